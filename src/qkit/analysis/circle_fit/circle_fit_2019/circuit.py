@@ -70,20 +70,28 @@ class circuit:
             1. - 2.*Ql / (complexQc * cls.n_ports * (1. + 2j*Ql*(f/fr-1.)))
         )
     
-    def autofit(self, calc_errors=True, fixed_delay=None, isolation=15):
+    def autofit(self, calc_errors=True, fixed_delay=None, isolation=15,
+                guesses=None):
         """
         Automatically calibrate data, normalize it and extract quality factors.
         If the autofit fails or the results look bad, please discuss with
         author.
+        
+        inputs:
+        - fixed_delay (opt.): Use this cable delay instead of fitting it
+        - guesses (opt.): fitresults of a similar trace, e.g. the neighboring
+                          point of a power or flux scan. Its delay, fr and Ql
+                          are used as starting values instead of estimating
+                          them from scratch.
         """
         
         if fixed_delay is None:
-            self._fit_delay()
+            self._fit_delay(guesses)
         else:
             self.delay = fixed_delay
             # Store result in dictionary (also for backwards-compatibility)
             self.fitresults["delay"] = self.delay
-        self._calibrate()
+        self._calibrate(guesses)
         self._normalize()
         self._extract_Qs(calc_errors=calc_errors)
         self.calc_fano_range(isolation=isolation)
@@ -97,20 +105,26 @@ class circuit:
             self.f_data, self.fr, self.Ql, self.Qc, self.phi
         )
     
-    def _fit_delay(self):
+    def _fit_delay(self, guesses=None):
         """
         Finds the cable delay by repeatedly centering the "circle" and fitting
-        the slope of the phase response.
+        the slope of the phase response. With guesses (fitresults of a similar
+        trace) the iteration starts at their delay, which usually needs no
+        further correction.
         """
         
-        # Translate data to origin
-        xc, yc, r0 = self._fit_circle(self.z_data_raw)
-        z_data = self.z_data_raw - complex(xc, yc)
-        # Find first estimate of parameters
-        fr, Ql, theta, self.delay = self._fit_phase(z_data)
-        
-        # Do not overreact (see end of for loop)
-        self.delay *= 0.05
+        if guesses is not None:
+            self.delay = guesses["delay"]
+            fr, Ql = guesses["fr"], guesses["Ql"]
+        else:
+            # Translate data to origin
+            xc, yc, r0 = self._fit_circle(self.z_data_raw)
+            z_data = self.z_data_raw - complex(xc, yc)
+            # Find first estimate of parameters
+            fr, Ql, theta, self.delay = self._fit_phase(z_data)
+            
+            # Do not overreact (see end of for loop)
+            self.delay *= 0.05
         
         # Iterate to improve result for delay
         for i in range(self.fit_delay_max_iterations):
@@ -153,10 +167,11 @@ class circuit:
         # Store result in dictionary (also for backwards-compatibility)
         self.fitresults["delay"] = self.delay
     
-    def _calibrate(self):
+    def _calibrate(self, guesses=None):
         """
         Finds the parameters for normalization of the scattering data. See
-        Sij for explanation of parameters.
+        Sij for explanation of parameters. With guesses (fitresults of a
+        similar trace) the phase fit starts at their fr and Ql.
         """
         
         # Correct for delay and translate circle to origin
@@ -167,7 +182,11 @@ class circuit:
         
         # Find off-resonant point by fitting offset phase
         # (centered circle corresponds to lossless resonator in reflection)
-        self.fr, self.Ql, theta, self.delay_remaining = self._fit_phase(z_data)
+        if guesses is not None:
+            guesses = (guesses["fr"], guesses["Ql"], 0.)
+        self.fr, self.Ql, theta, self.delay_remaining = self._fit_phase(
+            z_data, guesses
+        )
         self.theta = self._periodic_boundary(theta)
         beta = self._periodic_boundary(theta - np.pi)
         offrespoint = zc + self.r0*np.cos(beta) + 1j*self.r0*np.sin(beta)
@@ -39,9 +39,31 @@ class dict2obj(object):
                 setattr(self, a.replace(' ', '_'), dict2obj(b) if isinstance(b, dict) else b)
 
 
+class lazy2obj(object):
+    """
+    Object with the datasets of a group as attributes, each read into a numpy array on first access.
+    """
+    def __init__(self, group):
+        self.__dict__['_lazy'] = dict(group.__dict__)
+
+    def __getattr__(self, name):
+        lazy = self.__dict__['_lazy']
+        if name not in lazy:
+            raise AttributeError(name)
+        value = lazy.pop(name)
+        if hasattr(value, 'ds'):  # lazy_dataset
+            value = value[:]
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(dir(type(self))) | set(self.__dict__) | set(self.__dict__['_lazy']))
+
+
 class qData(object):
     """
     This is an analysis class for qkit measurements.
+    Datasets of the loaded file are available as attributes, they are read on first access.
     """
 
     def __init__(self):
@@ -81,6 +103,7 @@ class qData(object):
         >>> qd = qData()
         """
         # qkit.fid.update_file_db()  # update file database
+        self._lazy = {}  # datasets not read yet, see __getattr__
         self.uuid = self.path = self.df = None
         self.analysis = self.views = None
         self.settings = None
@@ -149,9 +172,12 @@ class qData(object):
                     self.measurement.load(qkit.fid.measure_db[self.uuid])
                 except:
                     self.measurement = dict2obj(json.loads(self.df.data.measurement[0], cls=QkitJSONDecoder))
+            elif key == 'comment':
+                self.comment = val
             else:
-                setattr(self, key, val[:])
-        self.analysis = dict2obj({key: val[:] for key, val in self.df.analysis.__dict__.items()})  # all entries in analysis
+                self.__dict__.pop(key, None)  # data of a previously loaded file
+                self._lazy[key] = val  # read on first access
+        self.analysis = lazy2obj(self.df.analysis)  # all entries in analysis, read on first access
         self.views = dict2obj({key: val for key, val in self.df['entry/views'].items()})  # all entries in views
         for name, view in self.views.__dict__.items():
             for a, b in self.views.__dict__[name].attrs.items():
@@ -159,6 +185,20 @@ class qData(object):
                     setattr(self.views.__dict__[name], a, b)  # set view attributes (e.g. xy_0) as attributes of qd.views.<view>
         self.m_type = self.measurement.measurement_type  # measurement type
 
+    def __getattr__(self, name):
+        """
+        Reads datasets of the loaded file on first access.
+        """
+        lazy = self.__dict__.get('_lazy', {})
+        if name not in lazy:
+            raise AttributeError("'{}' object has no attribute '{}'".format(type(self).__name__, name))
+        value = lazy.pop(name)[:]
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(dir(type(self))) | set(self.__dict__) | set(self.__dict__.get('_lazy', {})))
+
     def _get_xy_parameter(self, measurand):
         """
         Identifies eventual x- and y-parameters.
@@ -8,10 +8,269 @@ import qkit
 from qkit.storage import store
 from qkit.analysis.circle_fit import circuit
 from qkit.storage.hdf_constants import ds_types
+from qkit.core.lib.process_pool import get_pool, discard_pool, BrokenProcessPool
 from scipy.optimize import leastsq
 from scipy.ndimage import gaussian_filter1d
 from scipy.ndimage.filters import median_filter
 
+
+def lorentzian(f, f0, k, a, offs):
+    '''squared amplitude of a lorentzian with center f0, full width k, height a, and offset offs'''
+    return a / (1 + 4 * ((f - f0) / k) ** 2) + offs
+
+def lorentzian_start_values(frequency, amplitudes_sq):
+    '''
+    estimates the starting parameters [f0, k, a, offs] of a lorentzian fit from the squared amplitudes
+    amplitudes_sq can be a single trace or a 2dim array of traces (one per row), the latter
+    returns an array of shape (# traces, 4)
+    '''
+    frequency = np.asarray(frequency)
+    y = np.atleast_2d(amplitudes_sq)
+    n = y.shape[1]
+    nb = int(n*.1)
+    '''offset is calculated from the first and last 10% of the data to improve fitting on tight windows'''
+    s_offs = np.mean(np.concatenate((y[:, :nb], y[:, n-nb:]), axis=1), axis=1)
+
+    mean = np.mean(y, axis=1)
+    peak = np.abs(np.max(y, axis=1)-mean) > np.abs(np.min(y, axis=1)-mean) #peak or dip is expected
+    s_a = np.where(peak, np.abs(np.max(y, axis=1)-mean), -np.abs(np.min(y, axis=1)-mean))
+    s_f0 = frequency[np.where(peak, np.argmax(y, axis=1), np.argmin(y, axis=1))]
+
+    '''estimate peak/dip width from the first and last mid level crossing'''
+    mid = s_offs + .5*s_a #estimated mid region between base line and peak/dip
+    crossing = np.diff(np.sign(y-mid[:, np.newaxis]), axis=1) != 0
+    first = np.argmax(crossing, axis=1)
+    last = n-2-np.argmax(crossing[:, ::-1], axis=1)
+    s_k = np.where(np.sum(crossing, axis=1) > 1, frequency[last]-frequency[first],
+                   .15*(frequency[-1]-frequency[0])) #else try 15% of window
+
+    start = np.stack((s_f0, s_k, s_a, s_offs), axis=1)
+    if np.ndim(amplitudes_sq) == 1:
+        return list(start[0])
+    return start
+
+def fit_lorentzian_trace(frequency, amplitude):
+    '''
+    fits a lorentzian to the squared amplitudes of a single trace using scipy.leastsq
+    returns the parameters [f0, k, a, offs] and the reduced chi2 of the fit
+    '''
+    def residuals(p,x,y):
+        return y-lorentzian(x,*p)
+
+    amplitudes_sq = np.absolute(amplitude)**2
+    popt = leastsq(residuals,lorentzian_start_values(frequency,amplitudes_sq),args=(frequency,amplitudes_sq))[0]
+    chi2 = np.sum((lorentzian(frequency,*popt)-amplitudes_sq)**2) / (len(amplitudes_sq)-len(popt))
+    return popt, chi2
+
+
+def _lorentzian_jacobian(f, p):
+    '''derivatives of lorentzian() w.r.t. [f0, k, a, offs], one row per parameter'''
+    f0, k, a, offs = p
+    u = (f-f0)/k
+    d = 1 + 4*u**2
+    J = np.empty((4, len(f)))
+    J[0] = 8*a*u/(k*d**2)
+    J[1] = J[0]*u
+    J[2] = 1/d
+    J[3] = 1.
+    return J
+
+def skewed_lorentzian(f, A1, A2, A3, A4, fr, Qr):
+    '''squared amplitude of a skewed lorentzian with resonance frequency fr and loaded quality factor Qr'''
+    return A1+A2*(f-fr)+(A3+A4*(f-fr))/(1.+4.*Qr**2*((f-fr)/fr)**2)
+
+def _skewed_jacobian(f, p):
+    '''derivatives of skewed_lorentzian() w.r.t. [A1, A2, A3, A4, fr, Qr], one row per parameter'''
+    A1, A2, A3, A4, fr, Qr = p
+    x = f-fr
+    v = x/fr
+    d = 1.+4.*Qr**2*v**2
+    num = A3+A4*x
+    J = np.empty((6, len(f)))
+    J[0] = 1.
+    J[1] = x
+    J[2] = 1/d
+    J[3] = x*J[2]
+    J[4] = -A2-A4*J[2]+num*8*Qr**2*v*f/(fr**2*d**2)
+    J[5] = -num*8*Qr*v**2/d**2
+    return J
+
+def leastsq_traces(func, jac, p0, x, y, free=None):
+    '''
+    least squares fits of func(x, *p) to the traces y (one per row) one after another with scipy.leastsq,
+    the analytic derivatives jac are passed as Dfun
+
+    input:
+    func: model func(x, *p)
+    jac: jac(x, p) derivatives of func w.r.t. all parameters p, shape (# parameters, # x)
+    p0 (array): starting values, shape (# traces, # parameters)
+    x (array): common x values
+    y (array): data, shape (# traces, # x)
+    free (list, optional): indices of the parameters to be fitted, the others are kept at p0
+    returns the fitted parameters, shape (# traces, # parameters), NaN for traces that failed
+    '''
+    p = np.array(p0, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    free = np.arange(p.shape[1]) if free is None else np.asarray(free)
+    for i in range(len(p)):
+        pi, yi = p[i].copy(), y[i]
+        if not (np.all(np.isfinite(pi)) and np.all(np.isfinite(yi))):
+            p[i] = np.nan
+            continue
+
+        def residuals(q):
+            pi[free] = q
+            return func(x, *pi)-yi
+
+        def dfun(q):
+            pi[free] = q
+            return jac(x, pi)[free]
+
+        '''the result is kept also if leastsq stopped at maxfev, as in the former per-trace fits'''
+        try:
+            with np.errstate(all='ignore'):
+                q = leastsq(residuals, pi[free], Dfun=dfun, col_deriv=True)[0]
+        except Exception:
+            q = np.nan
+        pi[free] = q
+        p[i] = pi
+    p[~np.all(np.isfinite(p), axis=1)] = np.nan
+    return p
+
+def _fit_lorentzian_chunk(frequency, p0, amplitudes_sq):
+    return leastsq_traces(lorentzian, _lorentzian_jacobian, p0, frequency, amplitudes_sq)
+
+def _fit_skewed_lorentzian_chunk(frequency, p0, amplitudes_sq):
+    '''first background slope A2, A4 and Qr only, then all parameters'''
+    p0 = leastsq_traces(skewed_lorentzian, _skewed_jacobian, p0, frequency, amplitudes_sq, free=[1, 3, 5])
+    return leastsq_traces(skewed_lorentzian, _skewed_jacobian, p0, frequency, amplitudes_sq)
+
+# traces are distributed over worker processes in chunks of at least this many traces
+lorentzian_traces_per_process = 200
+
+def _fit_traces(fit, frequency, p0, amplitudes_sq, processes):
+    '''
+    runs fit(frequency, p0, amplitudes_sq) for all traces, in contiguous chunks over worker processes
+    if requested and there are enough traces, see qkit.core.lib.process_pool
+    '''
+    chunks = min(processes or 0, len(amplitudes_sq)//lorentzian_traces_per_process)
+    pool = get_pool('lorentzian_fit', chunks) if chunks >= 2 else None
+    if pool is None:
+        return fit(frequency, p0, amplitudes_sq)
+
+    index = np.array_split(np.arange(len(amplitudes_sq)), chunks)
+    futures = [pool.submit(fit, frequency, p0[i], amplitudes_sq[i]) for i in index]
+    popt = np.empty(np.shape(p0))
+    for i, future in zip(index, futures):
+        try:
+            popt[i] = future.result()
+        except BrokenProcessPool as e:
+            logging.error("Resonator: Lorentzian fit worker died (%s), fitting its traces here." % e)
+            discard_pool('lorentzian_fit')
+            popt[i] = fit(frequency, p0[i], amplitudes_sq[i])
+        except Exception as e:
+            logging.error("Resonator: Lorentzian fit worker failed (%s), fitting its traces here." % e)
+            popt[i] = fit(frequency, p0[i], amplitudes_sq[i])
+    return popt
+
+def fit_lorentzian_traces(frequency, amplitudes, processes=0):
+    '''
+    fits lorentzians to the squared amplitudes of all traces (one per row): the start values of all traces
+    are estimated at once, the fits run per trace (see leastsq_traces), over 'processes' worker processes if > 1
+    returns the parameters [f0, k, a, offs], shape (# traces, 4), and the reduced chi2 of the fits,
+    NaN for traces that could not be fitted
+    '''
+    amplitudes_sq = np.absolute(np.atleast_2d(amplitudes))**2
+    popt = _fit_traces(_fit_lorentzian_chunk, frequency, lorentzian_start_values(frequency, amplitudes_sq),
+                       amplitudes_sq, processes)
+    return popt, _batch_chi2(lorentzian, frequency, popt, amplitudes_sq)
+
+def fit_skewed_lorentzian_traces(frequency, amplitudes, processes=0):
+    '''
+    fits skewed lorentzians to the squared amplitudes of all traces (one per row)
+    in two steps as in Resonator.fit_skewed_lorentzian: first background slope A2, A4 and Qr only,
+    then all parameters [A1, A2, A3, A4, fr, Qr], over 'processes' worker processes if > 1
+    returns the parameters, shape (# traces, 6), and the reduced chi2 of the fits
+    '''
+    amplitudes_sq = np.absolute(np.atleast_2d(amplitudes))**2
+    p0 = np.zeros((len(amplitudes_sq), 6))
+    p0[:, 0] = np.minimum(amplitudes_sq[:, 0], amplitudes_sq[:, -1])
+    p0[:, 2] = -np.max(amplitudes_sq, axis=1)
+    p0[:, 4] = frequency[np.argmin(amplitudes_sq, axis=1)]
+    p0[:, 5] = 1e3
+    popt = _fit_traces(_fit_skewed_lorentzian_chunk, frequency, p0, amplitudes_sq, processes)
+    return popt, _batch_chi2(skewed_lorentzian, frequency, popt, amplitudes_sq)
+
+def skewed_estimate_Qi(popt):
+    '''
+    very clumsy numerical estimate of the Qi factor based on the +3dB method for the skewed
+    lorentzian parameters popt, shape (# traces, 6): the squared amplitude is evaluated on 1000
+    points between fr and fr+fr/Qr and the first point exceeding twice the value at fr is taken
+    '''
+    A1, A2, A3, A4, fr, Qr = [c[:, np.newaxis] for c in popt.T]
+    fs = fr+(fr/Qr)*np.linspace(0, 1, 1000)
+    with np.errstate(all='ignore'):
+        above = skewed_lorentzian(fs, A1, A2, A3, A4, fr, Qr) > 2*(A1+A3)
+        i = np.where(np.any(above, axis=1), np.argmax(above, axis=1), fs.shape[1]-1)
+        f = fs[np.arange(len(fs)), i]
+        return fr[:, 0]/(2*(f-fr[:, 0]))
+
+def _batch_chi2(func, x, popt, y):
+    return np.sum((func(x, *popt[:, :, np.newaxis].transpose(1, 0, 2))-y)**2, axis=1) / (y.shape[1]-popt.shape[1])
+
+
+# a warm-started circle fit is rejected if its reduced chi2 exceeds the one of the previous trace by this factor
+warm_start_max_chi2_ratio = 10.
+
+def _circle_fit_plausible(port, previous):
+    '''
+    checks the fitresults of a warm-started circle fit against the fitresults of the previous trace:
+    fr has to lie within the fitted frequencies, Ql has to be positive and the reduced chi2 must not
+    be much worse than the previous one
+    '''
+    fr, Ql, chi = [float(port.fitresults.get(key, np.nan)) for key in ("fr", "Ql", "chi_square")]
+    if not np.min(port.f_data) <= fr <= np.max(port.f_data) or not Ql > 0:
+        return False
+    chi_previous = float(previous.get("chi_square", np.nan))
+    if np.isfinite(chi_previous):
+        return np.isfinite(chi) and chi <= warm_start_max_chi2_ratio*chi_previous
+    return True
+
+def _fit_circle_traces(port, z_data, kwargs, warm_start):
+    '''
+    circle fits the traces z_data (one per row) one after another with the circuit port
+    with warm_start each fit starts from the delay, fr and Ql of the previous trace (circle_fit_version 2).
+    a warm-started fit that fails or does not pass _circle_fit_plausible is repeated from scratch and
+    the following trace starts from this result
+    returns a list of (fitresults, z_data_sim), None for traces that could not be fitted
+    '''
+    results = []
+    guesses = None
+    for z_data_raw in z_data:
+        port.z_data_raw = z_data_raw
+        try:
+            fitted = False
+            if guesses is not None:
+                try:
+                    port.fitresults = {}
+                    port.autofit(guesses=guesses, **kwargs)
+                    fitted = _circle_fit_plausible(port, guesses)
+                except Exception:
+                    pass
+            if not fitted:
+                if warm_start:
+                    # no results of a rejected warm start must remain
+                    port.fitresults = {}
+                port.autofit(**kwargs)
+        except Exception:
+            results.append(None)
+            guesses = None
+        else:
+            results.append((dict(port.fitresults), np.array(port.z_data_sim)))
+            if warm_start:
+                guesses = dict(port.fitresults)
+    return results
+
 class Resonator(object):
     '''
     Resonator class for fitting (live or after measurement) amplitude and phase data at multiple functions. The data is stored in .h5-files, having a NeXus compatible organization.
@@ -29,10 +288,22 @@ class Resonator(object):
         res.fit_lorentzian(fit_all=True,f_min=5.667e9,f_max=5.668e9)
         res.fit_fano(fit_all=True)
         res.fit_circle(fit_all=True,f_max=5.668e9)
+
+    live fitting without reading the data back from the file:
+        res=Resonator(filepath, threaded=True)
+        res.stream('lorentzian', frequency, x_co=power_coordinate, y_co=frequency_coordinate, ds_amp=amplitude, ds_pha=phase)
+        res.push_trace(amplitude_trace, phase_trace) # for every measured trace
     '''
+    # fit functions supported by stream()
+    stream_functions = ('lorentzian', 'skewed_lorentzian', 'circle_fit_reflection', 'circle_fit_notch', 'fano')
 
-    def __init__(self, hf_path):
-        self._hf = store.Data(hf_path)
+    def __init__(self, hf_path, threaded=None):
+        '''
+        hf_path (HDF5-filepath): Path to file containing datasets to be fitted
+        threaded (bool, optional): results are written by a background writer thread, see store.Data
+        '''
+        self._hf = store.Data(hf_path, threaded=threaded)
+        self._stream_fit = None
 
         self._first_circle = True
         self._first_lorentzian = True
@@ -41,6 +312,9 @@ class Resonator(object):
         
         self._do_prefilter_data = False
         self.pre_filter_params = []
+        # fit_all circle fits are distributed over worker processes in chunks of at least this many traces
+        self.circle_traces_per_process = 20
+        self._lorentzian_processes = 0
         self._debug = False
 
         # these ds_url should always be present in a resonator measurement
@@ -151,14 +425,31 @@ class Resonator(object):
             logging.info('No hf file kown yet!')
             return
 
+        self._amplitude = self._read_filled(self.ds_url_amp)
+        self._phase = self._read_filled(self.ds_url_pha)
+        self._frequency = np.array(self._hf[self.ds_url_freq],dtype=np.float64)
+        self._get_dataset_objects()
+        self._datasets_loaded = True
+
+    def _read_filled(self, ds_url):
+        '''
+        reads the written part of a dataset: preallocated (and not yet trimmed) datasets are NaN-padded
+        beyond the number of traces in their 'fill' attribute, so [-1] is the last trace actually measured
+        '''
+        ds = self._hf[ds_url]
+        fill = ds.attrs.get('fill', None)
+        if fill is not None and len(ds.shape) > 0 and 0 < fill[0] < ds.shape[0]:
+            return np.array(ds[:int(fill[0])], dtype=np.float64)
+        return np.array(ds, dtype=np.float64)
+
+    def _get_dataset_objects(self):
+        '''
+        gets the amplitude and phase datasets and their coordinates, without reading the data
+        '''
         self._ds_amp = self._hf.get_dataset(self.ds_url_amp)
         self._ds_pha = self._hf.get_dataset(self.ds_url_pha)
         self._ds_type = self._ds_amp.ds_type
 
-        self._amplitude = np.array(self._hf[self.ds_url_amp],dtype=np.float64)
-        self._phase = np.array(self._hf[self.ds_url_pha],dtype=np.float64)
-        self._frequency = np.array(self._hf[self.ds_url_freq],dtype=np.float64)
-
         try:
             self._x_co = self._hf.get_dataset(self._ds_amp.x_ds_url)
         except:
@@ -172,7 +463,6 @@ class Resonator(object):
             try: self._y_co = self._hf.get_dataset(self.ds_url_freq) # hardcode a std url
             except:
                 logging.warning('Unable to open any y_coordinate. Please set manually using \'set_y_coord()\'.')
-        self._datasets_loaded = True
 
     def _prepare_f_range(self,f_min,f_max):
         '''
@@ -180,7 +470,18 @@ class Resonator(object):
         f_min (float): lower boundary
         f_max (float): upper boundary
         '''
+        self._set_f_range(f_min,f_max)
 
+        '''
+        cut the data-arrays with f_min/f_max and fit_all information
+        '''
+        self._fit_amplitude = np.array(self._set_data_range(self._amplitude))
+        self._fit_phase = np.array(self._set_data_range(self._phase))
+
+    def _set_f_range(self,f_min,f_max):
+        '''
+        sets the frequency range to be fitted and creates the frequency coordinate of the fits
+        '''
         self._f_min = np.min(self._frequency)
         self._f_max = np.max(self._frequency)
 
@@ -198,25 +499,114 @@ class Resonator(object):
                     self._f_max = freq
                     break
 
-        '''
-        cut the data-arrays with f_min/f_max and fit_all information
-        '''
         self._fit_frequency = np.array(self._set_data_range(self._frequency))
-        self._fit_amplitude = np.array(self._set_data_range(self._amplitude))
-        self._fit_phase = np.array(self._set_data_range(self._phase))
-
         self._frequency_co = self._hf.add_coordinate('frequency',folder='analysis', unit = 'Hz')
         self._frequency_co.add(self._fit_frequency)
 
     def _update_data(self):
-        self._amplitude = np.array(self._hf[self.ds_url_amp],dtype=np.float64)
-        self._phase = np.array(self._hf[self.ds_url_pha],dtype=np.float64)
+        self._amplitude = self._read_filled(self.ds_url_amp)
+        self._phase = self._read_filled(self.ds_url_pha)
 
     def _get_starting_values(self):
         pass
+
+    def stream(self, fit_function, frequency, f_min=None, f_max=None, x_co=None, y_co=None, ds_amp=None, ds_pha=None):
+        '''
+        prepares the live fit of a running measurement, which passes every trace to push_trace() right after it is acquired.
+        the traces are fitted as they are, nothing is read back from the file, so the cost of a fit does not grow
+        with the number of traces already measured. with a Resonator(hf_path, threaded=True) also the results
+        are written by a background thread.
+
+        input:
+        fit_function (string): 'lorentzian', 'skewed_lorentzian', 'circle_fit_reflection', 'circle_fit_notch', or 'fano'
+        frequency (array): frequency values of the traces
+        f_min (float): lower boundary for data to be fitted (optional, default: None, results in min(frequency-array))
+        f_max (float): upper boundary for data to be fitted (optional, default: None, results in max(frequency-array))
+        x_co (hdf_dataset): x-coordinate of a 2dim measurement (optional, default: None, single trace)
+        y_co, ds_amp, ds_pha (hdf_dataset): frequency coordinate, amplitude and phase datasets of the measurement
+            to plot the fits in views. default: None, read from the file, which requires the measurement to have written data
+        '''
+        functions = {'lorentzian': self._do_fit_lorentzian,
+                     'skewed_lorentzian': self._do_fit_skewed_lorentzian,
+                     'circle_fit_reflection': self._do_fit_circle,
+                     'circle_fit_notch': self._do_fit_circle,
+                     'fano': self._do_fit_fano_traces}
+        if fit_function not in self.stream_functions:
+            raise ValueError("Resonator: Fit function '%s' can not be streamed, must be one of %s." % (fit_function, self.stream_functions))
+        if ds_amp is None:
+            self._get_dataset_objects()
+        else:
+            self._ds_amp, self._ds_pha = ds_amp, ds_pha
+            self._ds_type = ds_types['matrix'] if x_co is not None else ds_types['vector']
+            self._y_co = y_co
+        if x_co is not None:
+            self._x_co = x_co
+
+        self._fit_all = False
+        self._frequency = np.array(frequency, dtype=np.float64)
+        self._set_f_range(f_min, f_max)
+        self._stream_mask = (self._frequency >= self._f_min) & (self._frequency <= self._f_max)
+
+        if fit_function == 'lorentzian' and self._first_lorentzian:
+            self._prepare_lorentzian()
+            self._first_lorentzian = False
+        elif fit_function == 'skewed_lorentzian' and self._first_skewed_lorentzian:
+            self._prepare_skewed_lorentzian()
+            self._first_skewed_lorentzian = False
+        elif fit_function == 'fano' and self._first_fano:
+            self._prepare_fano()
+            self._first_fano = False
+        elif fit_function.startswith('circle_fit'):
+            self._circle_reflection = fit_function == 'circle_fit_reflection'
+            self._circle_notch = not self._circle_reflection
+            self._circle_processes = 0
+            self._circle_warm_start = False
+            self._circle_reference_trace = None
+            if self._first_circle:
+                self._prepare_circle()
+                self._first_circle = False
+            if self._circle_reflection:
+                self._circle_port = circuit.reflection_port(f_data = self._fit_frequency)
+            else:
+                self._circle_port = circuit.notch_port(f_data = self._fit_frequency)
+        self._stream_fit = functions[fit_function]
+
+    def push_trace(self, amplitude, phase=None):
+        '''
+        fits a single trace of the measurement prepared with stream() and appends the results
+
+        input:
+        amplitude (array): amplitude trace, as stored in the amplitude dataset
+        phase (array): phase trace, required for the circle fit (optional)
+        '''
+        if self._stream_fit is None:
+            raise RuntimeError("Resonator: Call stream() before pushing traces.")
+        self._fit_amplitude = np.array(amplitude, dtype=np.float64)[np.newaxis, self._stream_mask]
+        if phase is not None:
+            self._fit_phase = np.array(phase, dtype=np.float64)[np.newaxis, self._stream_mask]
+        else:
+            self._fit_phase = np.zeros_like(self._fit_amplitude)
+        self._stream_fit()
     
-    def fit_circle(self,reflection = False, notch = False, fit_all = False, f_min = None, f_max=None):
+    def fit_circle(self,reflection = False, notch = False, fit_all = False, f_min = None, f_max=None,
+                   processes = None, warm_start = False, reference_trace = None):
+        '''
+        circle fit for amp and pha data in the f_min-f_max frequency range, see _do_fit_circle
+
+        input:
+        reflection, notch (bool): resonator type, default: notch
+        fit_all (bool): True or False, default: False. Whole data (True) or only last "slice" (False) is fitted (optional)
+        f_min (float): lower boundary for data to be fitted (optional, default: None, results in min(frequency-array))
+        f_max (float): upper boundary for data to be fitted (optional, default: None, results in max(frequency-array))
+        processes (int): number of worker processes for fit_all, 0 fits in the kernel (optional, default: qkit.cfg['circle_fit_processes'] or 0)
+        warm_start (bool): start the fit of a trace from the results of the previous one, implausible results
+                           are refitted from scratch, default: False (circle_fit_version 2)
+        reference_trace (int): fit this trace first and use its delay for all traces (optional, circle_fit_version 2)
+        '''
         self._fit_all = fit_all
+        self._circle_processes = processes
+        self._circle_warm_start = warm_start
+        self._circle_reference_trace = reference_trace
         self._circle_reflection = reflection
         self._circle_notch = notch
         if not reflection and not notch:
@@ -245,41 +635,79 @@ class Resonator(object):
         circle fit for amp and pha data in the f_min-f_max frequency range
         fit parameter, errors, and generated amp/pha data are stored in the hdf-file
 
+        with fit_all, the traces can be distributed in contiguous chunks over a pool of worker processes.
+        for circle_fit_version 2, each fit can be warm-started from the previous trace of its chunk and
+        the delay can be fixed to the one of a reference trace.
+
         input:
         fit_all (bool): True or False, default: False. Whole data (True) or only last "slice" (False) is fitted (optional)
         '''
 
         self._get_data_circle()
-        trace = 0
-        self.debug("circle fit:")
-        for z_data_raw in self._z_data_raw:
-            
-            z_data_raw.real = self._pre_filter_data(z_data_raw.real)
-            z_data_raw.imag = self._pre_filter_data(z_data_raw.imag)
-            self.debug("fitting trace: "+str(trace))
-            self._circle_port.z_data_raw = z_data_raw
-            
-            try:
-                self._circle_port.autofit()
-            except:
-                err=np.array([np.nan for f in self._fit_frequency])
-                self._circ_amp_gen.append(err)
-                self._circ_pha_gen.append(err)
-                self._circ_real_gen.append(err)
-                self._circ_imag_gen.append(err)
-
-                for key in iter(self._results):
-                    self._results[str(key)].append(np.nan)
-
+        z_data = self._z_data_raw
+        if self._do_prefilter_data:
+            z_data = z_data.copy()
+            for z_data_raw in z_data:
+                z_data_raw.real = self._pre_filter_data(z_data_raw.real)
+                z_data_raw.imag = self._pre_filter_data(z_data_raw.imag)
+
+        kwargs = {}
+        warm_start = self._circle_warm_start
+        if qkit.cfg.get("circle_fit_version", 1) != 2:
+            # the classic circle fit does not take starting values
+            warm_start = False
+            if self._circle_reference_trace is not None:
+                logging.warning("Resonator: A fixed delay from a reference trace requires circle_fit_version 2.")
+        elif self._circle_reference_trace is not None and len(z_data) > 1:
+            ref = _fit_circle_traces(self._circle_port, z_data[[self._circle_reference_trace]], {}, False)[0]
+            if ref is None:
+                logging.warning("Resonator: Circle fit of reference trace %i failed, the delay is fitted for every trace." % self._circle_reference_trace)
             else:
-                self._circ_amp_gen.append(np.absolute(self._circle_port.z_data_sim))
-                self._circ_pha_gen.append(np.angle(self._circle_port.z_data_sim))
-                self._circ_real_gen.append(np.real(self._circle_port.z_data_sim))
-                self._circ_imag_gen.append(np.imag(self._circle_port.z_data_sim))
-
-                for key in iter(self._results):
-                    self._results[str(key)].append(float(self._circle_port.fitresults[str(key)]))
-            trace+=1
+                kwargs['fixed_delay'] = ref[0]["delay"]
+                self.debug("circle fit: delay fixed to %g s" % kwargs['fixed_delay'])
+
+        results = self._fit_circle_traces(z_data, kwargs, warm_start)
+        self.debug("circle fit: %i traces, %i failed" % (len(results), results.count(None)))
+
+        z_data_sim = np.full(z_data.shape, np.nan, dtype=np.complex128)
+        for i, result in enumerate(results):
+            if result is not None:
+                z_data_sim[i] = result[1]
+        self._append_traces(self._circ_amp_gen, np.absolute(z_data_sim))
+        self._append_traces(self._circ_pha_gen, np.angle(z_data_sim))
+        self._append_traces(self._circ_real_gen, np.real(z_data_sim))
+        self._append_traces(self._circ_imag_gen, np.imag(z_data_sim))
+        for key in iter(self._results):
+            self._append_traces(self._results[str(key)],
+                                np.array([np.nan if result is None else float(result[0].get(str(key), np.nan)) for result in results]))
+
+    def _fit_circle_traces(self, z_data, kwargs, warm_start):
+        '''
+        runs the circle fits of all traces, in worker processes if requested and there are enough traces,
+        see qkit.core.lib.process_pool
+        '''
+        processes = self._circle_processes
+        if processes is None:
+            processes = qkit.cfg.get('circle_fit_processes', 0)
+        chunks = min(processes, len(z_data)//self.circle_traces_per_process)
+        pool = get_pool('circle_fit', chunks) if chunks >= 2 else None
+        if pool is None:
+            return _fit_circle_traces(self._circle_port, z_data, kwargs, warm_start)
+
+        z_chunks = np.array_split(z_data, chunks)
+        futures = [pool.submit(_fit_circle_traces, self._circle_port, z, kwargs, warm_start) for z in z_chunks]
+        results = []
+        for z, future in zip(z_chunks, futures):
+            try:
+                results += future.result()
+            except BrokenProcessPool as e:
+                logging.error("Resonator: Circle fit worker died (%s), fitting its traces here." % e)
+                discard_pool('circle_fit')
+                results += _fit_circle_traces(self._circle_port, z, kwargs, warm_start)
+            except Exception as e:
+                logging.error("Resonator: Circle fit worker failed (%s), fitting its traces here." % e)
+                results += _fit_circle_traces(self._circle_port, z, kwargs, warm_start)
+        return results
 
     def _prepare_circle(self):
         '''
@@ -364,11 +792,9 @@ class Resonator(object):
             self._data_imag_gen.append(self._z_data_raw[0].imag)
 
         if self._fit_all:
-            self._z_data_raw = np.empty((self._fit_amplitude.shape), dtype=np.complex64)
-            for i,a in enumerate(self._fit_amplitude):
-                self._z_data_raw[i] = self._fit_amplitude[i]*np.exp(1j*self._fit_phase[i])
-                self._data_real_gen.append(self._z_data_raw[i].real)
-                self._data_imag_gen.append(self._z_data_raw[i].imag)
+            self._z_data_raw = np.array(np.atleast_2d(self._fit_amplitude)*np.exp(1j*np.atleast_2d(self._fit_phase)),dtype=np.complex64)
+            self._append_traces(self._data_real_gen, self._z_data_raw.real)
+            self._append_traces(self._data_imag_gen, self._z_data_raw.imag)
 
     def _get_last_amp_trace(self):
         tmp_amp = np.empty((1,self._fit_frequency.shape[0]))
@@ -379,23 +805,20 @@ class Resonator(object):
         self._fit_amplitude = np.empty((1,self._fit_frequency.shape[0]))
         self._fit_amplitude[0] = tmp_amp[0]
 
-    def fit_lorentzian(self,fit_all = False,f_min=None,f_max=None,pre_filter_data=None):
+    def fit_lorentzian(self,fit_all = False,f_min=None,f_max=None,pre_filter_data=None, processes = None):
         '''
         lorentzian fit for amp data in the f_min-f_max frequency range
-        squared amps are fitted at lorentzian using scipy.leastsq
+        the start values of all traces are estimated at once, each trace is fitted with scipy.leastsq (see fit_lorentzian_traces)
         fit parameter, chi2, and generated amp are stored in the hdf-file
 
         input:
         fit_all (bool): True or False, default: False. Whole data (True) or only last "slice" (False) is fitted (optional)
         f_min (float): lower boundary for data to be fitted (optional, default: None, results in min(frequency-array))
         f_max (float): upper boundary for data to be fitted (optional, default: None, results in max(frequency-array))
+        processes (int): number of worker processes for fit_all, 0 fits in the kernel (optional, default: qkit.cfg['lorentzian_fit_processes'] or 0)
         '''
-        def residuals(p,x,y):
-            f0,k,a,offs=p
-            err = y-(a/(1+4*((x-f0)/k)**2)+offs)
-            return err
-        
         self._fit_all = fit_all
+        self._lorentzian_processes = processes
 
         if not self._datasets_loaded:
             self._get_datasets()
@@ -413,54 +836,36 @@ class Resonator(object):
         '''
         if not self._fit_all:
             self._get_last_amp_trace()
+        self._do_fit_lorentzian()
 
-        for amplitudes in self._fit_amplitude:
-            amplitudes = np.absolute(amplitudes)
-            amplitudes_sq = amplitudes**2
-            '''extract starting parameter for lorentzian from data'''
-            s_offs = np.mean(np.array([amplitudes_sq[:int(np.size(amplitudes_sq)*.1)], amplitudes_sq[int(np.size(amplitudes_sq)-int(np.size(amplitudes_sq)*.1)):]]))
-            '''offset is calculated from the first and last 10% of the data to improve fitting on tight windows'''
-
-            if np.abs(np.max(amplitudes_sq)-np.mean(amplitudes_sq)) > np.abs(np.min(amplitudes_sq)-np.mean(amplitudes_sq)):
-                '''peak is expected'''
-                s_a = np.abs((np.max(amplitudes_sq)-np.mean(amplitudes_sq)))
-                s_f0 = self._fit_frequency[np.argmax(amplitudes_sq)]
-            else:
-                '''dip is expected'''
-                s_a = -np.abs((np.min(amplitudes_sq)-np.mean(amplitudes_sq)))
-                s_f0 = self._fit_frequency[np.argmin(amplitudes_sq)]
-
-            '''estimate peak/dip width'''
-            mid = s_offs + .5*s_a #estimated mid region between base line and peak/dip
-            m = [] #mid points
-            for i in range(len(amplitudes_sq)-1):
-                if np.sign(amplitudes_sq[i]-mid) != np.sign(amplitudes_sq[i+1]-mid):#mid level crossing
-                    m.append(i)
-            if len(m)>1:
-                s_k = self._fit_frequency[m[-1]]-self._fit_frequency[m[0]]
-            else:
-                s_k = .15*(self._fit_frequency[-1]-self._fit_frequency[0]) #try 15% of window
-            p0=[s_f0, s_k, s_a, s_offs]
-            try:
-                fit = leastsq(residuals,p0,args=(self._fit_frequency,amplitudes_sq))
-            except:
-                self._lrnz_amp_gen.append(np.array([np.nan for f in self._fit_frequency]))
-                self._lrnz_f0.append(np.nan)
-                self._lrnz_k.append(np.nan)
-                self._lrnz_a.append(np.nan)
-                self._lrnz_offs.append(np.nan)
-                self._lrnz_Ql.append(np.nan)
-                self._lrnz_chi2_fit.append(np.nan)
-            else:
-                popt=fit[0]
-                chi2 = self._lorentzian_fit_chi2(popt,amplitudes_sq)
-                self._lrnz_amp_gen.append(np.sqrt(np.array(self._lorentzian_from_fit(popt))))
-                self._lrnz_f0.append(float(popt[0]))
-                self._lrnz_k.append(float(np.fabs(float(popt[1]))))
-                self._lrnz_a.append(float(popt[2]))
-                self._lrnz_offs.append(float(popt[3]))
-                self._lrnz_Ql.append(float(float(popt[0])/np.fabs(float(popt[1]))))
-                self._lrnz_chi2_fit.append(float(chi2))
+    def _do_fit_lorentzian(self):
+        '''
+        fits all traces in self._fit_amplitude and appends the results
+        '''
+        popt, chi2 = fit_lorentzian_traces(self._fit_frequency, self._fit_amplitude, self._get_lorentzian_processes())
+        self.debug("lorentzian fit: %i traces, %i failed" % (len(chi2), np.sum(~np.isfinite(chi2))))
+
+        self._append_traces(self._lrnz_amp_gen, np.sqrt(lorentzian(self._fit_frequency, *popt[:, :, np.newaxis].transpose(1, 0, 2))))
+        self._append_traces(self._lrnz_f0, popt[:, 0])
+        self._append_traces(self._lrnz_k, np.fabs(popt[:, 1]))
+        self._append_traces(self._lrnz_a, popt[:, 2])
+        self._append_traces(self._lrnz_offs, popt[:, 3])
+        self._append_traces(self._lrnz_Ql, popt[:, 0]/np.fabs(popt[:, 1]))
+        self._append_traces(self._lrnz_chi2_fit, chi2)
+
+    def _get_lorentzian_processes(self):
+        if self._lorentzian_processes is None:
+            return qkit.cfg.get('lorentzian_fit_processes', 0)
+        return self._lorentzian_processes
+
+    def _append_traces(self, ds, data):
+        '''
+        writes the results of all fitted traces to ds with a single write
+        '''
+        if len(data) == 1:
+            ds.append(data[0])
+        else:
+            ds.append_block(data)
 
     def _prepare_lorentzian(self):
         '''
@@ -490,33 +895,26 @@ class Resonator(object):
         lrnz_view.add(x=self._frequency_co, y=self._lrnz_amp_gen)
 
     def _lorentzian_from_fit(self,fit):
-        return fit[2] / (1 + (4*((self._fit_frequency-fit[0])/fit[1]) ** 2)) + fit[3]
+        return lorentzian(self._fit_frequency, *fit)
 
     def _lorentzian_fit_chi2(self, fit, amplitudes_sq):
         chi2 = np.sum((self._lorentzian_from_fit(fit)-amplitudes_sq)**2) / (len(amplitudes_sq)-len(fit))
         return chi2
 
-    def fit_skewed_lorentzian(self, fit_all = False, f_min=None, f_max=None,pre_filter_data=None):
+    def fit_skewed_lorentzian(self, fit_all = False, f_min=None, f_max=None,pre_filter_data=None, processes = None):
         '''
         skewed lorentzian fit for amp data in the f_min-f_max frequency range
-        squared amps are fitted at skewed lorentzian using scipy.leastsq
+        each trace is fitted with scipy.leastsq (see fit_skewed_lorentzian_traces)
         fit parameter, chi2, and generated amp are stored in the hdf-file
 
         input:
         fit_all (bool): True or False, default: False. Whole data (True) or only last "slice" (False) is fitted (optional)
         f_min (float): lower boundary for data to be fitted (optional, default: None, results in min(frequency-array))
         f_max (float): upper boundary for data to be fitted (optional, default: None, results in max(frequency-array))
+        processes (int): number of worker processes for fit_all, 0 fits in the kernel (optional, default: qkit.cfg['lorentzian_fit_processes'] or 0)
         '''
-        def residuals(p,x,y):
-            A2, A4, Qr = p
-            err = y -(A1a+A2*(x-fra)+(A3a+A4*(x-fra))/(1.+4.*Qr**2*((x-fra)/fra)**2))
-            return err
-        def residuals2(p,x,y):
-            A1, A2, A3, A4, fr, Qr = p
-            err = y -(A1+A2*(x-fr)+(A3+A4*(x-fr))/(1.+4.*Qr**2*((x-fr)/fr)**2))
-            return err
-
         self._fit_all = fit_all
+        self._lorentzian_processes = processes
 
         if not self._datasets_loaded:
             self._get_datasets()
@@ -534,51 +932,27 @@ class Resonator(object):
         '''
         if not self._fit_all:
             self._get_last_amp_trace()
+        self._do_fit_skewed_lorentzian()
 
-        for amplitudes in self._fit_amplitude:
-            "fits a skewed lorenzian to reflection amplitudes of a resonator"
-            # prefilter the data
-            amplitudes = self._pre_filter_data(amplitudes)
-
-            amplitudes = np.absolute(amplitudes)
-            amplitudes_sq = amplitudes**2
-
-            A1a = np.minimum(amplitudes_sq[0],amplitudes_sq[-1])
-            A3a = -np.max(amplitudes_sq)
-            fra = self._fit_frequency[np.argmin(amplitudes_sq)]
-
-            p0 = [0., 0., 1e3]
-
-            try:
-                p_final = leastsq(residuals,p0,args=(self._fit_frequency,amplitudes_sq))
-                A2a, A4a, Qra = p_final[0]
-
-                p0 = [A1a, A2a , A3a, A4a, fra, Qra]
-                p_final = leastsq(residuals2,p0,args=(self._fit_frequency,amplitudes_sq))
-                popt=p_final[0]
-            except:
-                self._skwd_amp_gen.append(np.array([np.nan for f in self._fit_frequency]))
-                self._skwd_f0.append(np.nan)
-                self._skwd_a1.append(np.nan)
-                self._skwd_a2.append(np.nan)
-                self._skwd_a3.append(np.nan)
-                self._skwd_a4.append(np.nan)
-                self._skwd_Qr.append(np.nan)
-                self._skwd_chi2_fit.append(np.nan)
-            else:
-                chi2 = self._skewed_fit_chi2(popt,amplitudes_sq)
-                amp_gen = np.sqrt(np.array(self._skewed_from_fit(popt)))
-
-                self._skwd_amp_gen.append(amp_gen)
-                self._skwd_f0.append(float(popt[4]))
-                self._skwd_a1.append(float(popt[0]))
-                self._skwd_a2.append(float(popt[1]))
-                self._skwd_a3.append(float(popt[2]))
-                self._skwd_a4.append(float(popt[3]))
-                self._skwd_Qr.append(float(popt[5]))
-                self._skwd_chi2_fit.append(float(chi2))
-
-            self._skwd_Qi.append(self._skewed_estimate_Qi(popt))
+    def _do_fit_skewed_lorentzian(self):
+        '''
+        fits all traces in self._fit_amplitude and appends the results
+        '''
+        amplitudes = self._fit_amplitude
+        if self._do_prefilter_data:
+            amplitudes = np.array([self._pre_filter_data(a) for a in amplitudes])
+        popt, chi2 = fit_skewed_lorentzian_traces(self._fit_frequency, amplitudes, self._get_lorentzian_processes())
+        self.debug("skewed lorentzian fit: %i traces, %i failed" % (len(chi2), np.sum(~np.isfinite(chi2))))
+
+        self._append_traces(self._skwd_amp_gen, np.sqrt(skewed_lorentzian(self._fit_frequency, *popt[:, :, np.newaxis].transpose(1, 0, 2))))
+        self._append_traces(self._skwd_f0, popt[:, 4])
+        self._append_traces(self._skwd_a1, popt[:, 0])
+        self._append_traces(self._skwd_a2, popt[:, 1])
+        self._append_traces(self._skwd_a3, popt[:, 2])
+        self._append_traces(self._skwd_a4, popt[:, 3])
+        self._append_traces(self._skwd_Qr, popt[:, 5])
+        self._append_traces(self._skwd_chi2_fit, chi2)
+        self._append_traces(self._skwd_Qi, skewed_estimate_Qi(popt))
 
     def _prepare_skewed_lorentzian(self):
         '''
@@ -616,33 +990,10 @@ class Resonator(object):
         return chi2
 
     def _skewed_from_fit(self,p):
-        A1, A2, A3, A4, fr, Qr = p
-        return A1+A2*(self._fit_frequency-fr)+(A3+A4*(self._fit_frequency-fr))/(1.+4.*Qr**2*((self._fit_frequency-fr)/fr)**2)
+        return skewed_lorentzian(self._fit_frequency, *p)
 
     def _skewed_estimate_Qi(self,p):
-
-        #this is a very clumsy numerical estimate of the Qi factor based on the +3dB method.#
-        A1, A2, A3, A4, fr, Qr = p
-        def skewed_from_fit(p,f):
-            A1, A2, A3, A4, fr, Qr = p
-            return A1+A2*(f-fr)+(A3+A4*(f-fr))/(1.+4.*Qr**2*((f-fr)/fr)**2)
-
-        #df = fr/(Qr*10000)
-        fmax = fr+fr/Qr
-        fs = np.linspace(fr,fmax,1000,dtype=np.float64)
-        Amin = skewed_from_fit(p,fr)
-        #print("---")
-        #print("Amin, 2*Amin",Amin, 2*Amin)
-
-        for f in fs:
-            A = skewed_from_fit(p,f)
-            #print(A, f)
-            if A>2*Amin:
-                break
-        qi = fr/(2*(f-fr))
-        #print("f, A, fr/2*(f-fr)", f,A, qi)
-
-        return float(qi)
+        return float(skewed_estimate_Qi(np.atleast_2d(p))[0])
 
     def _prepare_fano(self):
         "create the datasets for the fano fit in the hdf-file"
@@ -699,7 +1050,12 @@ class Resonator(object):
         '''
         if not self._fit_all:
             self._get_last_amp_trace()
+        self._do_fit_fano_traces()
 
+    def _do_fit_fano_traces(self):
+        '''
+        fits all traces in self._fit_amplitude one by one and appends the results
+        '''
         for amplitudes in self._fit_amplitude:
             amplitude_sq = (np.absolute(amplitudes))**2
             try:
@@ -53,6 +53,47 @@ cfg['datafolder_structure'] = 2
 #fid_scan_hdf     = False
 ## should the viewer object be created on startup (slow, needs pandas) ?
 #fid_init_viewer  = True
+## the fid keeps an index in logdir/fid_index.sqlite. Directories with unchanged
+## mtime are not listed again on startup (files modified in place are then only
+## found by qkit.fid.recreate_database()):
+#fid_skip_unchanged_dirs = True
+## number of processes opening hdf files with fid_scan_hdf (default: number of CPUs):
+#fid_scan_workers = 4
+## watch the datadir (inotify, polling elsewhere) and add new files live:
+#fid_watch_datadir = False
+## seconds a file has to be unchanged before it is added and polling period:
+#fid_watch_debounce = 2
+#fid_watch_interval = 10
+## always poll (network filesystems like NFS/SMB are detected and polled anyway):
+#fid_watch_polling = False
+## the breadcrumb journal (.<node>.breadcrumb) is merged into the sorted
+## breadcrumb file on startup when it has more lines than:
+#breadcrumb_compact_lines = 10000
+
+##
+## Write-behind buffer for hdf datasets (opt-in, also per Data/dataset via 'buffered'):
+## appended traces are kept in memory and written in blocks after
+## 'h5_flush_interval' seconds or 'h5_flush_bytes' pending bytes.
+#cfg['h5_buffered'] = False
+#cfg['h5_flush_interval'] = 1.  # s
+#cfg['h5_flush_bytes'] = 16*1024**2
+## create value datasets at the final shape given by their coordinates (opt-in,
+## also per Data/dataset via 'preallocate'), progress is tracked in 'fill'
+#cfg['h5_preallocate'] = False
+## single-writer/multiple-reader access of measurement files (opt-in, also per
+## measurement via 'swmr'): qviewkit follows the data without reopening the file
+#cfg['h5_swmr'] = False
+## write appended data in a background thread (opt-in, also per Data via 'threaded')
+#cfg['h5_threaded'] = False
+#cfg['h5_writer_queue_size'] = 100
+## target size of a chunk for matrix and box datasets: a chunk holds as many whole
+## traces as fit, limited by the lengths of the outer coordinates
+#cfg['h5_chunk_bytes'] = 512*1024
+## store level-of-detail pyramids (block means) of value matrices larger than
+## 'h5_lod_min_size' in analysis0 on close, used by qviewkit for large plots
+#cfg['h5_lod_pyramid'] = False
+#cfg['h5_lod_factor'] = 4
+#cfg['h5_lod_min_size'] = 512
 
 ##
 ## Load (py) visa (Virtual Instrument Software Architecture) lib 
@@ -98,10 +139,39 @@ cfg['stdout_log_level'] = 'WARNING'
 #cfg['visa_backend'] = '@py' # Use pyvisa-py
 #cfg['visa_backend'] = '' # (default) use NI-VISA if available, otherwise pyvisa-py
 
+##
+## Pipelined VNA spectroscopy: the hdf appends and live fits of a trace are done
+## in a worker thread while the VNA sweeps the next one. The per-stage timings
+## of a scan are printed at its end and available as spectrum.timings
+#cfg['spectroscopy_pipelined'] = False
+#cfg['measure_pipeline_depth'] = 4 # queued jobs before the measurement waits
+
+##
+## Resonator circle fits with fit_all are distributed over this many worker
+## processes, 0 (default) fits all traces in the kernel. As for
+## save_plots_processes, the measurement script needs an
+## "if __name__ == '__main__':" guard.
+#cfg['circle_fit_processes'] = 0
+## the same for the (skewed) lorentzian fits with fit_all
+#cfg['lorentzian_fit_processes'] = 0
+
+##
+## Averaged transport sweeps (set_average): the intermediate averages are
+## written to the h5 file at most every this many seconds, the final one always
+#cfg['transport_average_write_interval'] = 1
+
 ##
 ## Make png files at the end of the measurement
 ##
 #cfg['save_png'] = True
+## the plots are rendered in the measurement kernel, > 0 renders them in a pool
+## of worker processes (the measurement script needs an
+## "if __name__ == '__main__':" guard, otherwise it is rendered in the kernel).
+## Datasets whose content did not change since the last export are skipped.
+## Batch export of a run folder:
+##     python -m qkit.gui.plot.plot -d <folder>
+#cfg['save_plots_processes'] = 0
+#cfg['save_plots_incremental'] = True
 
 ##
 ## QT related options
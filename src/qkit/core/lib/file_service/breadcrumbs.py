@@ -15,6 +15,15 @@ The file contents are untrusted. (Who knows where they come from.) They thus may
 UUID=rel_path\n
 
 The UUID is 6 symbols long. It is followed by an `=` symbol. The rest of the line is the relative path.
+Lines not following this format are ignored.
+
+Each machine keeps two files:
+- `.{Node-UUID}.breadcrumb` is an append-only journal. Entries are only appended if the path of a UUID is new or changed.
+- `.{Node-UUID}.sorted.breadcrumb` holds the same format, sorted by UUID with one line per UUID. When the journal
+  exceeds `qkit.cfg['breadcrumb_compact_lines']` lines (default 10000), it is merged into the sorted file on startup.
+
+A single UUID is resolved with `find_uuid` by a binary search in the sorted files (seeking in the file, only a few
+lines are read) and a scan of the short journals, without loading every breadcrumb.
 """
 
 from pathlib import Path
@@ -23,6 +32,8 @@ import os
 import itertools
 
 FILE_END = ".breadcrumb"
+SORTED_END = ".sorted" + FILE_END
+UUID_LENGTH = 6
 
 def derive_breadcrumb_filename() -> Path:
     """
@@ -33,39 +44,136 @@ def derive_breadcrumb_filename() -> Path:
     filename = f".{node:x}{FILE_END}"
     return Path(qkit.cfg['datadir']) / filename
 
+def sorted_breadcrumb_filename(journal_path: Path) -> Path:
+    return journal_path.with_name(journal_path.name[:-len(FILE_END)] + SORTED_END)
+
+def _parse_line(line: str):
+    """
+    Returns (uuid, rel_path) of a valid breadcrumb line, None otherwise.
+    """
+    line = line.rstrip("\r\n")
+    if len(line) <= UUID_LENGTH + 1 or line[UUID_LENGTH] != '=' or not line[:UUID_LENGTH].isalnum():
+        return None
+    return line[:UUID_LENGTH], line[UUID_LENGTH + 1:].strip()
+
+def _format_line(uuid: str, rel_path) -> str:
+    rel_path = str(rel_path)
+    if len(uuid) != UUID_LENGTH or not uuid.isalnum() or "\n" in rel_path or "\r" in rel_path:
+        raise ValueError(f"Can not create a breadcrumb for '{uuid}' -> '{rel_path}'.")
+    return f"{uuid}={rel_path}\n"
+
 class BreadCrumbCreator():
     """
-    Manages creating the initial bread crumb file and updating it after each measurement.
+    Manages the bread crumb files of this machine and updates them after each measurement.
     """
 
     def __init__(self) -> None:
         self._breadcrumb_path = derive_breadcrumb_filename()
-        if self._breadcrumb_path.exists():
-            os.remove(self._breadcrumb_path)
-        self._breadcrumb_file = open(self._breadcrumb_path, mode="w")
+        self._sorted_path = sorted_breadcrumb_filename(self._breadcrumb_path)
+        self._known: dict[str, str] = {}
+        journal_lines = 0
+        for path in (self._sorted_path, self._breadcrumb_path):
+            if path.exists():
+                for uuid, rel_path in _read_entries(path):
+                    self._known[uuid] = rel_path
+                    journal_lines += path == self._breadcrumb_path
+        if journal_lines > qkit.cfg.get('breadcrumb_compact_lines', 10000):
+            self.compact()
+        self._breadcrumb_file = open(self._breadcrumb_path, mode="a", encoding="utf-8")
 
     def append_entry(self, uuid: str, path: Path|str):
-        rel_path = Path(path).relative_to(self._breadcrumb_path.parent)
-        print(f"{uuid[:6]}={rel_path}", file=self._breadcrumb_file, flush=True) # Fails if uuid is not 6 digits
+        rel_path = str(Path(path).relative_to(self._breadcrumb_path.parent))
+        uuid = uuid[:UUID_LENGTH]
+        if self._known.get(uuid) == rel_path:
+            return
+        self._breadcrumb_file.write(_format_line(uuid, rel_path))
+        self._breadcrumb_file.flush()
+        self._known[uuid] = rel_path
+
+    def compact(self):
+        """
+        Writes all known entries sorted into the sorted breadcrumb file and empties the journal.
+        """
+        tmp_path = self._sorted_path.with_name(self._sorted_path.name + ".tmp")
+        with open(tmp_path, mode="w", encoding="utf-8") as f:
+            f.writelines(_format_line(uuid, self._known[uuid]) for uuid in sorted(self._known))
+        os.replace(tmp_path, self._sorted_path)
+        open(self._breadcrumb_path, mode="w").close()
+
+def _read_entries(path: Path):
+    with open(path, mode="r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            entry = _parse_line(line)
+            if entry is not None:
+                yield entry
 
 def read_breadcrumb(path: Path) -> dict[str, Path]:
     """
     Read a breadcrumb file.
     """
     breadcrumb_parent = path.parent
-    uuid_map: dict[str, Path] = {}
-    with open(path, mode="r") as f:
-        for line in f.readlines():
-            if line[6] == '=': # Valid format
-                uuid = line[:6]
-                rel_path = line[7:].strip()
-                uuid_map[uuid] = breadcrumb_parent / rel_path
-    return uuid_map
+    return {uuid: breadcrumb_parent / rel_path for uuid, rel_path in _read_entries(path)}
+
+def _breadcrumb_files(dir: Path) -> list[Path]:
+    # sorted files first, the journals hold the newer entries
+    breadcrumbs = [f for f in dir.iterdir() if f.is_file() and f.name.endswith(FILE_END)]
+    return sorted(breadcrumbs, key=lambda f: not f.name.endswith(SORTED_END))
 
 def read_breadcrumbs(dir: Path) -> dict[str, Path]:
     assert dir.is_dir(), "Directory must be a directory!"
-    breadcrumbs = [f for f in dir.iterdir() if f.is_file and f.name.endswith(FILE_END)]
-    return dict(itertools.chain.from_iterable(map(dict.items, map(read_breadcrumb, breadcrumbs))))
+    return dict(itertools.chain.from_iterable(map(dict.items, map(read_breadcrumb, _breadcrumb_files(dir)))))
+
+def _search_sorted(path: Path, uuid: str):
+    """
+    Binary search for uuid in a sorted breadcrumb file, returns rel_path or None.
+    Works on byte offsets: lo is always left of the first line with a key >= uuid.
+    """
+    key = uuid.encode("ascii")
+    with open(path, mode="rb") as f:
+        lo, hi = 0, os.fstat(f.fileno()).st_size
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            f.seek(mid)
+            f.readline()
+            line = f.readline()
+            if not line or line[:UUID_LENGTH] >= key:
+                hi = mid
+            else:
+                lo = mid
+        f.seek(lo)
+        if lo > 0:
+            f.readline()
+        for line in f:
+            if line[:UUID_LENGTH] > key:
+                break
+            entry = _parse_line(line.decode("utf-8", errors="replace"))
+            if entry is not None and entry[0] == uuid:
+                return entry[1]
+    return None
+
+def find_uuid(uuid: str, dir: Path|str|None = None) -> Path|None:
+    """
+    Resolves a UUID with the breadcrumbs of all machines in dir (default: datadir).
+    Paths which exist are preferred, otherwise the last found path is returned.
+    """
+    dir = Path(dir if dir is not None else qkit.cfg['datadir'])
+    uuid = uuid[:UUID_LENGTH]
+    if len(uuid) != UUID_LENGTH or not uuid.isalnum() or not dir.is_dir():
+        return None
+    found = None
+    for path in _breadcrumb_files(dir):
+        if path.name.endswith(SORTED_END):
+            rel_path = _search_sorted(path, uuid)
+        else:
+            rel_path = None
+            for entry in _read_entries(path):
+                if entry[0] == uuid:
+                    rel_path = entry[1]
+        if rel_path is not None:
+            found = path.parent / rel_path
+            if found.exists():
+                return found
+    return found
 
 def manual_index():
     import os
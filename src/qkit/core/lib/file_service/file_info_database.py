@@ -19,6 +19,10 @@ fid_scan_hdf     = False
     This will open every h5 file found and extract attributes.
 fid_init_viewer  = True
     Make a database out of the dictionary of h5 files.
+fid_watch_datadir = False
+    Watch the datadir for new, changed and deleted files after the initial 
+    scan and update the databases and the viewer incrementally 
+    (see start_watching()).
 
 
 databases
@@ -67,6 +71,8 @@ after startup, the following main commands are available in a jupyter notebook:
 -------------------------------------------------------------------------------
 qkit.fid.show()
 qkit.fid.view(file_id)
+qkit.fid.query("run == 'R12' and fit_freq > 5e9")
+qkit.fid.add_settings_column(device, setting)
 
 qkit.fid.get_uuid(time)
 qkit.fid.get_time(uuid)
@@ -75,7 +81,9 @@ qkit.fid.get_date(uuid)
 
 
 
+import json
 import logging
+import os
 import threading
 from distutils.version import LooseVersion
 
@@ -91,6 +99,7 @@ if qkit.module_available['pandas']:
         found_qgrid = True
 
 from qkit.core.lib.file_service.file_info_database_lib import file_system_service
+from qkit.core.lib.file_service.breadcrumbs import find_uuid
 
 # display using qviewkit
 from qkit.gui.plot.plot import plot
@@ -100,7 +109,9 @@ class fid(file_system_service):
         self._batch_update = False
         self.column_sorting = ['datetime', 'name', 'run', 'user', 'comment', 'rating']
         self.columns_ignore = ['time']
+        self.numeric_columns = ['rating', 'fit_time', 'fit_freq']
         self.df = None
+        self._set_cache = {}
         # create initial database in the background. This can take a while...
         self.create_database()
         self._selected_df = []
@@ -119,11 +130,17 @@ class fid(file_system_service):
             try:
                 return self.h5_db[key]
             except KeyError as e:
+                path = find_uuid(key)  # files of other machines, known from their breadcrumbs
+                if path is not None:
+                    return str(path)
                 raise KeyError("Can not find your UUID '{}' in qkit.fid database.".format(key))
 
     def get(self, key, args=None):
         with self.lock:
             if key not in self.h5_db:
+                path = find_uuid(key)  # files of other machines, known from their breadcrumbs
+                if path is not None:
+                    return str(path)
                 logging.error("Can not find your UUID '{}' in qkit.fid database.".format(key))
             return self.h5_db.get(key, args)
 
@@ -185,7 +202,9 @@ class fid(file_system_service):
         self.set_db = {}
         self.measure_db = {}
         self.h5_info_db = {}
-        self._h5_n_mtime = {}
+        self._dir_index = {}
+        self._file_index = {}
+        self._files_by_dir = {}
         
         self._remove_cache_files()
         self.create_database()
@@ -193,6 +212,9 @@ class fid(file_system_service):
     def update_all(self):
         """ updates file and grid database if activated
         """
+        if qkit.cfg.get('fid_watch_datadir', False):
+            # start before the scan to not miss files written meanwhile
+            self.start_watching()
         self.update_file_db()
         self.update_grid_db()
 
@@ -206,29 +228,45 @@ class fid(file_system_service):
             else:
                 qkit.cfg['fid_init_viewer'] = False
     
-    def _get_setting_from_set_file(self, filename, instrument, value):
+    def _read_set_file(self, filename):
+        """
+        Returns the instrument settings {instrument: {parameter: value}} of a .set file.
+        The result is cached until the mtime of the file changes.
+        """
         try:
-            with open(filename, 'r') as f:
-                i_name = False
-                return_dict = {}
-                for line in f:
-                    if line.startswith("Instrument: "):
-                        if line[12:].strip() in instrument:
-                            i_name = line[12:].strip()
-                        else:
-                            i_name = False
-                    elif i_name:
-                        p = line.strip().split(":")
-                        if p[0] in value:
-                            for i in range(len(instrument)):
-                                if p[0] == value[i] and i_name == instrument[i]:
-                                    try:
-                                        return_dict.update({i_name+":"+p[0] : float(p[1][1:])})
-                                    except(ValueError,TypeError):
-                                        return_dict.update({i_name + ":" + p[0]: p[1][1:]})
-                return return_dict
-        except(IOError):
+            mtime = os.path.getmtime(filename)
+        except OSError:
             return {}
+        cached = self._set_cache.get(filename)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        try:
+            with open(filename, 'r') as f:
+                try:
+                    settings = json.load(f)
+                except ValueError:  # the text format of old qkit versions
+                    f.seek(0)
+                    settings = self._parse_legacy_set_file(f)
+        except IOError:
+            settings = {}
+        self._set_cache[filename] = (mtime, settings)
+        return settings
+
+    @staticmethod
+    def _parse_legacy_set_file(f):
+        settings = {}
+        parameters = None
+        for line in f:
+            if line.startswith("Instrument: "):
+                parameters = settings.setdefault(line[12:].split(" (")[0].strip(), {})
+            elif parameters is not None:
+                p = line.strip().split(":", 1)
+                if len(p) == 2:
+                    try:
+                        parameters[p[0]] = float(p[1][1:])
+                    except (ValueError, TypeError):
+                        parameters[p[0]] = p[1][1:]
+        return settings
 
     def set_rating(self, uid, rating):
         """
@@ -252,20 +290,66 @@ class fid(file_system_service):
             if len(self.h5_info_db) == 0:  # necessary if a data directory is chosen without any h5 file
                 self.df = pd.DataFrame(columns=['datetime', 'name', 'run', 'user'])
             else:
-                self.df = pd.DataFrame(self.h5_info_db).T
-        
+                # column-wise construction, avoids the object typed transpose of pd.DataFrame(...).T
+                self.df = pd.DataFrame.from_dict(self.h5_info_db, orient='index')
+            self.df = self._format_df(self.df)
+
+        def _format_df(self, df):
+            """
+            Gives the columns their types: numeric_columns become float (NaN if missing),
+            'datetime' datetime64 and the remaining (text) columns use "" for missing values.
+            """
             if qkit.cfg.get('fid_scan_hdf', False):
                 # self.df = self.df[['datetime', 'name', 'run', 'user', 'comment', 'fit_time', 'fit_freq', 'rating']]
-                for key in ['rating', 'fit_time', 'fit_freq']:
-                    if key in self.df.keys():
-                        self.df[key] = pd.to_numeric(self.df[key], errors='coerce')
+                for key in self.numeric_columns:
+                    if key in df.keys():
+                        df[key] = pd.to_numeric(df[key], errors='coerce')
             else:
-                self.df = self.df[['datetime', 'name', 'run', 'user']]
-            self.df['datetime'] = pd.to_datetime(self.df['datetime'], errors='coerce')
-            self.df.fillna("", inplace=True)  # Replace NAs with empty string to be able to detect changes
+                df = df[['datetime', 'name', 'run', 'user']].copy()
+            df['datetime'] = pd.to_datetime(df['datetime'], errors='coerce')
+            text_columns = [c for c in df.columns if df[c].dtype == object]
+            df[text_columns] = df[text_columns].fillna("")  # Replace NAs with empty string to be able to detect changes
+            return df
+
+        def query(self, expr, **kwargs):
+            """
+            Vectorized filter of the database, e.g.
+                qkit.fid.query("run == 'R12' and fit_freq > 5e9")
+                qkit.fid.query("datetime > '2019-05-01' and name.str.contains('resonator')", engine='python')
+            Local variables can be used with '@', numeric and datetime columns are 
+            compared as numbers. See pandas.DataFrame.query for the syntax and kwargs.
+            :param expr: boolean expression in terms of the column names
+            :type str
+            :return: pandas data frame with the matching measurements
+            """
+            self.wait()
+            kwargs['level'] = kwargs.get('level', 0) + 1  # resolve '@' variables in the caller's scope
+            with self.lock:
+                return self.df.query(expr, **kwargs)
+
+        def _file_added(self, uuid):
+            """
+            Updates the row of uuid in the data frame in place, new attributes become new columns.
+            """
+            if self.df is None or uuid not in self.h5_info_db:
+                return
+            row = self._format_df(pd.DataFrame.from_dict({uuid: self.h5_info_db[uuid]}, orient='index'))
+            for column in row.columns:
+                if column not in self.df.columns:
+                    self.df[column] = "" if row[column].dtype == object else np.nan
+            values = row.iloc[0].reindex(self.df.columns)
+            self.df.loc[uuid] = [("" if self.df[c].dtype == object and not isinstance(v, (list, np.ndarray)) and pd.isnull(v) else v)
+                                 for c, v in values.items()]
+
+        def _file_removed(self, uuid):
+            if self.df is not None and uuid in self.df.index:
+                self.df.drop(uuid, inplace=True)
+
+        def _watcher_batch_done(self):
+            if self.df is not None and not self.df.index.is_monotonic_increasing:
+                self.df.sort_index(inplace=True)
         
         def _get_settings_column(self, device, setting, uid=None, update_hdf=False):
-            dfsetting = pd.DataFrame()
             if not isinstance(device, (tuple, list)):
                 device = [device]
             if not isinstance(setting, (tuple, list)):
@@ -274,20 +358,28 @@ class fid(file_system_service):
                 raise ValueError("Please specify 'device' and 'setting' as equally long lists, where teir individual entries correspond to each other.")
             if uid is None:
                 uid = self.df.index
+            uid = list(uid)
+            columns = {d + ":" + s: [] for d, s in zip(device, setting)}
             for i in uid:
-                values = self._get_setting_from_set_file(self.h5_db[i].replace('.h5', '.set'), device, setting)
-                if update_hdf:
-                    for p, v in values.items():
-                        self._set_hdf_attribute(i, p, v)
-                dfsetting = pd.concat([dfsetting,
-                                       pd.DataFrame(values, index=[i])
-                                       ], sort=False)
+                settings = self._read_set_file(self.h5_db[i].replace('.h5', '.set'))
+                for d, s in zip(device, setting):
+                    columns[d + ":" + s].append(settings.get(d, {}).get(s, np.nan))
+            dfsetting = pd.DataFrame(columns, index=uid)
+            for key in dfsetting.keys():
+                numeric = pd.to_numeric(dfsetting[key], errors='coerce')
+                if numeric.notnull().sum() == dfsetting[key].notnull().sum():
+                    dfsetting[key] = numeric
+            if update_hdf:
+                for key in dfsetting.keys():
+                    for i, v in dfsetting[key].dropna().items():
+                        self._set_hdf_attribute(i, key, v)
             return dfsetting
     
         def add_settings_column(self, device, setting, measurement_id=None):
             """
             Reads out a specific setting from your chosen device. If you provide a uid,
-            then only these files will be considered
+            then only these files will be considered. device and setting can also be 
+            equally long lists to extract several settings in one pass over the .set files.
             :param device: your device name
             :type str
             :param setting: setting of your device
@@ -300,7 +392,7 @@ class fid(file_system_service):
                 if key in self.df.keys():
                     self.df.update(settings_column.loc[:, key])
                 else:
-                    self.df = pd.concat([self.df, settings_column.loc[:, key]], axis=1)
+                    self.df[key] = settings_column[key].reindex(self.df.index)
         
         def open_in_filemanager(self):
             ids = self._selected_df.index
@@ -344,7 +436,8 @@ class fid(file_system_service):
                 changed_df = c.get_changed_df()
             try:
                 uuids = [i for i in list(changed_df.index) if i in self.df.index]
-                indices = np.where(self.df.loc[uuids, keys] != changed_df.loc[uuids, keys])
+                old, new = self.df.loc[uuids, keys], changed_df.loc[uuids, keys]
+                indices = np.where((old != new) & ~(old.isnull() & new.isnull()))  # NaN in numeric columns is no change
                 logging.debug("I found {} changes".format(len(indices[0])))
                 for i in range(len(indices[0])):
                     index = uuids[indices[0][i]]
@@ -467,7 +560,7 @@ class fid(file_system_service):
         def void_func(self):
             raise ImportError("This function requires pandas to be installed.")
 
-        add_settings_column = open_in_filemanager = remove_column = show = get_filtered_uuids = search = add_column = void_func
+        add_settings_column = open_in_filemanager = remove_column = show = get_filtered_uuids = search = add_column = query = void_func
 
     def enlarge_notebook(self,width=100):
         from IPython.core.display import display, HTML
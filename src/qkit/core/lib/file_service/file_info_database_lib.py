@@ -1,13 +1,17 @@
 import qkit
 
 import os
+import itertools
 import threading
 import logging
 import time
 import json
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import qkit.storage.hdf_DateTimeGenerator as dtg
 from qkit.core.lib.file_service.breadcrumbs import BreadCrumbCreator
+from qkit.core.lib.file_service.file_watcher import FileWatcher
 import h5py
 
 try:
@@ -62,58 +66,148 @@ class UUID_base(object):
         return time.strftime("%Y-%m-%d %H:%M:%S",time.localtime(self.get_time(uuid)))
 
 
+def collect_h5_info(uuid, path, scan_hdf=False):
+    """
+    Collects the information about a h5 file for the h5_info_db.
+    
+    The basic information is derived from the UUID and the path, with 
+    'scan_hdf' the file is opened and its attributes are extracted (slow).
+    This is a module level function to be usable in a process pool.
+    """
+    tm = ""
+    dt = ""
+    j_split = (path.replace('/', '\\')).split('\\')
+    name = j_split[-1][7:-3]
+    if ord(uuid[0]) > ord('L'):
+        try:
+            tm = UUID_base().get_time(uuid)
+            dt = UUID_base().get_date(uuid)
+            user = j_split[-3]
+            run = j_split[-4]
+        except ValueError as e:
+            user = None
+            run = None
+            logging.info(e)
+    else:
+        tm = uuid
+        try:
+            if j_split[-3][0:3] != 201:  # not really a measurement file then
+                dt = None
+            else:
+                dt = '{}-{}-{} {}:{}:{}'.format(j_split[-3][:4], j_split[-3][4:6], j_split[-3][6:], tm[:2], tm[2:4], tm[4:])
+        except IndexError:
+            dt = None
+        user = None
+        run = None
+    h5_info_db = {'time': tm, 'datetime': dt, 'run': run, 'name': name, 'user': user}
+    
+    if scan_hdf:
+        h5_info_db.update({'rating':10})
+        h5f = None
+        try:
+            h5f=h5py.File(path,'r')
+            if "comment" in  h5f['/entry/data0'].attrs:
+                h5_info_db.update({'comment': h5f['/entry/data0'].attrs['comment']})
+            if "dr_values" in h5f['/entry/analysis0']:
+                try:
+                    # this is legacy and should be removed at some point
+                    # please use the entry/analysis0 attributes instead.
+                    fit_comment = h5f['/entry/analysis0/dr_values'].attrs.get('comment',"").split(', ')
+                    comm_begin = [i[0] for i in fit_comment]
+                    try:
+                        h5_info_db.update({'fit_freq': float(h5f['/entry/analysis0/dr_values'][comm_begin.index('f')])})
+                    except (ValueError, IndexError):
+                        pass
+                    try:
+                        h5_info_db.update({'fit_time': float(h5f['/entry/analysis0/dr_values'][comm_begin.index('T')])})
+                    except (ValueError, IndexError):
+                        pass
+                except (KeyError, AttributeError):
+                    pass
+            if "measurement" in h5f['/entry/data0']:
+                try:
+                    mmt = json.loads(h5f['/entry/data0/measurement'][0])
+                    h5_info_db.update(
+                            {arg: mmt[arg] for arg in ['run_id', 'user', 'rating', 'smt'] if mmt.has_key(arg)}
+                    )
+                except(AttributeError, KeyError):
+                    pass
+            try:
+                h5_info_db.update(dict(h5f['/entry/analysis0'].attrs))
+            except(AttributeError, KeyError):
+                pass
+        except KeyError as e:
+            logging.debug("fid could not index file {}, probably it is just new and empty. Original message: {}".format(path,e))
+        except IOError as e:
+            logging.error("fid {}:{}".format(path,e))
+        finally:
+            if h5f is not None:
+                h5f.close()
+    return h5_info_db
+
+
 class file_system_service(UUID_base):
     h5_db = {}
     set_db = {}
     measure_db = {}
     h5_info_db = {}
 
-    _h5_n_mtime = {}
+    # duration of the phases of the last update_file_db() in seconds
+    timings = {}
     
-    _h5_mtime_db_path   = os.path.join(qkit.cfg['logdir'],"h5_mtime.db")
-    _h5_info_cache_path = os.path.join(qkit.cfg['logdir'],"h5_info_cache.db")
+    # persistent index of all known files and directories, see _open_index()
+    _index_path = os.path.join(qkit.cfg['logdir'],"fid_index.sqlite")
+    # pickled caches of former versions
+    _legacy_cache_paths = [os.path.join(qkit.cfg['logdir'],"h5_mtime.db"), os.path.join(qkit.cfg['logdir'],"h5_info_cache.db")]
+
+    _breadcrumb_creator = None
 
-    _breadcrumb_creator = BreadCrumbCreator()
+    # FileWatcher and its pending events {path: (event, time of last event)}, see start_watching()
+    _watcher = None
+    _pending_events = {}
+    _pending_lock = threading.Lock()
 
     lock = threading.Lock()
     
+    def _get_breadcrumb_creator(self):
+        # created on first use, importing this module must not touch the datadir (process pool)
+        if file_system_service._breadcrumb_creator is None:
+            file_system_service._breadcrumb_creator = BreadCrumbCreator()
+        return file_system_service._breadcrumb_creator
+
     def _remove_cache_files(self):
         """
             remove cached files to recreate the database
         """
-        for f in [self._h5_mtime_db_path,self._h5_info_cache_path]:
+        for f in [self._index_path] + self._legacy_cache_paths:
             if os.path.isfile(f):
                 os.remove(f)
 
-    def _load_cache_files(self):
-        """ to speed up things, try to load the h5 
-            information from previous runs. 
+    def _open_index(self):
         """
-        self._new_cache = False
-        self._h5_mtime_db = {}
-        self._h5_info_cache_db = {}
-        self._n_mtime = {}
-        try:
-            with open(self._h5_mtime_db_path,'rb') as f:
-                self._h5_mtime_db = pickle.load(f)
-            with open(self._h5_info_cache_path,'rb') as f:
-                self._h5_info_cache_db = pickle.load(f)
-        except IOError as e:
-            logging.info("m_time_db not found. Not using cached files for now. %s"%e)
-            self._new_cache = True
-
-    def _store_cache_files(self):
-        """ writes the cached files on disk, 
-        qkit.cfg['logdir'] is used by default.
-
-        exeptions are not handled ... if something fails here 
-        there is a severe general problem, e.g. the disk is full.
+        Opens the SQLite file index in qkit.cfg['logdir'].
+        
+        files: one row per .h5, .set and .measurement file with its UUID,
+            directory, mtime and size. For h5 files the pickled h5_info_db
+            entry is cached, 'hdf_scanned' marks entries with file attributes.
+        dirs: one row per directory with its mtime and its subdirectories.
+            Directories with unchanged mtime are not listed again.
         """
-        write_protocol = 2 # For Python 2 compatibility 0=text, 1...x binary, -1 highest binary. 
-        with open(self._h5_mtime_db_path,'wb+') as f:
-            pickle.dump(self._h5_n_mtime,f,protocol=write_protocol)
-        with open(self._h5_info_cache_path,'wb+') as f:
-            pickle.dump(self.h5_info_db,f,protocol=write_protocol)
+        con = sqlite3.connect(self._index_path)
+        con.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, uuid TEXT, dir TEXT, mtime REAL, size INTEGER, hdf_scanned INTEGER, info BLOB)")
+        con.execute("CREATE INDEX IF NOT EXISTS files_uuid ON files (uuid)")
+        con.execute("CREATE INDEX IF NOT EXISTS files_dir ON files (dir)")
+        con.execute("CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, mtime REAL, subdirs TEXT)")
+        return con
+
+    def _load_index(self, con):
+        """ to speed up things, load the file information from previous runs. """
+        self._dir_index = {p: (m, json.loads(sd)) for p, m, sd in con.execute("SELECT path, mtime, subdirs FROM dirs")}
+        self._file_index = {}
+        self._files_by_dir = {}
+        for path, d, mtime, size, hdf_scanned, info in con.execute("SELECT path, dir, mtime, size, hdf_scanned, info FROM files"):
+            self._file_index[path] = (mtime, size, hdf_scanned, info)
+            self._files_by_dir.setdefault(d, []).append(path)
 
     def _get_datadir(self):
         if qkit.cfg.get('fid_restrict_to_userdir',False):
@@ -122,30 +216,103 @@ class file_system_service(UUID_base):
             return qkit.cfg['datadir']
 
     def update_file_db(self):
+        """
+        Scans the datadir and updates the databases and the persistent index.
+        
+        Directories whose mtime did not change since the last scan are not 
+        listed again, their files are taken from the index 
+        (qkit.cfg['fid_skip_unchanged_dirs'], default: True). Files modified
+        in place by other programs are then only found by recreate_database().
+        h5 files are opened (fid_scan_hdf) in a process pool with 
+        qkit.cfg['fid_scan_workers'] processes (default: number of CPUs).
+        The duration of the phases is stored in 'timings'.
+        """
         with self.lock:
             start_time = time.time()
-            self._load_cache_files()
-            if qkit.cfg.get('fid_scan_datadir',True):
-                qkit.cfg['fid_scan_datadir'] = True
-                logging.debug("file info database: Start to update database.")
-                for root, _ , files in os.walk(self._get_datadir()): # root, dirs, files
-                    for f in files:
-                        self._inspect_and_add_Leaf(f,root)
-                logging.debug("file info database: Updating database done.")
-            self._store_cache_files()
+            self.timings = {}
+            con = self._open_index()
+            try:
+                self._load_index(con)
+                self.timings['load_index'] = time.time() - start_time
+                if qkit.cfg.get('fid_scan_datadir',True):
+                    qkit.cfg['fid_scan_datadir'] = True
+                    logging.debug("file info database: Start to update database.")
+                    t0 = time.time()
+                    to_collect = self._scan_datadir(con)
+                    self.timings['scan_datadir'] = time.time() - t0
+                    t0 = time.time()
+                    self._collect_infos(to_collect)
+                    self.timings['collect_info'] = time.time() - t0
+                    t0 = time.time()
+                    self._store_infos(con, to_collect)
+                    con.commit()
+                    self.timings['store_index'] = time.time() - t0
+                    logging.debug("file info database: Updating database done.")
+            finally:
+                con.close()
+            self.timings['total'] = time.time() - start_time
             print ("Initialized the file info database (qkit.fid) in %.3f seconds."%(time.time()-start_time))
+            logging.info("file info database: phases (s): " + ", ".join("%s %.3f" % (k, v) for k, v in self.timings.items()))
 
-    def _inspect_and_add_Leaf(self,fname,root):
+    def _scan_datadir(self, con):
         """
-        inspect the filenames if .h5, .set or .measurement
-
-        to speed up things, the files are only scanned 
-        if something has changed (os.stat.m_time) on disk. 
+        Walks through the datadir, registers all files and updates the index.
+        Returns a list of (uuid, path) of the h5 files whose info has to be collected.
         """
+        skip_unchanged = qkit.cfg.get('fid_skip_unchanged_dirs', True)
+        scan_hdf = qkit.cfg.get('fid_scan_hdf', False)
+        to_collect = []
+        stack = [self._get_datadir()]
+        while stack:
+            root = stack.pop()
+            try:
+                mtime = os.stat(root).st_mtime
+            except OSError:
+                continue
+            cached = self._dir_index.get(root)
+            if skip_unchanged and cached is not None and cached[0] == mtime:
+                subdirs = cached[1]
+                for fqpath in self._files_by_dir.get(root, []):
+                    self._register_file(fqpath, self._file_index[fqpath], scan_hdf, to_collect)
+            else:
+                subdirs = []
+                rows = []
+                try:
+                    entries = list(os.scandir(root))
+                except OSError as e:
+                    logging.error("file info database: Cannot list '{}': {}".format(root, e))
+                    continue
+                for entry in entries:
+                    if entry.is_dir():
+                        subdirs.append(entry.path)
+                    elif entry.name[-3:] in ('.h5', 'set', 'ent'):
+                        fqpath = entry.path
+                        if entry.name[-3:] == '.h5':
+                            # we only care about the mtime of .h5 files
+                            st = entry.stat()
+                            mtime_f, size = st.st_mtime, st.st_size
+                        else:
+                            mtime_f, size = 0, 0
+                        row = self._file_index.get(fqpath)
+                        if row is None or row[0] != mtime_f or row[1] != size:
+                            row = (mtime_f, size, 0, None)
+                        rows.append((fqpath, entry.name[:6], root, row[0], row[1], row[2], row[3]))
+                        self._register_file(fqpath, row, scan_hdf, to_collect)
+                # replace the directory's entries, removed files vanish from the index
+                con.execute("DELETE FROM files WHERE dir = ?", (root,))
+                con.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                con.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)", (root, mtime, json.dumps(subdirs)))
+            stack.extend(subdirs)
+        return to_collect
 
-        # join to absolute path:
-        fqpath = os.path.join(root, fname)
-
+    def _register_file(self, fqpath, row, scan_hdf, to_collect):
+        """
+        Adds a .h5, .set or .measurement file to the databases. 
+        
+        The h5 info is taken from the index row if it is up to date, otherwise
+        the file is appended to to_collect.
+        """
+        fname = os.path.basename(fqpath)
         # take the prefix ...
         uuid = fname[:6]
 
@@ -156,98 +323,67 @@ class file_system_service(UUID_base):
             # Note: All path entries with the same uuid are 
             # overwritten with the last found uuid indexed file
             self.h5_db[uuid] = fqpath
-            self._breadcrumb_creator.append_entry(uuid, fqpath)
-
-            # we only care about the mtime of .h5 files 
-            mtime = os.stat(fqpath).st_mtime
-
-            # store the file's modification time 
-            self._h5_n_mtime[uuid] = mtime
+            self._get_breadcrumb_creator().append_entry(uuid, fqpath)
 
-            if mtime == self._h5_mtime_db.get(uuid,0):
-                if self._h5_info_cache_db.get(uuid,0):
-                    self.h5_info_db[uuid] = self._h5_info_cache_db.get(uuid)
-                else:
-                    self._collect_info(uuid, fqpath) # collect_info is expensive.
+            _, _, hdf_scanned, info = row
+            if info is None or (scan_hdf and not hdf_scanned):
+                to_collect.append((uuid, fqpath))
             else:
-                self._collect_info(uuid, fqpath) # collect_info is expensive. 
+                self.h5_info_db[uuid] = pickle.loads(info)
 
         elif fqpath[-3:] == 'set':
             self.set_db[uuid] = fqpath
         elif fqpath[-3:] == 'ent':
             self.measure_db[uuid] = fqpath
 
-    def _collect_info(self,uuid,path):
-            tm = ""
-            dt = ""
-            j_split = (path.replace('/', '\\')).split('\\')
-            name = j_split[-1][7:-3]
-            if ord(uuid[0]) > ord('L'):
-                try:
-                    tm = self.get_time(uuid)
-                    dt = self.get_date(uuid)
-                    user = j_split[-3]
-                    run = j_split[-4]
-                except ValueError as e:
-                    user = None
-                    run = None
-                    logging.info(e)
-            else:
-                tm = uuid
-                try:
-                    if j_split[-3][0:3] != 201:  # not really a measurement file then
-                        dt = None
-                    else:
-                        dt = '{}-{}-{} {}:{}:{}'.format(j_split[-3][:4], j_split[-3][4:6], j_split[-3][6:], tm[:2], tm[2:4], tm[4:])
-                except IndexError:
-                    dt = None
-                user = None
-                run = None
-            h5_info_db = {'time': tm, 'datetime': dt, 'run': run, 'name': name, 'user': user}
-            
-            if qkit.cfg.get('fid_scan_hdf', False):
-                h5_info_db.update({'rating':10})
-                try:
-                    h5f=h5py.File(path,'r')
-                    if "comment" in  h5f['/entry/data0'].attrs:
-                        h5_info_db.update({'comment': h5f['/entry/data0'].attrs['comment']})
-                    if "dr_values" in h5f['/entry/analysis0']:
-                        try:
-                            # this is legacy and should be removed at some point
-                            # please use the entry/analysis0 attributes instead.
-                            fit_comment = h5f['/entry/analysis0/dr_values'].attrs.get('comment',"").split(', ')
-                            comm_begin = [i[0] for i in fit_comment]
-                            try:
-                                h5_info_db.update({'fit_freq': float(h5f['/entry/analysis0/dr_values'][comm_begin.index('f')])})
-                            except (ValueError, IndexError):
-                                pass
-                            try:
-                                h5_info_db.update({'fit_time': float(h5f['/entry/analysis0/dr_values'][comm_begin.index('T')])})
-                            except (ValueError, IndexError):
-                                pass
-                        except (KeyError, AttributeError):
-                            pass
-                    if "measurement" in h5f['/entry/data0']:
-                        try:
-                            mmt = json.loads(h5f['/entry/data0/measurement'][0])
-                            h5_info_db.update(
-                                    {arg: mmt[arg] for arg in ['run_id', 'user', 'rating', 'smt'] if mmt.has_key(arg)}
-                            )
-                        except(AttributeError, KeyError):
-                            pass
-                    try:
-                        h5_info_db.update(dict(h5f['/entry/analysis0'].attrs))
-                    except(AttributeError, KeyError):
-                        pass
-                except KeyError as e:
-                    logging.debug("fid could not index file {}, probably it is just new and empty. Original message: {}".format(path,e))
-                except IOError as e:
-                    logging.error("fid {}:{}".format(path,e))
-                finally:
-                    h5f.close()
+    def _collect_infos(self, to_collect):
+        """ collects the h5 info of the given files, in parallel if the files have to be opened. """
+        scan_hdf = qkit.cfg.get('fid_scan_hdf', False)
+        workers = qkit.cfg.get('fid_scan_workers', os.cpu_count() or 1)
+        uuids = [u for u, _ in to_collect]
+        paths = [p for _, p in to_collect]
+        infos = None
+        if scan_hdf and workers > 1 and len(to_collect) >= 32:
+            try:
+                with ProcessPoolExecutor(max_workers=workers) as ex:
+                    infos = list(ex.map(collect_h5_info, uuids, paths, itertools.repeat(scan_hdf),
+                                        chunksize=max(1, len(to_collect) // (4 * workers))))
+            except Exception as e:  # e.g. no process spawning possible in this environment
+                logging.warning("file info database: Parallel scan failed, scanning serially: {}".format(e))
+        if infos is None:
+            infos = [collect_h5_info(u, p, scan_hdf) for u, p in to_collect]
+        for uuid, info in zip(uuids, infos):
+            self.h5_info_db[uuid] = info
+
+    def _store_infos(self, con, to_collect):
+        """ writes the collected h5 infos to the index. """
+        hdf_scanned = int(bool(qkit.cfg.get('fid_scan_hdf', False)))
+        con.executemany("UPDATE files SET hdf_scanned = ?, info = ? WHERE path = ?",
+                        [(hdf_scanned, pickle.dumps(self.h5_info_db[uuid], protocol=2), path) for uuid, path in to_collect])
+
+    def _inspect_and_add_Leaf(self,fname,root):
+        """
+        inspect the filenames if .h5, .set or .measurement and update the 
+        index entry of the file.
+        """
+        fqpath = os.path.join(root, fname)
+        if fqpath[-3:] == '.h5':
+            st = os.stat(fqpath)
+            row = (st.st_mtime, st.st_size, 0, None)
+        else:
+            row = (0, 0, 0, None)
+        to_collect = []
+        self._register_file(fqpath, row, qkit.cfg.get('fid_scan_hdf', False), to_collect)
+        for uuid, path in to_collect:
+            self.h5_info_db[uuid] = collect_h5_info(uuid, path, qkit.cfg.get('fid_scan_hdf', False))
+        con = self._open_index()
+        try:
+            con.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)", (fqpath, fname[:6], root) + row)
+            self._store_infos(con, to_collect)
+            con.commit()
+        finally:
+            con.close()
 
-            self.h5_info_db[uuid] = h5_info_db
-    
     def add_h5_file(self, h5_filename):
         if qkit.cfg['fid_scan_datadir']:
             threading.Timer(20, function=self._add, kwargs={'h5_filename':h5_filename}).start()
@@ -259,7 +395,7 @@ class file_system_service(UUID_base):
         basename = os.path.basename(h5_filename)[:-2]
         dirname = os.path.dirname(h5_filename)
         uuid = basename[:6]
-        self._breadcrumb_creator.append_entry(uuid, h5_filename)
+        self._get_breadcrumb_creator().append_entry(uuid, h5_filename)
         if h5_filename[-3:] != '.h5':
             logging.error("Tried to add '{:s}' to the qkit.fid database: Not a .h5 filename.".format(h5_filename))
         with self.lock:
@@ -277,6 +413,116 @@ class file_system_service(UUID_base):
         self.update_grid_db()
 
 
+    def start_watching(self):
+        """
+        Keeps the databases up to date with the files in the datadir.
+        
+        Created, modified and deleted .h5, .set and .measurement files are 
+        reported by a FileWatcher (inotify on Linux, polling otherwise with 
+        qkit.cfg['fid_watch_interval'] seconds, default 10) and added or removed 
+        one by one. Datadirs on network filesystems (NFS, SMB/CIFS, ...) are
+        polled, as inotify misses changes made by other machines; polling can
+        be forced with qkit.cfg['fid_watch_polling'] = True. Files are only processed 
+        qkit.cfg['fid_watch_debounce'] seconds (default 2) after their last 
+        change and h5 files only when their 'updating' flag has been cleared 
+        or they have not been touched for 
+        qkit.cfg['fid_watch_updating_timeout'] seconds (default 600).
+        Started on startup with qkit.cfg['fid_watch_datadir'] = True.
+        """
+        if self._watcher is not None:
+            return
+        file_system_service._watcher = FileWatcher(self._get_datadir(), self._on_file_event,
+                                                   interval=qkit.cfg.get('fid_watch_interval', 10),
+                                                   use_inotify=False if qkit.cfg.get('fid_watch_polling', False) else None)
+        self._watcher.start()
+        threading.Thread(name='fid_pending_events', target=self._process_pending_events, daemon=True).start()
+        logging.info("file info database: watching {} ({}).".format(self._watcher.path, self._watcher.backend))
+
+    def stop_watching(self):
+        if self._watcher is not None:
+            watcher, file_system_service._watcher = self._watcher, None
+            watcher.stop()
+
+    def _on_file_event(self, event, path):
+        with self._pending_lock:
+            self._pending_events[path] = (event, time.time())
+
+    def _process_pending_events(self):
+        debounce = qkit.cfg.get('fid_watch_debounce', 2)
+        while self._watcher is not None:
+            time.sleep(min(debounce, 1))
+            now = time.time()
+            with self._pending_lock:
+                due = [(path, p[0]) for path, p in self._pending_events.items() if now - p[1] >= debounce]
+            changed = False
+            for path, event in due:
+                try:
+                    done = self._apply_file_event(event, path)
+                except Exception as e:
+                    logging.error("file info database: Could not process {} '{}': {}".format(event, path, e))
+                    done = True
+                if done:
+                    with self._pending_lock:
+                        # only drop the event if no newer one arrived meanwhile
+                        if path in self._pending_events and self._pending_events[path][1] <= now - debounce:
+                            del self._pending_events[path]
+                    changed = True
+            if changed:
+                with self.lock:
+                    self._watcher_batch_done()
+
+    def _is_updating(self, path):
+        """ True if the h5 file is still being written, i.e. its 'updating' flag is set or it can not be opened. """
+        try:
+            with h5py.File(path, 'r') as h5f:
+                return bool(h5f['entry'].attrs.get('updating', False))
+        except (IOError, OSError, KeyError):
+            return True
+
+    def _apply_file_event(self, event, path):
+        """
+        Adds, updates or removes the file in the databases.
+        Returns False if the file is still being written and should be tried again later.
+        """
+        fname = os.path.basename(path)
+        uuid = fname[:6]
+        if event == 'deleted' or not os.path.isfile(path):
+            with self.lock:
+                for db in (self.h5_db, self.set_db, self.measure_db):
+                    if db.get(uuid) == path:
+                        del db[uuid]
+                        if db is self.h5_db:
+                            self.h5_info_db.pop(uuid, None)
+                            self._file_removed(uuid)
+                con = self._open_index()
+                try:
+                    con.execute("DELETE FROM files WHERE path = ?", (path,))
+                    con.commit()
+                finally:
+                    con.close()
+            return True
+        if path[-3:] == '.h5' and self._is_updating(path):
+            if time.time() - os.path.getmtime(path) < qkit.cfg.get('fid_watch_updating_timeout', 600):
+                return False
+            logging.info("file info database: '{}' is still marked as updating, adding it anyway.".format(path))
+        with self.lock:
+            self._inspect_and_add_Leaf(fname, os.path.dirname(path))
+            if path[-3:] == '.h5':
+                self._file_added(uuid)
+        return True
+
+    def _file_added(self, uuid):
+        """ called (with lock held) after the watcher added or updated the h5 file with this uuid """
+        pass
+
+    def _file_removed(self, uuid):
+        """ called (with lock held) after the watcher removed the h5 file with this uuid """
+        pass
+
+    def _watcher_batch_done(self):
+        """ called (with lock held) after the watcher has processed a batch of events """
+        pass
+
     def _set_hdf_attribute(self,UUID,attribute,value):
         h5_filepath = self.h5_db[UUID]
         h = h5py.File(h5_filepath,'r+')['entry']
@@ -299,6 +545,14 @@ class file_system_service(UUID_base):
         finally:
             h.file.close()
         self.h5_info_db[UUID].update({attribute:value})
+        con = self._open_index()
+        try:
+            st = os.stat(h5_filepath)
+            con.execute("UPDATE files SET mtime = ?, size = ?, info = ? WHERE path = ?",
+                        (st.st_mtime, st.st_size, pickle.dumps(self.h5_info_db[UUID], protocol=2), h5_filepath))
+            con.commit()
+        finally:
+            con.close()
         
     def wait(self):
         with self.lock:
@@ -0,0 +1,296 @@
+"""
+Watches a directory tree for created, modified and deleted files and reports
+them to a callback. This is used by the file info database (qkit.fid) to pick
+up files written by other machines or copied in by a backup without a rescan.
+
+On Linux the kernel's inotify interface is used (via ctypes, no additional
+package needed). Every directory of the tree gets a watch, new directories are
+watched as soon as they appear. inotify only sees changes made through the
+local kernel, writes of other machines to a network share (NFS, SMB/CIFS, ...)
+are missed. Therefore the tree is polled every 'interval' seconds and compared
+to the previous snapshot where inotify is not available (other OS, exhausted
+watch limit), where the tree lies on a network filesystem, or on request.
+
+Files below a deleted or moved-away directory are reported as deleted.
+
+The callback is called from the watcher thread as callback(event, path) with
+event being one of 'created', 'modified' or 'deleted'. Events are not
+debounced here, a file being written produces many 'modified' events.
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+
+# inotify event masks, see inotify(7)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+# filesystem types (as in /proc/mounts) whose changes inotify does not see
+NETWORK_FILESYSTEMS = ('nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'ncpfs', 'afs', 'ceph', 'glusterfs',
+                       'lustre', 'gpfs', '9p', 'fuse.sshfs', 'fuse.glusterfs', 'fuse.cephfs')
+
+_WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+def filesystem_type(path):
+    """ returns the type of the filesystem path lies on as listed in /proc/mounts, None if unknown """
+    path = os.path.realpath(path)
+    best, fstype = '', None
+    try:
+        with open('/proc/mounts') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                # spaces in mount points are escaped as \040
+                mountpoint = fields[1].replace('\\040', ' ')
+                if (path == mountpoint or path.startswith(mountpoint.rstrip(os.sep) + os.sep)) and len(mountpoint) >= len(best):
+                    best, fstype = mountpoint, fields[2]
+    except (IOError, OSError):
+        return None
+    return fstype
+
+
+def is_network_filesystem(path):
+    return filesystem_type(path) in NETWORK_FILESYSTEMS
+
+
+class FileWatcher(object):
+    """
+    Reports changes of files ending with one of 'suffixes' below 'path'.
+
+    Args:
+        path: root directory of the watched tree.
+        callback: function(event, path), called from the watcher thread.
+        suffixes: only files with these endings are reported.
+        interval: polling period in seconds, also used as select timeout.
+        use_inotify: None (default) uses inotify if available and the tree is
+            not on a network filesystem, False forces polling.
+    """
+
+    def __init__(self, path, callback, suffixes=('.h5', '.set', '.measurement'), interval=10, use_inotify=None):
+        self.path = path
+        self.callback = callback
+        self.suffixes = tuple(suffixes)
+        self.interval = interval
+        self.use_inotify = use_inotify
+        self.backend = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._fd = None
+        self._wd_to_dir = {}
+        self._snapshot = {}
+        self._files = set()  # matching files seen by inotify, to report the content of deleted directories
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        use_inotify = self.use_inotify is not False and sys.platform.startswith('linux')
+        if use_inotify and self.use_inotify is None and is_network_filesystem(self.path):
+            logging.info("FileWatcher: '{}' is on a network filesystem ({}), inotify misses changes made by other machines, polling instead.".format(self.path, filesystem_type(self.path)))
+            use_inotify = False
+        if use_inotify:
+            try:
+                self._init_inotify()
+                self.backend = 'inotify'
+            except OSError as e:
+                logging.warning("FileWatcher: inotify not usable ({}), falling back to polling.".format(e))
+                self._close_inotify()
+        if self.backend is None:
+            self._snapshot = self._scan()
+            self.backend = 'polling'
+        self._thread = threading.Thread(name='fid_file_watcher', target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._close_inotify()
+        self.backend = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _matches(self, name):
+        return name.endswith(self.suffixes)
+
+    def _emit(self, event, path):
+        try:
+            self.callback(event, path)
+        except Exception as e:
+            logging.error("FileWatcher: callback failed for {} '{}': {}".format(event, path, e))
+
+    def _run(self):
+        if self.backend == 'inotify':
+            self._run_inotify()
+        else:
+            self._run_polling()
+
+    # polling
+    def _scan(self):
+        """ returns {path: (mtime, size)} of all matching files in the tree """
+        snapshot = {}
+        stack = [self.path]
+        while stack:
+            try:
+                entries = list(os.scandir(stack.pop()))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        stack.append(entry.path)
+                    elif self._matches(entry.name):
+                        st = entry.stat()
+                        snapshot[entry.path] = (st.st_mtime, st.st_size)
+                except OSError:
+                    pass  # vanished in between
+        return snapshot
+
+    def _run_polling(self):
+        while not self._stop.wait(self.interval):
+            snapshot = self._scan()
+            for path, stat in snapshot.items():
+                old = self._snapshot.get(path)
+                if old is None:
+                    self._emit('created', path)
+                elif old != stat:
+                    self._emit('modified', path)
+            for path in set(self._snapshot) - set(snapshot):
+                self._emit('deleted', path)
+            self._snapshot = snapshot
+
+    # inotify
+    def _init_inotify(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._inotify_add_watch = libc.inotify_add_watch
+        self._inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._inotify_rm_watch = libc.inotify_rm_watch
+        self._inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        fd = libc.inotify_init()
+        if fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self._fd = fd
+        self._add_tree(self.path, emit=False)
+
+    def _close_inotify(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        self._wd_to_dir = {}
+        self._files = set()
+
+    def _add_watch(self, directory):
+        wd = self._inotify_add_watch(self._fd, os.fsencode(directory), _WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, "inotify_add_watch '{}': {}".format(directory, os.strerror(errno)))
+        self._wd_to_dir[wd] = directory
+
+    def _add_tree(self, root, emit=True):
+        """ watches root and all its subdirectories, with emit the contained files are reported as created """
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            self._add_watch(directory)
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.is_dir():
+                    stack.append(entry.path)
+                elif self._matches(entry.name):
+                    self._files.add(entry.path)
+                    if emit:
+                        self._emit('created', entry.path)
+
+    def _remove_tree(self, root):
+        """ drops the watches below a deleted or moved-away directory and reports its files as deleted """
+        prefix = root + os.sep
+        for wd, directory in list(self._wd_to_dir.items()):
+            if directory == root or directory.startswith(prefix):
+                # a moved directory keeps its watches, they would report the old path
+                self._inotify_rm_watch(self._fd, wd)
+                self._wd_to_dir.pop(wd, None)
+        for path in [p for p in self._files if p.startswith(prefix)]:
+            self._files.discard(path)
+            self._emit('deleted', path)
+
+    def _run_inotify(self):
+        while not self._stop.is_set():
+            readable, _, _ = select.select([self._fd], [], [], min(self.interval, 1))
+            if not readable:
+                continue
+            try:
+                buf = os.read(self._fd, 64 * 1024)
+            except OSError as e:
+                logging.error("FileWatcher: reading inotify events failed: {}".format(e))
+                continue
+            offset = 0
+            while offset < len(buf):
+                wd, mask, _, length = _EVENT_HEADER.unpack_from(buf, offset)
+                offset += _EVENT_HEADER.size
+                name = os.fsdecode(buf[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                self._handle_event(wd, mask, name)
+
+    def _handle_event(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            # events were lost, report everything to get consistent again
+            logging.warning("FileWatcher: inotify queue overflow, reporting all files as modified.")
+            files = set(self._scan())
+            for path in files:
+                self._emit('modified', path)
+            for path in self._files - files:
+                self._emit('deleted', path)
+            self._files = files
+            return
+        if mask & IN_IGNORED:
+            self._wd_to_dir.pop(wd, None)
+            return
+        directory = self._wd_to_dir.get(wd)
+        if directory is None or mask & IN_DELETE_SELF:
+            return
+        path = os.path.join(directory, name)
+        if mask & IN_ISDIR:
+            if mask & (IN_DELETE | IN_MOVED_FROM):
+                self._remove_tree(path)
+            elif mask & (IN_CREATE | IN_MOVED_TO):
+                try:
+                    self._add_tree(path)
+                except OSError as e:
+                    logging.warning("FileWatcher: cannot watch '{}': {}".format(path, e))
+            return
+        if not self._matches(name):
+            return
+        if mask & (IN_DELETE | IN_MOVED_FROM):
+            self._files.discard(path)
+            self._emit('deleted', path)
+        elif mask & (IN_CREATE | IN_MOVED_TO):
+            self._files.add(path)
+            self._emit('created', path)
+        elif mask & (IN_MODIFY | IN_CLOSE_WRITE):
+            self._files.add(path)
+            self._emit('modified', path)
@@ -0,0 +1,93 @@
+"""
+Worker process pools for CPU bound tasks of the measurement kernel, e.g. saving
+plots (qkit.gui.plot.plot) and circle fits (qkit.analysis.resonator).
+
+The pools are opt-in and kept for the lifetime of the kernel, so the start-up
+of the workers (importing qkit, numpy, matplotlib, ...) is paid only once. The
+workers are spawned, not forked, as the measurement kernel runs threads.
+
+A spawned worker imports the __main__ module of the kernel. A plain script
+without an "if __name__ == '__main__':" guard would run again in every worker,
+including its measurement and instrument code. For such scripts get_pool()
+returns None and the caller does the work itself, InlineExecutor offers the
+submit() interface of a pool for this. A pool whose worker died raises
+BrokenProcessPool, the caller drops it with discard_pool() and continues
+without it.
+"""
+import ast
+import logging
+import multiprocessing
+import sys
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# {name: (ProcessPoolExecutor, number of processes)}
+_pools = {}
+_warned = False
+
+
+def _is_main_test(test):
+    """ True for the test of "if __name__ == '__main__':" """
+    names = [n.id for n in ast.walk(test) if isinstance(n, ast.Name)]
+    values = [n.value for n in ast.walk(test) if isinstance(n, ast.Constant)]
+    return '__name__' in names and '__main__' in values
+
+
+def main_is_guarded():
+    """
+    Returns True if spawned workers can import the __main__ module safely:
+    interactive sessions and notebooks (no __main__.__file__) and scripts
+    whose code runs under an "if __name__ == '__main__':" guard.
+    """
+    path = getattr(sys.modules.get('__main__'), '__file__', None)
+    if not path:
+        return True
+    try:
+        with open(path, 'rb') as f:
+            tree = ast.parse(f.read())
+    except (IOError, OSError, SyntaxError, ValueError):
+        return False
+    return any(isinstance(node, ast.If) and _is_main_test(node.test) for node in tree.body)
+
+
+def get_pool(name, processes):
+    """
+    Returns the pool 'name' with 'processes' workers, None if processes < 1 or
+    the __main__ module would be run again by the workers (see main_is_guarded).
+    """
+    global _warned
+    if not processes or processes < 1:
+        return None
+    if not main_is_guarded():
+        if not _warned:
+            logging.warning("qkit process pool: '%s' has no \"if __name__ == '__main__':\" guard, "
+                            "it would run again in every worker process. Working in the kernel instead."
+                            % getattr(sys.modules.get('__main__'), '__file__', '__main__'))
+            _warned = True
+        return None
+    pool, n = _pools.get(name, (None, 0))
+    if pool is None or n != processes:
+        if pool is not None:
+            pool.shutdown(wait=False)
+        pool = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn'))
+        _pools[name] = (pool, processes)
+    return pool
+
+
+def discard_pool(name):
+    """ drops the pool 'name', e.g. after a worker died (BrokenProcessPool) """
+    pool, _ = _pools.pop(name, (None, 0))
+    if pool is not None:
+        pool.shutdown(wait=False)
+
+
+class InlineExecutor(object):
+    """ submit() interface of a pool, the task is run right away in the calling thread """
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
@@ -22,6 +22,7 @@
 from ctypes import *
 from _Spectrum_M4i2211.errors import errors as _spcm_errors
 from _Spectrum_M4i2211.regs import regs as _spcm_regs
+from _Spectrum_M4i2211.simulation import SimulatedSpcm
 from qkit.core.instrument_base import Instrument
 import pickle
 from time import sleep, time
@@ -29,6 +30,7 @@ import types
 import logging
 import numpy
 import platform
+from math import gcd
 
 class Spectrum_M4i2211(Instrument):
     '''
@@ -48,7 +50,7 @@ class Spectrum_M4i2211(Instrument):
     7) fix handling of timeout! (not enough triggers detected) (error nr 263)
     '''
 
-    def __init__(self, name):
+    def __init__(self, name, simulate=False):
         '''
         Initializes the dataacquisition card, and communicates with the wrapper.
 
@@ -62,6 +64,7 @@ class Spectrum_M4i2211(Instrument):
 
         Input:
             name (string) : name of the instrument
+            simulate (bool) : use a software simulated card (see _Spectrum_M4i2211/simulation.py)
 
         Output:
             None
@@ -72,6 +75,9 @@ class Spectrum_M4i2211(Instrument):
 
         # Load dll and open connection
         self._card_is_open = False
+        self._simulate = simulate
+        # card mode and loops replaced by start_fifo(), restored by stop_fifo()
+        self._fifo_restore = None
         self._load_dll()
         self._open()
 
@@ -106,6 +112,8 @@ class Spectrum_M4i2211(Instrument):
         self.add_function('force_trigger')
         self.add_function('disable_trigger')
         self.add_function('stop')
+        self.add_function('start_fifo')
+        self.add_function('stop_fifo')
         self.add_function('waitprefull')
         self.add_function('waittrigger')
         self.add_function('waitready')
@@ -162,6 +170,11 @@ class Spectrum_M4i2211(Instrument):
         Output:
             None
         '''
+        if self._simulate:
+            logging.info(__name__ + ' : Using a simulated card')
+            self._spcm_win32 = SimulatedSpcm(_spcm_regs)
+            return
+
         if platform.architecture()[0] == '64bit':
             pf_64Bit = True
         else:
@@ -1260,15 +1273,21 @@ class Spectrum_M4i2211(Instrument):
 ### read data from card
 #######################
 
-    def _buffer_setup(self):
+    def _buffer_setup(self, lNotify=0, lBufsize=None):
         '''
         create a new data buffer
         (assuming the old one is now owned by another part of the program)
+
+        Input:
+            lNotify (int)  : notify size in bytes, the card reports every block of this size
+                             (FIFO mode), 0 reports the whole buffer
+            lBufsize (int) : buffer size in bytes, default: memsize * number of channels
         '''
         self.invalidate_buffer()
         logging.debug(__name__ + ' : _buffer_setup')
-        lMemsize = self.get_memsize()
-        lBufsize = lMemsize * self._numchannels
+        if lBufsize is None:
+            lMemsize = self.get_memsize()
+            lBufsize = lMemsize * self._numchannels
 
         # setup buffer
         #if hasattr(self, '_pbuffer') and (len(self._pbuffer.contents) == lBufsize):
@@ -1285,7 +1304,7 @@ class Spectrum_M4i2211(Instrument):
 
         # tell card to use buffer
         err = self._spcm_win32.DefTransfer64(self._spcm_win32.handel, _spcm_regs.SPCM_BUF_DATA, 1,
-            0, p_data, c_int64(0), c_int64(lBufsize))
+            lNotify, p_data, c_int64(0), c_int64(lBufsize))
         if (err!=0):
             logging.error(__name__ + ' : Error setting up buffer')
             self._get_error()
@@ -1301,6 +1320,8 @@ class Spectrum_M4i2211(Instrument):
 
         # save new buffer possibly freeing old one, will break if DMA is in progress
         self._pbuffer = p_data
+        # numpy view on the DMA memory, no copy
+        self._buffer_view = numpy.frombuffer(a, numpy.int8)
 
 
     def readout_raw_buffer(self, nr_of_channels=1):
@@ -1362,8 +1383,7 @@ class Spectrum_M4i2211(Instrument):
         data = self.readout_raw_buffer()
         if data == 'timeout':
             return data
-        data = numpy.array(data, numpy.float32)
-        data = []
+        data = numpy.frombuffer(data, numpy.int8)
         data = 2.0 * amp * (data / 255.0) + offset
         return data
 
@@ -1371,7 +1391,7 @@ class Spectrum_M4i2211(Instrument):
         lMemsize = self.get_memsize()
         lSegsize = self.get_segmentsize()
 
-        lnumber_of_segments = lMemsize / lSegsize
+        lnumber_of_segments = lMemsize // lSegsize
 
         data = self.readout_raw_buffer()
         if data == 'timeout':
@@ -1386,12 +1406,12 @@ class Spectrum_M4i2211(Instrument):
         amp = float(self.get_input_amp_ch0())
         offset = float(self.get_input_offset_ch0())
 
-        lnumber_of_segments = lMemsize / lSegsize
+        lnumber_of_segments = lMemsize // lSegsize
 
         data = self.readout_raw_buffer()
         if data == 'timeout':
             return data
-        data = numpy.array(data, numpy.float32)
+        data = numpy.frombuffer(data, numpy.int8)
         data = numpy.reshape(data, (lnumber_of_segments, lSegsize))
         data = 2.0 * amp * (data / 255.0) + offset
         return data
@@ -1415,7 +1435,7 @@ class Spectrum_M4i2211(Instrument):
         if data == 'timeout':
             return data
 
-        data = numpy.array(data, numpy.int8)
+        data = numpy.frombuffer(data, numpy.int8, 2*lMemsize)
         data = numpy.reshape(data, (lMemsize, 2))
         return data
 
@@ -1423,7 +1443,7 @@ class Spectrum_M4i2211(Instrument):
         lMemsize = self.get_memsize()
         lSegsize = self.get_segmentsize()
 
-        lnumber_of_segments = lMemsize / lSegsize
+        lnumber_of_segments = lMemsize // lSegsize
 
         data = self.readout_raw_buffer(nr_of_channels=2)
         if data == 'timeout':
@@ -1441,12 +1461,12 @@ class Spectrum_M4i2211(Instrument):
         amp1 = float(self.get_input_amp_ch0())
         offset1 = float(self.get_input_offset_ch1())
 
-        lnumber_of_ssegments = lMemsize / lSegsize
+        lnumber_of_segments = lMemsize // lSegsize
 
         data = self.readout_raw_buffer(nr_of_channels=2)
         if data == 'timeout':
             return data
-        data = numpy.array(data, numpy.int8)
+        data = numpy.frombuffer(data, numpy.int8, 2*lMemsize)
         data = numpy.reshape(data, (lMemsize, 2))
         data0 = data[:,0]
         data1 = data[:,1]
@@ -1457,6 +1477,131 @@ class Spectrum_M4i2211(Instrument):
         return (data0, data1)
 
 
+######################
+### FIFO acquisition
+######################
+
+    def start_fifo(self, segments=0, segments_per_block=None, buffer_blocks=16):
+        '''
+        Starts a streaming acquisition in 'FIFO multiple recording' mode.
+        The card writes the segments continuously into a ring buffer in the
+        PC memory, fifo_blocks() hands out the completed blocks as numpy views
+        on that buffer, without a copy. Segment size, post trigger, channels
+        and trigger are set up as for the standard multiple recording mode.
+
+        Input:
+            segments (int)           : number of segments (triggers) to record, 0 records until stop_fifo()
+            segments_per_block (int) : segments per block handed out by fifo_blocks(), default: the least
+                                       number of segments filling a multiple of 4 kB
+            buffer_blocks (int)      : size of the ring buffer in blocks
+
+        Output:
+            None
+        '''
+        lSegsize = self.get_segmentsize()
+        lSegbytes = lSegsize * self._numchannels
+        # the notify size has to be a multiple of 4 kB
+        lMinsegs = 4096 // gcd(lSegbytes, 4096)
+        if segments_per_block is None:
+            segments_per_block = lMinsegs
+        if segments_per_block % lMinsegs:
+            raise ValueError('segments_per_block must be a multiple of %i for a segment size of %i' % (lMinsegs, lSegsize))
+        if segments % segments_per_block:
+            raise ValueError('segments must be a multiple of segments_per_block (%i)' % segments_per_block)
+        logging.debug(__name__ + ' : Start FIFO acquisition of %s segments in blocks of %s' % (segments, segments_per_block))
+        lNotify = segments_per_block * lSegbytes
+
+        self.stop()
+        if self._fifo_restore is None:
+            self._fifo_restore = (self._get_param32(_spcm_regs.SPC_CARDMODE), self._get_param32(_spcm_regs.SPC_LOOPS))
+        self._set_param(_spcm_regs.SPC_CARDMODE, _spcm_regs.SPC_REC_FIFO_MULTI)
+        self.set_loops(segments)
+        self._buffer_setup(lNotify, buffer_blocks * lNotify)
+        self._fifo_notify = lNotify
+        self._fifo_shape = (segments_per_block, lSegsize, self._numchannels)
+        self._fifo_blocks = segments // segments_per_block if segments else None
+        self._set_param(_spcm_regs.SPC_M2CMD, _spcm_regs.M2CMD_CARD_START | _spcm_regs.M2CMD_CARD_ENABLETRIGGER)
+
+    def fifo_blocks(self, blocks=None):
+        '''
+        Generator of the blocks of a FIFO acquisition started by start_fifo().
+
+        Every block is a view (channel, segment, sample) of int8 on the DMA
+        ring buffer. The block is handed back to the card when the next one is
+        requested, so average or demodulate it in place before, e.g.
+            for block in spec.fifo_blocks():
+                numpy.add(acc, block, out=acc)
+        and copy what has to be kept. The acquisition is stopped when the
+        generator is exhausted or closed.
+
+        Input:
+            blocks (int) : number of blocks, default: all blocks of the acquisition
+                           (endless for segments=0)
+
+        Output:
+            block (int8[channels, segments_per_block, segmentsize])
+        '''
+        lNotify = self._fifo_notify
+        if blocks is None:
+            blocks = self._fifo_blocks
+        nblock = 0
+        try:
+            while blocks is None or nblock < blocks:
+                err = self._set_param(_spcm_regs.SPC_M2CMD, _spcm_regs.M2CMD_DATA_WAITDMA)
+                if err == 263:
+                    raise ValueError('Timeout during FIFO acquisition after %i blocks' % nblock)
+                if self._get_param32(_spcm_regs.SPC_M2STATUS) & _spcm_regs.M2STAT_DATA_OVERRUN:
+                    logging.warning(__name__ + ' : FIFO overrun, data of the card has been lost')
+                lPos = self._get_param32(_spcm_regs.SPC_DATA_AVAIL_USER_POS)
+                block = self._buffer_view[lPos:lPos + lNotify].reshape(self._fifo_shape)
+                yield numpy.rollaxis(block, 2)  # channel, segment, sample
+                # hand the block back to the card
+                self._set_param(_spcm_regs.SPC_DATA_AVAIL_CARD_LEN, lNotify)
+                nblock += 1
+        finally:
+            self.stop_fifo()
+
+    def fifo_average(self, blocks=None):
+        '''
+        Records the blocks of a FIFO acquisition started by start_fifo() and
+        averages them, the sum is accumulated in place while the card fills
+        the next blocks.
+
+        Input:
+            blocks (int) : number of blocks to average, default: all blocks of the acquisition
+
+        Output:
+            data (float[channels, segments_per_block, segmentsize]) : average in units of LSB
+        '''
+        segments_per_block, lSegsize, nchannels = self._fifo_shape
+        acc = numpy.zeros((nchannels, segments_per_block, lSegsize), numpy.int64)
+        nblock = 0
+        for block in self.fifo_blocks(blocks):
+            numpy.add(acc, block, out=acc)
+            nblock += 1
+        return acc / float(max(nblock, 1))
+
+    def stop_fifo(self):
+        '''
+        Stops the card and the DMA transfer of a FIFO acquisition and restores
+        the card mode and loops of the standard acquisition.
+
+        Input:
+            None
+
+        Output:
+            None
+        '''
+        logging.debug(__name__ + ' : Stop FIFO acquisition')
+        self.stop()
+        self._set_param(_spcm_regs.SPC_M2CMD, _spcm_regs.M2CMD_DATA_STOPDMA)
+        if self._fifo_restore is not None:
+            lCardmode, lLoops = self._fifo_restore
+            self._fifo_restore = None
+            self._set_param(_spcm_regs.SPC_CARDMODE, lCardmode)
+            self.set_loops(lLoops)
+
+
 ### test run
 
     def test(self, memsize=2048, posttrigger=1024, amp=500):
@@ -0,0 +1,190 @@
+# simulation.py software stand-in for the Spectrum spcm driver library
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Simulated Spectrum acquisition card.
+
+SimulatedSpcm provides the functions of the spcm library the Spectrum
+drivers load in _load_dll (open, SetParam32, GetParam64, DefTransfer64, ...)
+without a card. Registers are stored, the DMA buffer handed over by
+DefTransfer64 is filled with samples of 'signal' whenever the driver waits
+for data (M2CMD_DATA_WAITDMA, M2CMD_CARD_WAITREADY):
+ - standard mode (notify size 0): the whole buffer once per card start
+ - FIFO mode: one notify block per wait, as long as the user has freed
+   enough of the ring buffer (SPC_DATA_AVAIL_CARD_LEN), the SPC_LOOPS
+   segments (0: endless) are recorded.
+
+Used by the drivers with simulate=True, e.g.
+    spec = qkit.instruments.create('spec', 'Spectrum_M4i2211', simulate=True)
+"""
+
+import logging
+
+import numpy
+
+_ERR_TIMEOUT = 0x0107  # errors.ERR_TIMEOUT, 263
+
+
+def default_signal(sample, segment, channels):
+    """
+    Default test signal: a cosine with a period of 16 samples, shifted by 90 degrees
+    between the channels (I and Q), plus white noise of a few LSB.
+
+    Input:
+        sample (int[n])  : index of the samples within their segment
+        segment (int[n]) : index of the segments
+        channels (int)   : number of channels
+
+    Output:
+        data (float[n, channels]) : the samples in units of LSB
+    """
+    phase = 2 * numpy.pi * sample[:, numpy.newaxis] / 16. - numpy.pi / 2 * numpy.arange(channels)
+    return 60 * numpy.cos(phase) + 4 * numpy.random.randn(len(sample), channels)
+
+
+class SimulatedSpcm(object):
+    '''
+    Software simulated spcm library of a Spectrum card with 8 bit samples.
+
+    Input:
+        regs (class)        : register definitions of the driver
+        signal (function)   : signal(sample, segment, channels), see default_signal
+        ramsize (int)       : reported on-board memory in bytes
+    '''
+
+    def __init__(self, regs, signal=None, ramsize=4*1024**3):
+        self.regs = regs
+        self.signal = signal if signal is not None else default_signal
+        self.ramsize = ramsize
+        self.handel = None
+        self._params = {}
+        self._buffer = None  # numpy view on the DMA buffer
+        self._notify = 0
+        self._reset_transfer()
+
+    def _reset_transfer(self):
+        self._running = False
+        self._status = 0
+        self._samples_done = 0  # samples recorded since card start
+        self._write_pos = 0  # next byte written by the card
+        self._user_pos = 0  # first byte not yet freed by the user
+        self._user_len = 0  # bytes available for the user
+
+    # library functions
+    def open(self, name):
+        return 1
+
+    def close(self, handle):
+        self._running = False
+
+    def SetParam32(self, handle, regnum, regval):
+        regval = getattr(regval, 'value', regval)
+        if regnum == self.regs.SPC_M2CMD:
+            return self._command(regval)
+        if regnum == self.regs.SPC_DATA_AVAIL_CARD_LEN:
+            # the user hands a part of the ring buffer back to the card
+            regval = min(regval, self._user_len)
+            self._user_pos = (self._user_pos + regval) % len(self._buffer)
+            self._user_len -= regval
+            return 0
+        self._params[regnum] = regval
+        return 0
+
+    SetParam64 = SetParam32
+
+    def GetParam32(self, handle, regnum, p_value):
+        p_value.contents.value = self._get(regnum)
+        return 0
+
+    GetParam64 = GetParam32
+
+    def DefTransfer64(self, handle, buffertype, direction, notify, p_data, offset, length):
+        self._buffer = numpy.frombuffer(p_data.contents, numpy.int8)
+        self._notify = int(getattr(notify, 'value', notify))
+        self._reset_transfer()
+        return 0
+
+    def InValidateBuf(self, handle, buffertype):
+        self._buffer = None
+        return 0
+
+    def GetErrorInfo(self, handle, p_reg, p_val, p_text):
+        return 0
+
+    # card
+    def _get(self, regnum):
+        if regnum == self.regs.SPC_DATA_AVAIL_USER_LEN:
+            return self._user_len
+        if regnum == self.regs.SPC_DATA_AVAIL_USER_POS:
+            return self._user_pos
+        if regnum == self.regs.SPC_M2STATUS:
+            return self._status
+        if regnum == self.regs.SPC_PCIMEMSIZE:
+            return self.ramsize
+        return self._params.get(regnum, 0)
+
+    def _command(self, cmd):
+        regs = self.regs
+        if cmd & regs.M2CMD_CARD_RESET:
+            self._params = {}
+            self._reset_transfer()
+        if cmd & (regs.M2CMD_CARD_STOP | regs.M2CMD_DATA_STOPDMA):
+            self._running = False
+        if cmd & regs.M2CMD_CARD_START:
+            self._reset_transfer()
+            self._running = True
+        if cmd & (regs.M2CMD_DATA_WAITDMA | regs.M2CMD_CARD_WAITREADY):
+            return self._acquire()
+        return 0
+
+    def _channels(self):
+        return max(1, bin(self._params.get(self.regs.SPC_CHENABLE, 1)).count('1'))
+
+    def _acquire(self):
+        '''
+        Records the data the driver waits for.
+        Returns 0 or 263 (timeout) if the card is stopped or no more data will come.
+        '''
+        if self._buffer is None or not self._running:
+            return _ERR_TIMEOUT
+        if not self._notify:
+            if self._samples_done == 0:
+                self._record(0, len(self._buffer))
+            return 0
+        if self._user_len >= self._notify:
+            return 0
+        segsize = self._params.get(self.regs.SPC_SEGMENTSIZE, 0) or self._params.get(self.regs.SPC_MEMSIZE, 0) or 1
+        loops = self._params.get(self.regs.SPC_LOOPS, 0)
+        if loops and self._samples_done >= loops * segsize:
+            return _ERR_TIMEOUT
+        if len(self._buffer) - self._user_len < self._notify:
+            # the user did not free the buffer in time
+            logging.warning(__name__ + ' : simulated FIFO overrun')
+            self._status |= self.regs.M2STAT_DATA_OVERRUN
+            return _ERR_TIMEOUT
+        self._record(self._write_pos, self._notify)
+        self._write_pos = (self._write_pos + self._notify) % len(self._buffer)
+        self._user_len += self._notify
+        self._status |= self.regs.M2STAT_DATA_BLOCKREADY
+        return 0
+
+    def _record(self, pos, nbytes):
+        channels = self._channels()
+        segsize = self._params.get(self.regs.SPC_SEGMENTSIZE, 0) or self._params.get(self.regs.SPC_MEMSIZE, 0) or 1
+        index = self._samples_done + numpy.arange(nbytes // channels)
+        data = self.signal(index % segsize, index // segsize, channels)
+        self._buffer[pos:pos + len(index) * channels] = numpy.clip(numpy.round(data), -128, 127).astype(numpy.int8).ravel()
+        self._samples_done += len(index)
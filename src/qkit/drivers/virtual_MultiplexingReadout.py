@@ -43,6 +43,82 @@ from time import sleep
 from qkit.measure.timedomain.awg import load_awg as lawg
 
 
+_ddc_filters = {}  # FIR low pass filters of the decimating DDC, {(decimation, numtaps, cutoff): taps}
+
+
+def ddc_filter(decimation, numtaps, cutoff):
+    """
+    FIR low pass for a decimation by 'decimation', designed once per configuration
+    :param decimation: decimation factor
+    :param numtaps: number of filter taps
+    :param cutoff: cut off frequency relative to the Nyquist frequency of the decimated signal
+    :return: filter taps
+    """
+    key = (int(decimation), int(numtaps), float(cutoff))
+    taps = _ddc_filters.get(key)
+    if taps is None:
+        taps = signal.firwin(numtaps, cutoff / decimation)
+        taps.setflags(write=False)
+        _ddc_filters[key] = taps
+    return taps
+
+
+class DecimatingDDC(object):
+    """
+    Digital down conversion of several tones with decimation.
+
+    All tones are mixed to zero frequency at once (same mixing convention as
+    virtual_MultiplexingReadout.digital_down_conversion), low pass filtered
+    by one FIR filter and decimated. Only every decimation-th output sample
+    of the filter is computed (polyphase decimation), so the filter runs at
+    the output rate. The mixer phase and the filter history are carried
+    between process() calls: a long trace processed chunk by chunk gives the
+    same result as processed at once, and the full-rate intermediates never
+    exceed one chunk. The FIR filter delays the signal by (numtaps-1)/2
+    input samples.
+    """
+
+    def __init__(self, freqs, samplerate, decimation, numtaps=None, cutoff=0.8):
+        """
+        :param freqs: IF frequencies of the tones
+        :param samplerate: sample rate of the input
+        :param decimation: decimation factor, the output rate is samplerate/decimation
+        :param numtaps: number of FIR taps, default 16*decimation+1
+        :param cutoff: cut off frequency relative to the Nyquist frequency of the output
+        """
+        self.freqs = np.atleast_1d(np.asarray(freqs, dtype=float))
+        self.samplerate = float(samplerate)
+        self.decimation = int(decimation)
+        if numtaps is None:
+            numtaps = 16 * self.decimation + 1
+        self.taps = ddc_filter(self.decimation, numtaps, cutoff)
+        self.reset()
+
+    def reset(self):
+        """ start a new stream """
+        self._samples = 0  # input samples processed so far
+        self._history = np.zeros((len(self.freqs), len(self.taps) - 1), dtype=complex)
+
+    def process(self, I, Q):
+        """
+        down convert the next chunk of the stream
+        :param I, Q: next samples of the stream
+        :return: complex baseband signal (samples, tones) of the output samples in this chunk
+        """
+        x = np.asarray(I) + 1j * np.asarray(Q)
+        n = len(x)
+        t = (self._samples + np.arange(n)) / self.samplerate
+        mixed = np.exp(2j * np.pi * np.outer(self.freqs, t)) * x  # tone, sample
+        buf = np.concatenate((self._history, mixed), axis=1)
+        # output samples are at the multiples of decimation of the stream, the window of
+        # an output sample at buf index s + numtaps - 1 starts at buf index s
+        first = -self._samples % self.decimation
+        windows = np.lib.stride_tricks.sliding_window_view(buf, len(self.taps), axis=1)[:, first:n:self.decimation]
+        out = np.einsum('tsk,k->ts', windows, self.taps[::-1])  # tone, sample; on the strided view, without copying the windows
+        self._history = buf[:, buf.shape[1] - self._history.shape[1]:]
+        self._samples += n
+        return out.T
+
 class virtual_MultiplexingReadout(Instrument):
 
     def __init__(self, name, sample):
@@ -128,6 +204,9 @@ class virtual_MultiplexingReadout(Instrument):
         self._adc_channel_Q = 0
         self._phase = 0
         
+        # reference matrices of the tones used by IQ_decode, {(freqs, samplerate, samples): matrix}
+        self._demod_cache = {}
+
         # used for DDC
         self.lowpass_order = 20
         self.cut_off_freq_ratio = 0.8  # ratio of the IQ frequency up to that is transmitted
@@ -275,17 +354,26 @@ class virtual_MultiplexingReadout(Instrument):
             if set to true using IQ_decode
         :param timeTrace: also output raw trace for further processing
         :param ddc: performs a digital down conversion of your readout tone to get the time trace at the frequency of interest
+                    an integer > 1 uses the decimating DDC with this decimation factor
         :return:
         """
         Is, Qs = self._acquire_IQ()
         if ddc is None:
+            # all segments at once
+            sig_amp, sig_pha = self.IQ_decode(Is, Qs)
+        elif not isinstance(ddc, bool) and ddc > 1:
+            ddc = self.get_ddc(ddc)
             if len(Is.shape) == 2:
-                sig_amp = np.zeros((Is.shape[1], len(self._tone_freq)))
-                sig_pha = np.zeros((Is.shape[1], len(self._tone_freq)))
+                sig_amp, sig_pha = [], []
                 for idx in range(Is.shape[1]):
-                    sig_amp[idx, :], sig_pha[idx, :] = self.IQ_decode(Is[:, idx], Qs[:, idx])
+                    ddc.reset()
+                    signal_down_lp = ddc.process(Is[:, idx], Qs[:, idx])
+                    sig_amp.append(np.abs(signal_down_lp))
+                    sig_pha.append(np.angle(signal_down_lp))
+                sig_amp, sig_pha = np.array(sig_amp), np.array(sig_pha)
             else:
-                sig_amp, sig_pha = self.IQ_decode(Is, Qs)
+                signal_down_lp = ddc.process(Is, Qs)
+                sig_amp, sig_pha = np.abs(signal_down_lp), np.angle(signal_down_lp)
         else:
             if len(Is.shape) == 2:
                 sig_amp = np.zeros((Is.shape[1],Is.shape[0], len(self._tone_freq)))
@@ -335,13 +423,14 @@ class virtual_MultiplexingReadout(Instrument):
             return amplitude and phase of requested frequency components
 
             Input:
-                I, Q       - signal acquired at rate samplerate
+                I, Q       - signal acquired at rate samplerate, (samples) or (samples, segments)
                 freqs      - interesting frequency components
                 samplerate - rate at which I and Q were sampled
                 phase      - apply additional rotation to I+1j*Q
 
             Output:
-                two vectors: amplitude and phase of each fft point
+                two vectors: amplitude and phase of each fft point,
+                (segments, freqs) arrays for segmented I and Q
         """
         if samplerate is None: samplerate = self.get_adc_clock()
         if freqs is None: freqs = self._tone_freq
@@ -354,18 +443,77 @@ class virtual_MultiplexingReadout(Instrument):
     def fourieranalysis(self, signal_t, freqs, samplerate):
         """
         useful for only a few samples and freqs because no interpolation is needed
-        :param signal_t: The complex waveform to be analyzed
+        All segments are analyzed at once: by a matrix product with the cached reference matrix of the tones
+        or, if all tones are on the FFT grid of the trace and there are many of them, by picking the FFT bins.
+        :param signal_t: The complex waveform to be analyzed, (samples) or (samples, segments)
         :param freqs: Float or array of Floats of frequencies
         :param samplerate:
-        :return: [amplitudes, phases], each of them being an array over len(freqs)
+        :return: [amplitudes, phases], each of them being an array over len(freqs), (segments, len(freqs)) for segments
         """
         freqs = np.atleast_1d(freqs)
-        w = np.array([np.exp(-2 * np.pi * 1j * f * np.arange(len(signal_t)) / samplerate) for f in freqs])
-        f_signal = np.sum(w * signal_t, axis=1) / len(signal_t)
+        signal_t = np.asarray(signal_t)
+        bins = self._fft_bins(freqs, samplerate, signal_t.shape[0])
+        if bins is None:
+            f_signal = np.dot(self._demodulation_matrix(freqs, samplerate, signal_t.shape[0]), signal_t)
+        else:
+            f_signal = np.fft.fft(signal_t, axis=0)[bins] / signal_t.shape[0]
+        f_signal = f_signal.T  # segment, freq
         sig_amp = np.abs(f_signal)
         sig_pha = np.angle(f_signal)
         return sig_amp, sig_pha
 
+    def _demodulation_matrix(self, freqs, samplerate, samples):
+        """
+        reference matrix exp(-2 pi i f t)/samples of the tones, (len(freqs), samples)
+        it is computed once for a tone list, sample rate and trace length and then taken from the cache
+        """
+        key = (tuple(freqs), float(samplerate), int(samples))
+        w = self._demod_cache.get(key)
+        if w is None:
+            if len(self._demod_cache) >= 8:
+                self._demod_cache.clear()
+            w = np.exp(-2 * np.pi * 1j * np.outer(freqs, np.arange(samples)) / samplerate) / samples
+            self._demod_cache[key] = w
+        return w
+
+    def _fft_bins(self, freqs, samplerate, samples):
+        """
+        FFT bins of freqs, if all of them are on the FFT grid of the trace and the FFT (~log2(samples)
+        operations per sample) is cheaper than the matrix product (len(freqs) operations per sample), else None
+        """
+        if len(freqs) < np.log2(samples):
+            return None
+        k = np.asarray(freqs, dtype=float) * samples / samplerate
+        bins = np.round(k)
+        if np.any(np.abs(k - bins) > 1e-6):
+            return None
+        return bins.astype(int) % samples
+
+    def get_ddc(self, decimation, freqs=None, numtaps=None):
+        """
+        decimating digital down conversion of the tones set, for continuous readout of long traces
+        feed the chunks of a stream to the process(I, Q) method of the returned DecimatingDDC
+        :param decimation: decimation factor
+        :param freqs: IF frequencies, default: tone frequencies - LO
+        :param numtaps: number of FIR taps, default 16*decimation+1
+        :return: DecimatingDDC
+        """
+        if freqs is None:
+            freqs = np.array(self._tone_freq) - self._LO
+        return DecimatingDDC(freqs, self.get_adc_clock(), decimation, numtaps, self.cut_off_freq_ratio)
+
+    def decimating_down_conversion(self, I, Q, decimation, freqs=None):
+        """
+        digital down conversion with decimation by a polyphase FIR filter, see DecimatingDDC
+        :param I:
+        :param Q:
+        :param decimation: decimation factor
+        :param freqs:
+        :return: amplitude and phase, (samples/decimation, tones)
+        """
+        signal_down_lp = self.get_ddc(decimation, freqs).process(I, Q)
+        return np.abs(signal_down_lp), np.angle(signal_down_lp)
+
     def digital_down_conversion(self, I, Q, freqs=None):
         """
         performs a digital down conversion to get rid of the carrier frequency.
@@ -315,7 +315,8 @@ class virtual_measure_spec(Instrument):
         acquire the number of traces specified by the _averages and _blocks parameters
         and return the averaged trace. measurement is done in multiple recording mode.
         '''
-        dat = []
+        # running sum over the records of all blocks, accumulated while the card records the next block
+        total = None
         # measure first block
         self._acquire_multimode_prepare()
         for i in range(self._blocks):
@@ -325,33 +326,13 @@ class virtual_measure_spec(Instrument):
                 raise ValueError("dat_block is empty")
             # background-measure next block
             if (i < self._blocks - 1): self._acquire_multimode_prepare()
-            # process current block
-            # dat_block = numpy.asfarray(dat_block, numpy.float32)
-            # dat_block = numpy.mean(dat_block, axis = 1)
-            if self._segments > 1:
-                # fast averaging
-                sum = numpy.zeros((self._samples, self._numchannels, self._segments), numpy.int32)
-                for j in range(self._numchannels):
-                    for i in range(self._averages):
-                        sum[:, j, :] += dat_block[:, i, j, :]
-                dat_block = numpy.asfarray(sum) / self._averages
+            # process current block: sum over the records, sample, channel(, segment)
+            if total is None:
+                total = numpy.sum(dat_block, axis=1, dtype=numpy.int64)
             else:
-                # fast averaging
-                sum = numpy.zeros((self._samples, self._numchannels), numpy.int32)
-                for j in range(self._numchannels):
-                    for i in range(self._averages):
-                        sum[:, j] += dat_block[:, i, j]
-                dat_block = numpy.asfarray(sum) / self._averages
-
-                # faster averaging over 2d structure
-                # dat_block.shape = (self._averages, self._samples*self._numchannels)
-                # sum = numpy.zeros((self._samples*self._numchannels), numpy.int32)
-                # for i in range(self._averages):
-                #    sum += dat_block[i, :]
-                # dat_block = numpy.asfarray(sum.reshape((self._samples, self._numchannels))) / self._averages
-            dat.append(dat_block)
-        # average over blocks
-        return numpy.mean(numpy.array(dat), axis=0)
+                numpy.add(total, numpy.sum(dat_block, axis=1, dtype=numpy.int64), out=total)
+        # average over records and blocks
+        return total / float(self._averages * self._blocks)
 
     def _acquire_multimode_prepare(self):
         '''
@@ -365,11 +346,14 @@ class virtual_measure_spec(Instrument):
         # self._dacq.start_with_trigger_and_waitready()
         if (self._gate_func): self._gate_func(True)
 
-    def _acquire_multimode_extract(self, blocking=True, averaged=True):
+    def _acquire_multimode_extract(self, blocking=True, averaged=True, accumulate=None):
         '''
         return averaged traces acquired in multiple recording mode.
 
         blocking - if False, return to the main program if acquisition is not complete yet
+        averaged - if False, return the single records (sample, average, channel(, segment))
+        accumulate - int64 array (sample, channel(, segment)) the sum over the records is added to in place,
+                     for a running average over several blocks
         '''
         if (blocking):
             err = self._dacq.waitready()
@@ -382,41 +366,35 @@ class virtual_measure_spec(Instrument):
             if (~(status & 0x4) | ~(status & 0x200)): return None
             # todo: assumes that no error occured when status&4 occurs
 
-        # time is on axis 0
         if (self._numchannels == 2):
             dat = self._dacq.readout_doublechannel_multimode_bin()  # channel, segment, sample
         else:
             dat = self._dacq.readout_singlechannel_multimode_bin()  # channel, segment, sample
-        dat = numpy.swapaxes(dat, 0, 2)  # sample, segment, channel
-        # add segments axis at the end
+        # the records are taken as averages x segments
+        dat = numpy.reshape(dat, (self._numchannels, self._averages, self._segments, self._samples))
+        if accumulate is not None:
+            numpy.add(accumulate, self._multimode_sum(dat), out=accumulate)
+        if (averaged):
+            return self._multimode_average(dat)
+        # time is on axis 0
         if self._segments > 1:
-            dat = numpy.reshape(dat, (self._samples, self._averages, self._segments, self._numchannels))
-            dat = numpy.swapaxes(dat, 2, 3)
-            if (averaged):
-                dat = numpy.asfarray(dat, numpy.float32)
-                dat = numpy.mean(dat, axis=1)  # sample, channel
+            return numpy.transpose(dat, (3, 1, 0, 2))  # sample, average, channel, segment
         else:
-            if (averaged):
-                # two times faster than numpy.mean
-                dat = self._multimode_average(dat)
-        return dat
-
-    def _multimode_average1(self, dat):
-        ''' faster-than-numpy averaging '''
-        shp = dat.shape
-        res = numpy.zeros((shp[0], shp[2]))
-        for i in range(shp[0]):
-            for j in range(shp[2]):
-                res[i, j] = numpy.mean(numpy.asfarray(dat[i, :, j], numpy.float32))
+            return numpy.transpose(dat[:, :, 0, :], (2, 1, 0))  # sample, average, channel
+
+    def _multimode_sum(self, dat):
+        '''
+        sum over the records of dat (channel, average, segment, sample)
+        returns an int64 array (sample, channel, segment), without the segment axis for a single segment
+        '''
+        res = numpy.transpose(numpy.sum(dat, axis=1, dtype=numpy.int64), (2, 0, 1))
+        if self._segments == 1:
+            res = res[:, :, 0]
         return res
 
     def _multimode_average(self, dat):
-        ''' faster-than-numpy averaging '''
-        shp = dat.shape
-        sum = numpy.zeros((shp[0], shp[2]), numpy.int)
-        for i in range(shp[1]):
-            sum += dat[:, i, :]
-        return numpy.array(res, numpy.float32) / shp[1]
+        ''' average over the records of dat (channel, average, segment, sample) '''
+        return numpy.asarray(self._multimode_sum(dat), numpy.float32) / dat.shape[1]
 
     def _acquire_singlemode(self):
         '''
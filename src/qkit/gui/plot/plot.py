@@ -4,6 +4,7 @@ import os
 import numpy as np
 import logging
 import json
+import hashlib
 
 from numpy.core.multiarray import ndarray
 
@@ -13,8 +14,10 @@ import qkit
 from qkit.storage import store
 from qkit.storage.hdf_constants import ds_types
 from qkit.core.lib.misc import str3,concat
+from qkit.core.lib.process_pool import get_pool, discard_pool, InlineExecutor, BrokenProcessPool
 import sys
 
+plot_enable = False
 try:
     if qkit.module_available("matplotlib"):
         import matplotlib.pyplot as plt
@@ -90,18 +93,171 @@ def plot(h5_filepath, datasets=[], refresh = 2, live = True, echo = False):
 
 
 # this is for saving plots
-def save_plots(h5_filepath, comment='', save_pdf=False):
+def save_plots(h5_filepath, comment='', save_pdf=False, processes=None, incremental=None):
     """
     Saves plots of all datasets with default settings.
     
+    The plots are rendered in the calling thread, with 
+    qkit.cfg['save_plots_processes'] > 0 by a pool of worker processes (see 
+    plot_exporter and qkit.core.lib.process_pool).
+    
     Args:
         h5_filepath: String, absolute filepath.
         comment: Optional comment for the plots to be added to the filenames.
             default : ''
         save_pdf: Optional boolean setting for the output file type.
             default: False
+        processes: Optional number of worker processes, 0 renders in the 
+            calling thread, default: qkit.cfg['save_plots_processes'] or 0
+        incremental: Optional boolean, skip datasets that did not change since
+            the last export, default: qkit.cfg['save_plots_incremental'] or True
+    """
+    if processes is None:
+        processes = qkit.cfg.get('save_plots_processes', 0)
+    if incremental is None:
+        incremental = qkit.cfg.get('save_plots_incremental', True)
+    plot_exporter(processes, incremental).export(h5_filepath, comment=comment, save_pdf=save_pdf)
+
+
+def _save_name(filedir, ds_url, comment=''):
+    """Name of the image file (without extension) of the dataset ds_url."""
+    save_name = str(os.path.basename(filedir))[0:6] + '_' + ds_url.replace('/entry/','').replace('/','_')
+    if comment:
+        save_name = save_name+'_'+comment
+    return save_name
+
+
+def _export_dataset(h5_filepath, ds_url, comment, save_pdf, digest):
+    """Task of plot_exporter: renders ds_url unless its content digest equals
+    'digest' (None renders always). Returns the digest of the dataset.
+    """
+    p = h5plot(h5_filepath, comment=comment, save_pdf=save_pdf, datasets=[ds_url], digests={ds_url: digest}, mode='r')
+    return p.digests.get(ds_url)
+
+
+class plot_exporter(object):
     """
-    h5plot(h5_filepath, comment=comment, save_pdf=save_pdf)
+    plot_exporter saves the default plots of h5 files, optionally with a pool
+    of worker processes.
+
+    Every dataset is an own task. With processes > 0 the plots of a file are 
+    rendered in parallel and matplotlib does not compete with a running 
+    measurement for the GIL. Without a pool (processes = 0, a script without
+    __main__ guard, see qkit.core.lib.process_pool) or after a worker died,
+    the plots are rendered in the calling thread. A manifest '.plots.json' in the image folder keeps the mtime and
+    size of the h5 file and a digest of the content of every plotted dataset 
+    (including its axes). With incremental=True datasets are skipped if the 
+    file is unchanged or their digest matches and the image exists.
+    """
+    manifest_name = '.plots.json'
+    plot_types = (ds_types['vector'], ds_types['matrix'], ds_types['box'], ds_types['view'])
+
+    def __init__(self, processes=2, incremental=True):
+        self.processes = max(0, int(processes))
+        self.incremental = incremental
+
+    def export(self, h5_filepath, comment='', save_pdf=False):
+        """Saves the plots of one h5 file, returns the number of rendered datasets."""
+        return self.export_files([h5_filepath], comment=comment, save_pdf=save_pdf)
+
+    def export_dir(self, path, comment='', save_pdf=False):
+        """Saves the plots of all h5 files below path, e.g. a whole run folder."""
+        h5_filepaths = []
+        for root, dirs, files in os.walk(path):
+            dirs[:] = [d for d in dirs if d != 'images']
+            h5_filepaths += [os.path.join(root, f) for f in sorted(files) if f.endswith('.h5')]
+        return self.export_files(h5_filepaths, comment=comment, save_pdf=save_pdf)
+
+    def export_files(self, h5_filepaths, comment='', save_pdf=False):
+        """Submits the datasets of all files to the pool and updates the
+        manifests as the tasks finish. Returns the number of rendered datasets.
+        """
+        if not plot_enable or not qkit.cfg.get('save_png', True):
+            logging.info("plot_exporter: saving plots is disabled (qkit.cfg['save_png'] or matplotlib missing).")
+            return 0
+        pool = get_pool('save_plots', self.processes) or InlineExecutor()
+        jobs = []
+        for h5_filepath in h5_filepaths:
+            try:
+                jobs.append(self._submit(pool, os.path.abspath(h5_filepath), comment, save_pdf))
+            except (IOError, OSError, KeyError) as e:
+                logging.error("plot_exporter: cannot export '%s': %s" % (h5_filepath, e))
+        rendered = 0
+        broken = False
+        for image_dir, manifest, futures in jobs:
+            for save_name, (future, args) in futures.items():
+                old_digest = args[-1]
+                try:
+                    try:
+                        digest = future.result()
+                    except BrokenProcessPool as e:
+                        if not broken:
+                            logging.warning("plot_exporter: worker process died (%s), rendering the plots here." % e)
+                            discard_pool('save_plots')
+                            broken = True
+                        digest = _export_dataset(*args)
+                except Exception as e:
+                    print("Exception in qkit/gui/plot/plot.py while plotting")
+                    print(save_name)
+                    print(e)
+                    continue
+                if digest is None:
+                    continue
+                if digest != old_digest:
+                    rendered += 1
+                manifest['plots'][save_name] = digest
+            self._write_manifest(image_dir, manifest)
+            print('Plots saved in ' + image_dir)
+        return rendered
+
+    def _submit(self, pool, h5_filepath, comment, save_pdf):
+        filedir = os.path.dirname(h5_filepath)
+        image_dir = os.path.join(filedir, 'images')
+        if not os.path.isdir(image_dir):
+            os.mkdir(image_dir)
+        stat = os.stat(h5_filepath)
+        stamp = [stat.st_mtime, stat.st_size]
+        manifest = self._read_manifest(image_dir) if self.incremental else {}
+        unchanged = manifest.get('file') == stamp
+        plots = manifest.get('plots', {}) if self.incremental else {}
+        suffixes = ('.png', '.pdf') if save_pdf else ('.png',)
+
+        futures = {}
+        hf = store.Data(h5_filepath, mode='r')
+        try:
+            for pentry in hf['/entry'].keys():
+                for centry in hf['/entry/'+pentry].keys():
+                    ds_url = '/entry/'+pentry+'/'+centry
+                    attrs = hf[ds_url].attrs
+                    if not attrs.get('save_plot', True) or attrs.get('ds_type', -1) not in self.plot_types:
+                        continue
+                    save_name = _save_name(filedir, ds_url, comment)
+                    exists = all(os.path.exists(os.path.join(image_dir, save_name + suffix)) for suffix in suffixes)
+                    digest = plots.get(save_name) if exists else None
+                    if unchanged and digest is not None:
+                        continue
+                    args = (h5_filepath, ds_url, comment, save_pdf, digest)
+                    futures[save_name] = (pool.submit(_export_dataset, *args), args)
+        finally:
+            hf.close()
+        manifest = {'file': stamp, 'plots': dict(plots)}
+        return image_dir, manifest, futures
+
+    def _read_manifest(self, image_dir):
+        try:
+            with open(os.path.join(image_dir, self.manifest_name)) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _write_manifest(self, image_dir, manifest):
+        path = os.path.join(image_dir, self.manifest_name)
+        try:
+            with open(path + '.tmp', 'w') as f:
+                json.dump(manifest, f)
+            os.replace(path + '.tmp', path)
+        except (IOError, OSError) as e:
+            logging.warning("plot_exporter: cannot write manifest '%s': %s" % (path, e))
 
 
 class h5plot(object):
@@ -114,11 +270,17 @@ class h5plot(object):
     """
     y_data = None  # type: ndarray
 
-    def __init__(self,h5_filepath, comment='', save_pdf=False):
+    def __init__(self,h5_filepath, comment='', save_pdf=False, datasets=None, digests=None, mode='r+'):
         """Inits h5plot with a h5_filepath (string, absolute path), optional 
         comment string, and optional save_pdf boolean.
+        Optionally only the dataset urls in 'datasets' are plotted. If a dict
+        'digests' {ds_url: digest} is given, the content digest of every
+        dataset is computed and stored in it, datasets whose digest did not
+        change are not plotted again. The plot_exporter workers open the 
+        file with mode 'r', as several of them read it at the same time.
         """
-        if not plot_enable or not qkit.module_available("matplotlib"):
+        self.digests = digests
+        if not plot_enable:
             logging.warning("matplotlib not installed. I can not save your measurement files as png. I will disable this function.")
             qkit.cfg['save_png'] = False
         if not qkit.cfg.get('save_png',True):
@@ -131,31 +293,62 @@ class h5plot(object):
         self.filedir  = os.path.dirname(filepath)   #return directory component of the given pathname, here filepath
 
         self.image_dir = os.path.join(self.filedir,'images')
-        try:
-            os.mkdir(self.image_dir)
-        except OSError:
-            logging.warning('Error creating image directory.')
-            pass
+        if not os.path.isdir(self.image_dir):
+            try:
+                os.mkdir(self.image_dir)
+            except OSError:
+                logging.warning('Error creating image directory.')
 
         # open the h5 file and get the hdf_lib object
-        self.hf = store.Data(self.path)
+        self.hf = store.Data(self.path, mode=mode)
 
         # check for datasets
-        for i, pentry in enumerate(self.hf['/entry'].keys()):
-            key='/entry/'+pentry
-            for j, centry in enumerate(self.hf[key].keys()):
-                try:
-                    self.key='/entry/'+pentry+"/"+centry
-                    self.ds = self.hf[self.key]
-                    if self.ds.attrs.get('save_plot', True):
-                        self.plt() # this is the plot function
-                except Exception as e:
-                    print("Exception in qkit/gui/plot/plot.py while plotting")
-                    print(self.key)
-                    print(e)
+        if datasets is None:
+            datasets = ['/entry/'+pentry+'/'+centry for pentry in self.hf['/entry'].keys()
+                        for centry in self.hf['/entry/'+pentry].keys()]
+        for key in datasets:
+            try:
+                self.key = key
+                self.ds = self.hf[self.key]
+                if self.ds.attrs.get('save_plot', True):
+                    if self.digests is not None:
+                        digest = self._digest()
+                        if digest == self.digests.get(self.key):
+                            continue
+                    self.plt() # this is the plot function
+                    if self.digests is not None:
+                        self.digests[self.key] = digest
+            except Exception as e:
+                print("Exception in qkit/gui/plot/plot.py while plotting")
+                print(self.key)
+                print(e)
         #close hf file
         self.hf.close()
-        print('Plots saved in ' + self.image_dir)
+        if self.digests is None:
+            print('Plots saved in ' + self.image_dir)
+
+    def _digest(self):
+        """
+        Digest of the attributes and the content of the dataset and of all
+        datasets it is plotted against, used to detect unchanged plots.
+        """
+        h = hashlib.blake2b(digest_size=16)
+        urls = [self.key]
+        for k in sorted(self.ds.attrs.keys()):
+            h.update(k.encode() + repr(self.ds.attrs[k]).encode())
+            if k.endswith('_ds_url') or k.startswith('xy_'):
+                urls += str3(self.ds.attrs[k]).split(':')
+        for url in urls:
+            try:
+                data = np.asarray(self.hf[url])
+            except (KeyError, ValueError):
+                continue
+            h.update(repr((url, data.shape, data.dtype.str)).encode())
+            if data.dtype.hasobject:
+                h.update(repr(data.tolist()).encode())
+            else:
+                h.update(np.ascontiguousarray(data).tobytes())
+        return h.hexdigest()
 
     def plt(self):
         """
@@ -210,9 +403,7 @@ class h5plot(object):
         for i in self.ax.get_yticklabels():
             i.set_fontsize(16)
 
-        save_name = str(os.path.basename(self.filedir))[0:6] + '_' + self.key.replace('/entry/','').replace('/','_')
-        if self.comment:
-            save_name = save_name+'_'+self.comment
+        save_name = _save_name(self.filedir, self.key, self.comment)
         image_path = str(os.path.join(self.image_dir,save_name))
 
         if self.save_pdf:
@@ -513,12 +704,20 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(
     description="plot.py hdf and matplotlib-based plotting of datasets / KIT 2015")
 
-    parser.add_argument('-f','--file',required=True,type=str, help='hdf/h5 filename to open')
-    parser.add_argument('-c', '--comment', type=str, help='(optional) comment to append at filenames')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('-f','--file',type=str, help='hdf/h5 filename to open')
+    source.add_argument('-d','--dir',type=str, help='export the plots of all h5 files below this folder, e.g. a run folder')
+    parser.add_argument('-c', '--comment', type=str, default='', help='(optional) comment to append at filenames')
     parser.add_argument('-pdf','--save-pdf', default=False,action='store_true', help='(optional) save default plots')
+    parser.add_argument('-p','--processes', type=int, default=os.cpu_count(), help='(optional) number of worker processes')
+    parser.add_argument('--force', default=False, action='store_true', help='(optional) replot unchanged datasets')
 
     args=parser.parse_args()
 
-    # get the full path
-    filepath= os.path.abspath(args.file)
-    save_plots(filepath,comment=args.comment,save_pdf=args.save_pdf)
+    exporter = plot_exporter(args.processes, incremental=not args.force)
+    if args.dir:
+        n = exporter.export_dir(os.path.abspath(args.dir), comment=args.comment, save_pdf=args.save_pdf)
+    else:
+        # get the full path
+        n = exporter.export(os.path.abspath(args.file), comment=args.comment, save_pdf=args.save_pdf)
+    print("%i plots rendered" % n)
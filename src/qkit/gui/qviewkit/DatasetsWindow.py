@@ -64,7 +64,15 @@ class DatasetsWindow(QMainWindow, Ui_MainWindow):
         
         self.refreshTime_value = 2000
         self.tree_refresh  = True
+        # files written in SWMR mode are kept open and only refreshed,
+        # a full reopen every swmr_reopen_ticks updates structure and attributes
+        self.h5file = None
+        self._swmr = False
+        self._swmr_ticks = 0
+        self.swmr_reopen_ticks = 15
         self._force_live_plot = False
+        # change indicator of every group and dataset, see _ds_signature()
+        self._ds_meta = {}
         self._setup_signal_slots()        
         self.setup_timer()
         self.set_cmd_options()
@@ -104,17 +112,18 @@ class DatasetsWindow(QMainWindow, Ui_MainWindow):
         self.treeWidget.itemSelectionChanged.connect((self.handleSelectionChanged))
                 
         self.refreshTime.valueChanged.connect(self._refresh_time_handler)
-        self.updateButton.released.connect(self.update_file)
+        self.updateButton.released.connect(self._user_refresh)
         
         self.FileButton.clicked.connect(self.open_file)
         self.liveCheckBox.clicked.connect(self.live_update_onoff)
-        self.pw_refresh_signal.connect(self.update_file)
+        self.pw_refresh_signal.connect(self._user_refresh)
 
     def closeEvent(self, event):
         widgetList = QApplication.topLevelWidgets()
 
         self.DATA._remove_plot_widgets( closeAll = True)
         self.DATA.set_info_thread_continue(False)
+        self._close_h5file()
         event.accept()
     
     @pyqtSlot()
@@ -143,25 +152,30 @@ class DatasetsWindow(QMainWindow, Ui_MainWindow):
         """
         populate_data_list is called regularly withing the refresh cycle to
         update the data tree.
+        Tree items are only added for new groups and datasets, the info
+        strings are only regenerated for datasets whose signature changed.
+        The urls of the changed datasets are stored in DATA.changed_ds and
+        tell the plot windows whether they have to redraw.
         """
         self.parent = self.treeWidget.invisibleRootItem()
         column = 0
-        parents = []
-        s=""
+        changed = set()
         """itterate over the whole entry tree and collect the attributes """
-        for i,pentry in enumerate(self.h5file["/entry"].keys()):
+        for pentry in self.h5file["/entry"].keys():
             tree_key = "/entry/"+pentry
+            group = self.h5file[tree_key]
             if tree_key not in self.DATA.ds_tree_items:
                 parent = self.addParent(self.parent, column, str(pentry))
                 self.DATA.ds_tree_items[tree_key] = parent
-                parents.append(parent)
             else:
                 parent = self.DATA.ds_tree_items[tree_key]
-                
-            s= "comment:\t"+str3(self.h5file[tree_key].attrs.get('comment',""))+"\n"
-            self.DATA.dataset_info[tree_key] = s
+
+            signature = len(group.attrs)
+            if self._ds_meta.get(tree_key) != signature:
+                self._ds_meta[tree_key] = signature
+                self.DATA.dataset_info[tree_key] = "comment:\t"+str3(group.attrs.get('comment',""))+"\n"
             
-            for j,centry in enumerate(self.h5file[tree_key].keys()):
+            for centry in group.keys():
                 tree_key = "/entry/"+pentry+"/"+centry
                 if tree_key not in self.DATA.ds_tree_items:
                     item = self.addChild(parent, column, str(centry),tree_key)
@@ -172,20 +186,43 @@ class DatasetsWindow(QMainWindow, Ui_MainWindow):
                         self.DATA.append_plot(self,item,tree_key)
                         item.setCheckState(0,QtCore.Qt.Checked)
                         self.update_plots()
-                       
+
+                ds = group[centry]
+                try:
+                    signature = self._ds_signature(ds)
+                except ValueError as e:
+                    print("catch: populate data list:",e)
+                    continue
+                if self._ds_meta.get(tree_key) == signature:
+                    continue
+                self._ds_meta[tree_key] = signature
+                changed.add(tree_key)
+
                 s = ""
                 try:
-                    s="shape\t"+str(self.h5file[tree_key].shape)+"\n"
-                    for k in list(self.h5file[tree_key].attrs.keys()):
-                        s += k + "\t" + str3(self.h5file[tree_key].attrs[k]) + "\n"
+                    s="shape\t"+str(ds.shape)+"\n"
+                    for k in list(ds.attrs.keys()):
+                        s += k + "\t" + str3(ds.attrs[k]) + "\n"
                 except TypeError:
-                    s="shape\t"+str(self.h5file[tree_key].shape)+"\n"
-                    for k in list(self.h5file[tree_key].attrs.keys()): 
-                        s += k + "\t" + str(self.h5file[tree_key].attrs[k]) + "\n"
+                    s="shape\t"+str(ds.shape)+"\n"
+                    for k in list(ds.attrs.keys()): 
+                        s += k + "\t" + str(ds.attrs[k]) + "\n"
                 except ValueError as e:
                     print("catch: populate data list:",e)
                 
                 self.DATA.dataset_info[tree_key] = s
+        self.DATA.changed_ds = changed
+
+    def _ds_signature(self, ds):
+        """Cheap change indicator of a dataset: shape and attribute values, 
+        which include 'fill', the 'rewrites' counter of data overwritten in
+        place and e.g. the 'average' progress of transport measurements.
+        """
+        attrs = []
+        for k, v in ds.attrs.items():
+            # arrays are compared by their content
+            attrs.append((k, v.tobytes() if hasattr(v, 'tobytes') else v))
+        return (ds.shape, tuple(attrs))
                
     def addParent(self, parent, column, title,data = ''):
         item = QtGui.QTreeWidgetItem(parent, [title])
@@ -236,15 +273,67 @@ class DatasetsWindow(QMainWindow, Ui_MainWindow):
             self.Dataset_properties.insertPlainText(self.DATA.dataset_info[ds])
  
             
+    def _open_h5file(self):
+        """Opens the data file. A file that is still written in SWMR mode is 
+        reopened as SWMR reader and kept open.
+        """
+        was_swmr = self._swmr
+        self._close_h5file()
+        if not was_swmr:
+            self.h5file = h5py.File(str(self.DATA.DataFilePath),mode='r')
+            was_swmr = self.h5file.attrs.get('_swmr', False) and self.h5file['entry'].attrs.get('updating', False)
+            if was_swmr:
+                self.h5file.close()
+        if was_swmr:
+            try:
+                self.h5file = h5py.File(str(self.DATA.DataFilePath), mode='r', libver='latest', swmr=True)
+                # keep the file open as long as the measurement is running
+                self._swmr = bool(self.h5file['entry'].attrs.get('updating', False))
+            except (IOError, ValueError) as e:
+                # e.g. the writer has not switched to SWMR mode yet
+                qkit.logging.info("Qviewkit/DatasetsWindow.py: Could not open file as SWMR reader: "+str(e))
+                self.h5file = h5py.File(str(self.DATA.DataFilePath),mode='r')
+        self._swmr_ticks = 0
+
+    def _close_h5file(self):
+        if self.h5file:
+            self.h5file.close()
+        self._swmr = False
+
+    def _refresh_h5file(self):
+        """Refreshes the displayed datasets and their axes of a SWMR file."""
+        urls = set(self.DATA.open_ds.keys())
+        for url in list(urls):
+            try:
+                attrs = self.h5file[url].attrs
+                for k in attrs.keys():
+                    if k.endswith('_ds_url') or k.startswith('xy_'):
+                        urls.update(str3(attrs[k]).split(':'))
+            except (KeyError, ValueError):
+                pass
+        for url in urls:
+            try:
+                ds = self.h5file[url]
+                if isinstance(ds, h5py.Dataset):
+                    ds.refresh()
+            except (KeyError, ValueError):
+                pass
+        self._swmr_ticks += 1
+
     def update_file(self):
         "update_file is regularly called when _something_ has to be updated. open-> do something->close"
         try:
-            self.h5file= h5py.File(str(self.DATA.DataFilePath),mode='r')
+            if self._swmr and self.h5file and self._swmr_ticks < self.swmr_reopen_ticks:
+                self._refresh_h5file()
+            else:
+                self._open_h5file()
             self.DATA.filename = self.h5file.filename.split(os.path.sep)[-1]
             self.populate_data_list()
             self.update_plots()
+            self.DATA.redraw_all = False
             self._disable_live_update()
-            self.h5file.close()
+            if not self._swmr:
+                self.h5file.close()
             
             s = (self.DATA.DataFilePath.split(os.path.sep)[-5:])
             self.statusBar().showMessage((os.path.sep).join(s for s in s))
@@ -262,6 +351,9 @@ class DatasetsWindow(QMainWindow, Ui_MainWindow):
             
         if _DataFilePath:
             self.DATA.DataFilePath = _DataFilePath
+            self._close_h5file()
+            self._ds_meta = {}
+            self.DATA.redraw_all = True
             self.h5file= h5py.File(self.DATA.DataFilePath,mode='r')
             self.DATA.filename = self.h5file.filename.split(os.path.sep)[-1]
             self.populate_data_list()
@@ -272,5 +364,10 @@ class DatasetsWindow(QMainWindow, Ui_MainWindow):
             title = "Qviewkit: %s"%(self.DATA.DataFilePath.split(os.path.sep)[-1:][0][:6])
             self.setWindowTitle(title)
             
+    def _user_refresh(self):
+        "a user interaction (or the update button) redraws all plot windows, changed data or not"
+        self.DATA.redraw_all = True
+        self.update_file()
+
     def update_plots(self):
         self.refresh_signal.emit()
\ No newline at end of file
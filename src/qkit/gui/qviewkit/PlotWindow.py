@@ -32,7 +32,7 @@ import qkit
 from qkit.gui.qviewkit.plot_view import Ui_Form
 from qkit.storage.hdf_constants import ds_types, view_types
 from qkit.gui.qviewkit.PlotWindow_lib import _display_1D_view, _display_1D_data, _display_2D_data, _display_table, _display_text
-from qkit.gui.qviewkit.PlotWindow_lib import _get_ds, _get_ds_url, _get_name, _get_unit
+from qkit.gui.qviewkit.PlotWindow_lib import _get_ds, _get_ds_url, _get_name, _get_unit, _filled_shape
 from qkit.core.lib.misc import str3
 
 class PlotWindow(QWidget,Ui_Form):
@@ -101,6 +101,9 @@ class PlotWindow(QWidget,Ui_Form):
         except ValueError as e:
             print(str(self.dataset_url)+": "+str(e))
             return
+        if not (self._windowJustCreated or self.DATA.redraw_all or self._data_changed()):
+            # neither the data nor the user settings changed since the last tick
+            return
         self.ds_type = self.ds.attrs.get('ds_type', -1)
         
         # The axis names are parsed to plot_view's Ui_Form class to label the UI selectors 
@@ -208,6 +211,14 @@ class PlotWindow(QWidget,Ui_Form):
             print(e)
 
 
+    def _data_changed(self):
+        """True if the displayed dataset or one it is plotted against changed in the last refresh."""
+        urls = {self.dataset_url}
+        for k in self.ds.attrs.keys():
+            if k.endswith('_ds_url') or k.startswith('xy_'):
+                urls.update(str3(self.ds.attrs[k]).split(':'))
+        return not self.DATA.changed_ds.isdisjoint(urls)
+
     def _setup_signal_slots(self):
         """Depending on the dataset type the possible signal slots are created
         
@@ -538,9 +549,9 @@ class PlotWindow(QWidget,Ui_Form):
         if x_ds is None:
             return "__none__"
         if ds.attrs.get('ds_type') == ds_types['box']:
-            x_data = np.array(x_ds)[:ds.attrs.get('fill')[0]]
+            x_data = x_ds[:ds.attrs.get('fill')[0]]
         else:
-            x_data = np.array(x_ds)[:ds.shape[0]]
+            x_data = x_ds[:_filled_shape(ds)[0]]
         xunit = _get_unit(x_ds)
         try:
             xval = x_data[num]
@@ -551,9 +562,9 @@ class PlotWindow(QWidget,Ui_Form):
     def _getYValueFromTraceNum(self,ds,num):
         y_ds = _get_ds(ds, ds.attrs.get('y_ds_url'))
         if ds.attrs.get('ds_type') == ds_types['box']:
-            y_data = np.array(y_ds)[:ds.attrs.get('fill')[1]]
+            y_data = y_ds[:ds.attrs.get('fill')[1]]
         else:
-            y_data = np.array(y_ds)[:ds.shape[1]]
+            y_data = y_ds[:ds.shape[1]]
         yunit = _get_unit(y_ds)
         try:
             yval = y_data[num]
@@ -563,7 +574,7 @@ class PlotWindow(QWidget,Ui_Form):
 
     def _getZValueFromTraceNum(self,ds,num):
         z_ds = _get_ds(ds, ds.attrs.get('z_ds_url'))
-        z_data = np.array(z_ds)[:ds.shape[2]]
+        z_data = z_ds[:ds.shape[2]]
         zunit = _get_unit(z_ds)
         try:
             zval = z_data[num]
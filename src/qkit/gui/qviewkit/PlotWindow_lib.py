@@ -30,10 +30,12 @@ if not in_pyqt5:
         sys.exit(-1)
 
 import numpy as np
+import h5py
 import json
 import pyqtgraph as pg
 import qkit
 from qkit.storage.hdf_constants import ds_types
+from qkit.storage import hdf_lod
 import pprint
 from qkit.core.lib.misc import str3
 
@@ -55,6 +57,9 @@ def _display_1D_view(self, graphicsView):
     """
     
     graphicsView.clear()
+    # min/max decimation to the screen resolution, recomputed on zoom
+    graphicsView.plotItem.setDownsampling(auto=True, mode='peak')
+    graphicsView.plotItem.setClipToView(True)
     
     if not graphicsView.plotItem.legend:
         graphicsView.plotItem.addLegend(size=(160, 48), offset=(30, 15))
@@ -86,10 +91,10 @@ def _display_1D_view(self, graphicsView):
                     self.VTraceXSelector.setEnabled(False)
                     self.VTraceYSelector.setEnabled(False)
                     
-                    x_data = dss[0][()]
-                    y_data = dss[1][()]
+                    x_data = _read_slice(self, dss[0], (slice(None),))
+                    y_data = _read_slice(self, dss[1], (slice(None),))
                     if err_url:
-                        err_data = dss[2][()]
+                        err_data = _read_slice(self, dss[2], (slice(None),))
                     
                     # prevent a crash when the two datasets have a different length
                     # solution: truncate the longer dataset to the length of the shorter
@@ -106,27 +111,27 @@ def _display_1D_view(self, graphicsView):
                 elif y_ds_type == ds_types['matrix']:
                     if view_params.get('transpose',False):
                         self.VTraceYSelector.setEnabled(True)
-                        range_max = dss[1].shape[1]
+                        range_max = _filled_shape(dss[1])[1]
                         if self.VTraceXSelector.isEnabled(): #Hack to see if the window is freshly generated
                             self.VTraceXSelector.setEnabled(False)
                             self.VTraceYSelector.setValue(view_params.get('default_trace',range_max //2))
                         self.VTraceYSelector.setRange(-1 * range_max, range_max - 1)
                         self.VTraceYValue.setText(self._getYValueFromTraceNum(dss[1], self.VTraceYNum))
-                        x_data = dss[0][()]
-                        y_data = dss[1][:,self.VTraceYNum]
+                        x_data = _read_slice(self, dss[0], (slice(None),))
+                        y_data = _read_slice(self, dss[1], (slice(None), self.VTraceYNum))
                         if err_url:
-                            err_data = dss[2][:,self.VTraceYNum]
+                            err_data = _read_slice(self, dss[2], (slice(None), self.VTraceYNum))
                     else:
                         self.VTraceXSelector.setEnabled(True)
-                        range_max = dss[1].shape[0]
+                        range_max = _filled_shape(dss[1])[0]
                         self.VTraceXSelector.setRange(-1 * range_max, range_max - 1)
                         self.VTraceXValue.setText(self._getXValueFromTraceNum(dss[1], self.VTraceXNum))
                         self.VTraceYSelector.setEnabled(False)
                         
-                        x_data = dss[0][()]
-                        y_data = dss[1][()][self.VTraceXNum]
+                        x_data = _read_slice(self, dss[0], (slice(None),))
+                        y_data = _read_slice(self, dss[1], (self.VTraceXNum, slice(None)))
                         if err_url:
-                            err_data = dss[2][()][self.VTraceXNum]
+                            err_data = _read_slice(self, dss[2], (self.VTraceXNum, slice(None)))
                     x_data_len = len(x_data)
                     y_data_len = len(y_data)
                     if x_data_len != y_data_len:
@@ -137,43 +142,43 @@ def _display_1D_view(self, graphicsView):
                 
                 elif y_ds_type == ds_types['box']:
                     self.VTraceXSelector.setEnabled(True)
-                    range_maxX = dss[1].shape[0]
+                    range_maxX = _filled_shape(dss[1])[0]
                     self.VTraceXSelector.setRange(-1 * range_maxX, range_maxX - 1)
                     self.VTraceXValue.setText(self._getXValueFromTraceNum(dss[1], self.VTraceXNum))
                     self.VTraceYSelector.setEnabled(True)
-                    range_maxY = dss[1].shape[1]
+                    range_maxY = _filled_shape(dss[1])[1]
                     self.VTraceYSelector.setRange(-1 * range_maxY, range_maxY - 1)
                     self.VTraceYValue.setText(self._getYValueFromTraceNum(dss[1], self.VTraceYNum))
                     
-                    x_data = dss[0][()]
-                    y_data = dss[1][()][self.VTraceXNum, self.VTraceYNum, :]
+                    x_data = _read_slice(self, dss[0], (slice(None),))
+                    y_data = _read_slice(self, dss[1], (self.VTraceXNum, self.VTraceYNum, slice(None)))
                     if err_url:
-                        err_data = dss[2][()][self.VTraceXNum, self.VTraceYNum, :]
+                        err_data = _read_slice(self, dss[2], (self.VTraceXNum, self.VTraceYNum, slice(None)))
             
             ## This is in our case used so far only for IQ plots. The
             ## functionality derives from this application.
             elif x_ds_type == ds_types['matrix']:
                 self.VTraceXSelector.setEnabled(True)
-                range_max = np.minimum(dss[0].shape[0], dss[1].shape[0])
+                range_max = np.minimum(_filled_shape(dss[0])[0], _filled_shape(dss[1])[0])
                 self.VTraceXSelector.setRange(-1 * range_max, range_max - 1)
                 self.VTraceXValue.setText(self._getXValueFromTraceNum(dss[1], self.VTraceXNum))
                 self.VTraceYSelector.setEnabled(False)
                 
-                x_data = dss[0][()][self.VTraceXNum]
-                y_data = dss[1][()][self.VTraceXNum]
+                x_data = _read_slice(self, dss[0], (self.VTraceXNum, slice(None)))
+                y_data = _read_slice(self, dss[1], (self.VTraceXNum, slice(None)))
             
             elif x_ds_type == ds_types['box']:
                 self.VTraceXSelector.setEnabled(True)
-                range_maxX = dss[1].shape[0]
+                range_maxX = _filled_shape(dss[1])[0]
                 self.VTraceXSelector.setRange(-1 * range_maxX, range_maxX - 1)
                 self.VTraceXValue.setText(self._getXValueFromTraceNum(dss[1], self.VTraceXNum))
                 self.VTraceYSelector.setEnabled(True)
-                range_maxY = dss[1].shape[1]
+                range_maxY = _filled_shape(dss[1])[1]
                 self.VTraceYSelector.setRange(-1 * range_maxY, range_maxY - 1)
                 self.VTraceYValue.setText(self._getYValueFromTraceNum(dss[1], self.VTraceYNum))
                 
-                x_data = dss[0][()][self.VTraceXNum, self.VTraceYNum, :]
-                y_data = dss[1][()][self.VTraceXNum, self.VTraceYNum, :]
+                x_data = _read_slice(self, dss[0], (self.VTraceXNum, self.VTraceYNum, slice(None)))
+                y_data = _read_slice(self, dss[1], (self.VTraceXNum, self.VTraceYNum, slice(None)))
             
             else:
                 return
@@ -275,12 +280,12 @@ def _display_1D_data(self, graphicsView):
         # timestamps do (not?) have a x_ds_url in the 1d case. This is more a bug to be fixed in the
         # timstamp_ds part of qkit the resulting error is fixed here for now.
         try:
-            x_data = dss[0][()][:dss[1].shape[-1]]  # x_data gets truncated to y_data shape if necessarry
+            x_data = dss[0][:_filled_shape(dss[1])[-1]]  # x_data gets truncated to y_data shape if necessarry
         except:
-            x_data = [i for i in range(dss[1].shape[-1])]
+            x_data = [i for i in range(_filled_shape(dss[1])[-1])]
             units[0] = "#"
             names[0] = "data point number"
-        y_data = dss[1][()]
+        y_data = _read_slice(self, dss[1], (slice(None),))
     
     elif self.ds_type == ds_types['coordinate']:
         ## a coordinate does not have any coordinate. it gets plotted against the entry index.
@@ -293,7 +298,7 @@ def _display_1D_data(self, graphicsView):
         # timestamps do (not?) have a x_ds_url in the 1d case. This is more a bug to be fixed in the
         # timstamp_ds part of qkit the resulting error is fixed here for now.
         x_data = [i for i in range(dss[0].shape[-1])]
-        y_data = dss[0][()]
+        y_data = _read_slice(self, dss[0], (slice(None),))
     
     elif self.ds_type == ds_types['matrix'] or (self.ds_type == -1 and len(self.ds.shape) == 2):  # last expresson is for old hdf-files
         """
@@ -301,7 +306,7 @@ def _display_1D_data(self, graphicsView):
         """
         if self.PlotTypeSelector.currentIndex() == 1:  # y_ds on x-axis
             dss, names, units, scales = _get_all_ds_names_units_scales(self.ds, ['y_ds_url'])
-            self.TraceXSelector.setRange(-1 * self.ds.shape[0], self.ds.shape[0] - 1)
+            self.TraceXSelector.setRange(-1 * _filled_shape(self.ds)[0], _filled_shape(self.ds)[0] - 1)
             if self.TraceXValueChanged:
                 """
                 If the trace to be displayed has been changed, the correct dataslice and the displayed
@@ -314,8 +319,8 @@ def _display_1D_data(self, graphicsView):
                 self.TraceXSelector.setValue(self.TraceXNum)
                 self.TraceXValueChanged = False
             
-            y_data = dss[1][()][self.TraceXNum]
-            x_data = dss[0][()][:dss[1].shape[-1]]  # x_data gets truncated to y_data shape if neccessary
+            y_data = _read_slice(self, dss[1], (self.TraceXNum, slice(None)))
+            x_data = dss[0][:dss[1].shape[-1]]  # x_data gets truncated to y_data shape if neccessary
         
         if self.PlotTypeSelector.currentIndex() == 2:  # x_ds on x-axis
             dss, names, units, scales = _get_all_ds_names_units_scales(self.ds, ['x_ds_url'])
@@ -333,8 +338,8 @@ def _display_1D_data(self, graphicsView):
                 self.TraceYSelector.setValue(self.TraceYNum)
                 self.TraceYValueChanged = False
             
-            y_data = dss[1][()][:, self.TraceYNum]
-            x_data = dss[0][()][:dss[1].shape[0]]  # x_data gets truncated to y_data shape if neccessary
+            y_data = _read_slice(self, dss[1], (slice(None), self.TraceYNum))
+            x_data = dss[0][:_filled_shape(dss[1])[0]]  # x_data gets truncated to y_data shape if neccessary
         
         self.TraceXValue.setText(self._getXValueFromTraceNum(self.ds, self.TraceXNum))
         self.TraceYValue.setText(self._getYValueFromTraceNum(self.ds, self.TraceYNum))
@@ -345,9 +350,10 @@ def _display_1D_data(self, graphicsView):
         """
         For a box type. Z data is displayed along the chosen axes in the viewer
         """
-        self.TraceXSelector.setRange(-1 * self.ds.shape[0], self.ds.shape[0] - 1)
-        self.TraceYSelector.setRange(-1 * self.ds.shape[1], self.ds.shape[1] - 1)
-        self.TraceZSelector.setRange(-1 * self.ds.shape[2], self.ds.shape[2] - 1)
+        shape = _filled_shape(self.ds)
+        self.TraceXSelector.setRange(-1 * shape[0], shape[0] - 1)
+        self.TraceYSelector.setRange(-1 * shape[1], shape[1] - 1)
+        self.TraceZSelector.setRange(-1 * shape[2], shape[2] - 1)
 
         if self.TraceXValueChanged:
             """
@@ -391,16 +397,16 @@ def _display_1D_data(self, graphicsView):
 
         if self.PlotTypeSelector.currentIndex() == 5:
             dss, names, units, scales = _get_all_ds_names_units_scales(self.ds, ['z_ds_url'])
-            x_data = dss[0][()][:dss[1].shape[2]]  # x_data gets truncated to y_data shape if neccessary
-            y_data = dss[1][()][self.TraceXNum, self.TraceYNum, :]
+            x_data = dss[0][:dss[1].shape[2]]  # x_data gets truncated to y_data shape if neccessary
+            y_data = _read_slice(self, dss[1], (self.TraceXNum, self.TraceYNum, slice(None)))
         if self.PlotTypeSelector.currentIndex() == 4:
             dss, names, units, scales = _get_all_ds_names_units_scales(self.ds, ['y_ds_url'])
-            x_data = dss[0][()][:dss[1].shape[1]]
-            y_data = dss[1][()][self.TraceXNum, :, self.TraceZNum]
+            x_data = dss[0][:dss[1].shape[1]]
+            y_data = _read_slice(self, dss[1], (self.TraceXNum, slice(None), self.TraceZNum))
         if self.PlotTypeSelector.currentIndex() == 3:
             dss, names, units, scales = _get_all_ds_names_units_scales(self.ds, ['x_ds_url'])
-            x_data = dss[0][()][:dss[1].shape[0]]
-            y_data = dss[1][()][:, self.TraceYNum, self.TraceZNum]
+            x_data = dss[0][:_filled_shape(dss[1])[0]]
+            y_data = _read_slice(self, dss[1], (slice(None), self.TraceYNum, self.TraceZNum))
 
     
     ## Any data manipulation (dB <-> lin scale, etc) is done here
@@ -418,6 +424,10 @@ def _display_1D_data(self, graphicsView):
     elif y_data.shape[-1] == 1:
         self.plot_style = self.plot_styles['point']
 
+    # min/max decimation to the screen resolution, recomputed on zoom
+    graphicsView.getPlotItem().setDownsampling(auto=True, mode='peak')
+    graphicsView.getPlotItem().setClipToView(True)
+
     if self.plot_style == self.plot_styles['line']:
         graphicsView.plot(y=y_data, x=x_data, clear=True, pen=(200, 200, 100), connect='finite')
         self.linestyle_selector.line.setChecked(True)
@@ -531,24 +541,39 @@ def _display_2D_data(self, graphicsView):
         The matrix ds-type only knows one 2d plotting option. x_ds on x- and y_ds on y-axis
         """
         dss, names, units, scales = _get_all_ds_names_units_scales(self.ds, ['x_ds_url', 'y_ds_url'])
+        # large matrices of completed files are displayed from a pyramid level, see hdf_lod
+        lods = _lod_levels(dss[2])
+        factor, lod = _lod_pick(lods, _filled_shape(dss[2]), (graphicsView.width(), graphicsView.height())) if lods else (1, None)
         try:
-          data = dss[2][()]
+          if factor == 1:
+              data = _read_slice(self, dss[2], (slice(None), slice(None)))
+          else:
+              data = lod[()]
         except IOError as e:
               print("Could not open data file")
               print(e)
               return
+        if factor > 1:
+            # the file is closed between refreshes, the zoom handler reopens it
+            self._lod = (dss[2].file.filename, [(f, l.name) for f, l in lods], factor, list(scales), _filled_shape(dss[2]))
+            scales = list(scales)
+            for i in (0, 1):
+                scales[i] = (scales[i][0] + (factor - 1) / 2. * scales[i][1], factor * scales[i][1])
+        else:
+            self._lod = None
         
-        fill_x = dss[2].shape[0]
-        fill_y = dss[2].shape[1]
+        fill_x = data.shape[0]
+        fill_y = data.shape[1]
         self.TraceXValue.setText(self._getXValueFromTraceNum(self.ds, self.TraceXNum))
         self.TraceYValue.setText(self._getYValueFromTraceNum(self.ds, self.TraceYNum))
     if self.ds_type == ds_types['box']:
+        self._lod = None
         """
         The box ds-type can be plotted from 3 different "viewing directions" (PlotType). Depending on its 
         setting the x- and y-axis are set.
         The ds-type box also has a z_ds_url.
         """
-        self.TraceXSelector.setRange(-1 * self.ds.shape[0], self.ds.shape[0] - 1)
+        self.TraceXSelector.setRange(-1 * _filled_shape(self.ds)[0], _filled_shape(self.ds)[0] - 1)
         self.TraceYSelector.setRange(-1 * self.ds.shape[-1], self.ds.shape[-1] - 1)
         if self.PlotTypeSelector.currentIndex() == 0:  # y_ds on x-axis; z_ds on y-axis
             if self.TraceXValueChanged:
@@ -560,14 +585,14 @@ def _display_2D_data(self, graphicsView):
             
             dss, names, units, scales = _get_all_ds_names_units_scales(self.ds, ['y_ds_url', 'z_ds_url'])
             try:
-              data = dss[2][()][self.TraceXNum, :, :]
+              data = _read_slice(self, dss[2], (self.TraceXNum, slice(None), slice(None)))
             except IOError as e:
               print("Could not open data file")
               print(e)
               return
             
-            fill_x = dss[2].shape[1]
-            fill_y = dss[2].shape[2]
+            fill_x = data.shape[0]
+            fill_y = data.shape[1]
         
         if self.PlotTypeSelector.currentIndex() == 1:  # x_ds on x-axis; z_ds on y-axis
             if self.TraceYValueChanged:
@@ -579,14 +604,14 @@ def _display_2D_data(self, graphicsView):
             
             dss, names, units, scales = _get_all_ds_names_units_scales(self.ds, ['x_ds_url', 'z_ds_url'])
             try:
-              data = dss[2][()][:, self.TraceYNum, :]
+              data = _read_slice(self, dss[2], (slice(None), self.TraceYNum, slice(None)))
             except IOError as e:
               print("Could not open data file")
               print(e)
               return
             
-            fill_x = dss[2].shape[0]
-            fill_y = dss[2].shape[2]
+            fill_x = data.shape[0]
+            fill_y = data.shape[1]
         
         if self.PlotTypeSelector.currentIndex() == 2:  # x_ds on x-axis; y_ds on y-axis
             if self.TraceZValueChanged:
@@ -598,14 +623,14 @@ def _display_2D_data(self, graphicsView):
             
             dss, names, units, scales = _get_all_ds_names_units_scales(self.ds, ['x_ds_url', 'y_ds_url'])
             try:
-              data = dss[2][()][:, :, self.TraceZNum]
+              data = _read_slice(self, dss[2], (slice(None), slice(None), self.TraceZNum))
             except IOError as e:
               print("Could not open data file")
               print(e)
               return
             
-            fill_x = dss[2].shape[0]
-            fill_y = dss[2].shape[1]
+            fill_x = data.shape[0]
+            fill_y = data.shape[1]
         
         self.TraceXValue.setText(self._getXValueFromTraceNum(self.ds, self.TraceXNum))
         self.TraceYValue.setText(self._getYValueFromTraceNum(self.ds, self.TraceYNum))
@@ -626,6 +651,8 @@ def _display_2D_data(self, graphicsView):
         data[(0,) * len(data.shape)] = 0
         print("Your Data array is all NaN. I set the first value to not blow up graphics window.")
     graphicsView.setImage(data, pos=(scales[0][0] - scales[0][1] / 2., scales[1][0] - scales[1][1] / 2.), scale=(scales[0][1], scales[1][1]))
+    # mean decimation to the screen resolution, recomputed on zoom
+    graphicsView.getImageItem().setOpts(autoDownsample=True)
     graphicsView.show()
     
     # Fixme roi ...
@@ -700,6 +727,13 @@ def _display_2D_data(self, graphicsView):
     self.distance_measure = self.__dict__.get('distance_measure',[False])
     self.proxy2 = pg.SignalProxy(imVi.scene().sigMouseClicked,slot=middleClick)
 
+    # zooming into a matrix displayed from a pyramid level shows the region in finer resolution
+    if self._lod:
+        self.proxy_lod = pg.SignalProxy(imVi.sigRangeChanged, rateLimit=4, slot=lambda *args: _lod_zoom(self, graphicsView))
+    else:
+        self.proxy_lod = None
+    _lod_zoom(self, graphicsView)
+
 
 def _display_table(self, graphicsView):
     """displays the data values in a table.
@@ -717,7 +751,7 @@ def _display_table(self, graphicsView):
     """
     ## ds-type "box" is not (yet?) implemented here. This may be done in the 
     ## future.
-    data = np.array(self.ds)
+    data = self.ds[tuple(slice(0, n) for n in _filled_shape(self.ds))]
     if self.ds_type == ds_types['matrix']:
         data = data.transpose()
     if self.ds_type == ds_types['vector'] or self.ds_type == ds_types['coordinate']:
@@ -775,6 +809,178 @@ def _display_string(ds):
     return txt
 
 
+""" Reading the displayed data """
+
+
+def _filled_shape(ds):
+    """Returns the shape of the written part of a dataset.
+
+    Value datasets can be allocated larger than written (write-behind buffer,
+    preallocate). Their 'fill' attribute holds the number of written
+    traces (matrix) or x slices (box) resp. values (vector).
+
+    Args:
+        ds: hdf_dataset.
+
+    Returns:
+        Tuple with the shape.
+    """
+    shape = ds.shape
+    fill = ds.attrs.get('fill', None)
+    if fill is not None and len(shape) > 0 and 0 < fill[0] < shape[0]:
+        shape = (int(fill[0]),) + tuple(shape[1:])
+    return shape
+
+
+def _read_slice(self, ds, index):
+    """Reads the hyperslab ds[index] of the written part of a dataset.
+
+    index is a tuple of integers (negative ones count from the last written 
+    entry) and full slices, e.g. (-1, slice(None)) for the latest trace of a
+    matrix. Only the selection is read from the file.
+    While the file is updating, the result is cached in the PlotWindow and 
+    on the next call only the entries along the first sliced axis, which 
+    have been appended since, are read and spliced into the cached buffer. 
+    The last cached entry is always read again, as it may have been 
+    incomplete. The cache is dropped when the writer has overwritten data 
+    in place (reset), which it counts in the 'rewrites' attribute.
+    
+    Args:
+        self: Object of the PlotWindow class.
+        ds: hdf_dataset.
+        index: tuple of integers and slice(None).
+
+    Returns:
+        Numpy array with the data (a copy, it can be modified).
+    """
+    shape = _filled_shape(ds)
+    index = tuple(i if isinstance(i, slice) else _normalize_index(i, shape[d]) for d, i in enumerate(index))
+    axes = [d for d, i in enumerate(index) if isinstance(i, slice)]
+    if not axes:
+        return np.array(ds[index])
+    grow = axes[0]
+    n = shape[grow]
+    # number of entries along the grow axis which are known to be complete
+    fill = ds.attrs.get('fill', None)
+    if grow == 0:
+        valid = n
+    elif grow == 1 and fill is not None and index[0] == fill[0] - 1:
+        valid = min(int(fill[1]), n)
+    elif grow == 1:
+        valid = n
+    else:
+        valid = 0
+    
+    try:
+        live = ds.file['entry'].attrs.get('updating', False)
+    except (KeyError, ValueError):
+        live = False
+    cache = self.__dict__.setdefault('_slice_cache', {})
+    key = (ds.file.filename, ds.name, tuple(None if isinstance(i, slice) else i for i in index))
+    other = (tuple(shape[d] for d in axes[1:]), int(ds.attrs.get('rewrites', 0)))
+    entry = cache.pop(key, None)
+    if live and entry is not None and entry[0] == other and entry[2] <= n:
+        _, buf, start = entry
+        start = max(start - 1, 0)
+    else:
+        buf, start = None, 0
+    
+    sel = list(index)
+    sel[grow] = slice(start, n)
+    new = np.asarray(ds[tuple(sel)])
+    if not live:
+        return new
+    if buf is None or buf.shape[0] < n or buf.dtype != new.dtype:
+        old, buf = buf, np.empty((max(n, 2 * start),) + new.shape[1:], dtype=new.dtype)
+        if old is not None and start:
+            buf[:start] = old[:start]
+    buf[start:n] = new
+    cache[key] = (other, buf, valid)
+    while len(cache) > 16:
+        cache.pop(next(iter(cache)))
+    return buf[:n].copy()
+
+
+def _lod_levels(ds):
+    """Returns the level-of-detail pyramid [(factor, dataset)] of a matrix,
+    starting with (1, ds). Empty if there is none or the file is updating.
+    """
+    try:
+        if ds.file['entry'].attrs.get('updating', False):
+            return []
+        levels = hdf_lod.levels(ds)
+    except (KeyError, ValueError):
+        return []
+    return [(1, ds)] + levels if levels else []
+
+
+def _lod_pick(lods, n, pixels):
+    """Returns the coarsest (factor, dataset) of lods which still has one value
+    per pixel for a region of n = (nx, ny) values shown on pixels = (px, py).
+    """
+    best = lods[0]
+    for factor, lod in lods:
+        if n[0] / factor >= pixels[0] and n[1] / factor >= pixels[1]:
+            best = (factor, lod)
+    return best
+
+
+def _lod_zoom(self, graphicsView):
+    """Shows the visible region of a matrix displayed from a pyramid level in
+    the finest needed resolution as an overlay image.
+
+    Args:
+        self: Object of the PlotWindow class.
+        graphicsView: Modified object of pyqtgraph's ImageView class.
+    """
+    detail = self.__dict__.get('_lod_detail', None)
+    lod_state = self.__dict__.get('_lod', None)
+    try:
+        if not lod_state:
+            raise StopIteration
+        filename, lods, factor, scales, n = lod_state
+        vb = graphicsView.getView().getViewBox()
+        region = []
+        for (lo, hi), (x0, dx), size in zip(vb.viewRange(), scales, n):
+            a, b = sorted(((lo - x0) / dx + .5, (hi - x0) / dx + .5))
+            region.append((max(0, int(np.floor(a))), min(size, int(np.ceil(b)))))
+        if any(b <= a for a, b in region):
+            raise StopIteration
+        f, url = _lod_pick(lods, [b - a for a, b in region], (vb.width(), vb.height()))
+        if f >= factor:
+            raise StopIteration
+        (i0, i1), (j0, j1) = [(a // f, -(-b // f)) for a, b in region]
+        with h5py.File(filename, mode='r') as h5f:
+            img = np.array(h5f[url][i0:i1, j0:j1], dtype=float)
+        _, img, _, _, _, _ = _do_data_manipulation(None, img, None, None, None, "", ds_types['vector'], self.manipulation, self.manipulations, colorplot=True)
+        if detail is None or detail.scene() is None:
+            detail = pg.ImageItem()
+            self._lod_detail = detail
+            graphicsView.getView().addItem(detail)
+        imIt = graphicsView.getImageItem()
+        detail.setImage(img, autoLevels=False, levels=imIt.levels)
+        detail.setLookupTable(imIt.lut)
+        tr = pg.QtGui.QTransform()
+        tr.translate(scales[0][0] - scales[0][1] / 2. + i0 * f * scales[0][1], scales[1][0] - scales[1][1] / 2. + j0 * f * scales[1][1])
+        tr.scale(f * scales[0][1], f * scales[1][1])
+        detail.setTransform(tr)
+        detail.setZValue(imIt.zValue() + 1)
+        detail.show()
+    except StopIteration:
+        if detail is not None:
+            detail.hide()
+    except Exception as e:
+        print("Qviewkit level of detail:", e)
+
+
+def _normalize_index(i, n):
+    """Maps a negative index to the corresponding positive one."""
+    i = int(i)
+    if not -n <= i < n:
+        raise IndexError("index %i is out of range for axis with size %i" % (i, n))
+    return i % n
+
+
 """ A few handy methods for label and scale """
 
 
@@ -52,6 +52,10 @@ class DATA(QObject):
     ds_tree_items= {}
     ds_cmd_open = {}
     toBe_deleted = []
+    # urls of the datasets changed in the last refresh and whether the
+    # plot windows have to redraw regardless, see DatasetsWindow.populate_data_list()
+    changed_ds = set()
+    redraw_all = True
     lock = Lock()
     info_thread_continue = True
     "a set of housekeeping functions..."
@@ -49,6 +49,8 @@ class MeasureBase(object):
         self._pb = Progress_Bar(0, dummy=True)
         
         self._file_name = ""
+        self.preallocate = None  # create the datasets at their final shape (None: qkit.cfg['h5_preallocate']), see qkit.storage.store.Data
+        self.swmr = qkit.cfg.get('h5_swmr', False)  # qviewkit follows the file as SWMR reader, see qkit.storage.store.Data
         
         self.log_functions = []
         
@@ -293,7 +295,7 @@ class MeasureBase(object):
                 raise TypeError('{:s}:  {!s} is no valid coordinate object'.format(__name__, c))
         self._create_file_name(data)
         
-        self._data_file = hdf.Data(name=self._file_name, mode='a')
+        self._data_file = hdf.Data(name=self._file_name, mode='a', preallocate=self.preallocate, swmr=self.swmr)
         self._datasets = {}
         self._coordinates = {}
         for d in data:
@@ -341,6 +343,8 @@ class MeasureBase(object):
         if datasets is None:
             datasets = list(self._datasets.keys())
         self._data_file.hf.hf.attrs['default_ds'] = datasets
+        # all datasets and views are added, the file switches to SWMR mode when they are created
+        self._data_file.start_swmr()
         
         if self.open_qviewkit:
             self._qvk_process = qviewkit.plot(self._data_file.get_filepath(), datasets=datasets)
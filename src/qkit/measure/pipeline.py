@@ -0,0 +1,159 @@
+# Pipelined execution of the stages of a measurement point
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue  # python 2
+
+import qkit
+
+
+class MeasurementPipeline(object):
+    """Runs the storage and analysis of a measurement point in a worker thread
+    while the measurement thread already acquires the next point.
+
+    The instruments are only accessed from the measurement thread: it sets the
+    parameters, waits for the sweep and transfers the data, then submit()s the
+    hdf appends and live fits. The jobs are executed one after another in the
+    order of submission, so a live fit reading back the last trace sees the
+    trace appended just before it. The queue is bounded: if storage and fits
+    cannot keep up, submit() blocks (backpressure). An exception in the worker
+    is raised in the measurement thread on the next submit(), sync() or close();
+    jobs queued after a failed one are dropped until then.
+    With threaded=False the jobs are executed directly, only the timings are
+    recorded.
+
+    Every stage (the measurement thread's by stage(), the worker's by the
+    stage name given to submit()) is timed, report() summarizes where the
+    time of a scan is spent. 'wait' is the time the measurement thread was
+    blocked by a full queue.
+    """
+
+    def __init__(self, threaded=True, maxsize=None):
+        """
+        Args:
+            threaded: run the submitted jobs in a worker thread, default: True
+            maxsize: maximum number of queued jobs, default: qkit.cfg['measure_pipeline_depth'] or 4
+        """
+        self.threaded = threaded
+        if maxsize is None:
+            maxsize = qkit.cfg.get('measure_pipeline_depth', 4)
+        self._timings = {}
+        self._lock = threading.Lock()
+        self._error = None
+        self._t_start = time.time()
+        self._t_stop = None
+        self._thread = None
+        if threaded:
+            self._queue = queue.Queue(maxsize=maxsize)
+            self._thread = threading.Thread(target=self._run, name="MeasurementPipeline")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _record(self, name, dt):
+        with self._lock:
+            count, total, longest = self._timings.get(name, (0, 0., 0.))
+            self._timings[name] = (count + 1, total + dt, max(longest, dt))
+
+    @contextmanager
+    def stage(self, name):
+        """Times the enclosed code of the measurement thread as stage 'name'."""
+        t0 = time.time()
+        try:
+            yield
+        finally:
+            self._record(name, time.time() - t0)
+
+    def submit(self, name, func, *args, **kwargs):
+        """Queues func(*args, **kwargs), timed as stage 'name'. Blocks while the queue is full."""
+        self.check()
+        if not self.threaded:
+            with self.stage(name):
+                func(*args, **kwargs)
+            return
+        if not self._thread.is_alive():
+            raise RuntimeError("MeasurementPipeline: The worker thread is not running anymore.")
+        with self.stage('wait'):
+            self._queue.put((name, func, args, kwargs))
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                break
+            name, func, args, kwargs = job
+            try:
+                if self._error is None:
+                    with self.stage(name):
+                        func(*args, **kwargs)
+            except Exception as e:
+                logging.error("MeasurementPipeline: Error in stage '%s': %s" % (name, e))
+                with self._lock:
+                    self._error = e
+            finally:
+                self._queue.task_done()
+
+    def check(self):
+        """Raises an exception that occurred in the worker thread."""
+        with self._lock:
+            error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize() if self.threaded else 0
+
+    def sync(self):
+        """Waits until all queued jobs are done."""
+        if self.threaded:
+            self._queue.join()
+        self.check()
+
+    def close(self):
+        """Executes all queued jobs and stops the worker thread."""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        if self._t_stop is None:
+            self._t_stop = time.time()
+        self.check()
+
+    @property
+    def timings(self):
+        """{stage: (count, total time (s), longest time (s))}"""
+        with self._lock:
+            return dict(self._timings)
+
+    def report(self):
+        """Returns a table of the stage timings."""
+        elapsed = (self._t_stop or time.time()) - self._t_start
+        lines = ["%-10s %8s %10s %10s %10s %7s" % ("stage", "count", "total s", "mean ms", "max ms", "share")]
+        for name, (count, total, longest) in sorted(self.timings.items(), key=lambda t: -t[1][1]):
+            lines.append("%-10s %8d %10.2f %10.2f %10.2f %6.1f%%" % (
+                name, count, total, 1e3 * total / count, 1e3 * longest, 100. * total / elapsed if elapsed else 0.))
+        lines.append("elapsed %.2f s%s" % (elapsed, ", store/fit in worker thread" if self.threaded else ""))
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return "MeasurementPipeline: queue depth %d\n%s" % (self.queue_depth, self.report())
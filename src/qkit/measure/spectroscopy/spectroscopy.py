@@ -33,6 +33,7 @@ from qkit.analysis.resonator import Resonator as resonator
 from qkit.gui.plot import plot as qviewkit
 from qkit.gui.notebook.Progress_Bar import Progress_Bar
 from qkit.measure.measurement_class import Measurement
+from qkit.measure.pipeline import MeasurementPipeline
 import qkit.measure.write_additional_files as waf
 
 
@@ -76,8 +77,15 @@ class spectrum(object):
         self.y_vec = None
 
         self.progress_bar = True
+        self.preallocate = None  # create the datasets at their final shape (None: qkit.cfg['h5_preallocate']), see qkit.storage.store.Data
+        self.swmr = qkit.cfg.get('h5_swmr', False)  # qviewkit follows the file as SWMR reader, see qkit.storage.store.Data
         self._fit_resonator = False
+        self._resonator_stream = False
         self._plot_comment = ""
+        # store and fit a trace in a worker thread while the VNA already sweeps the next one, see qkit.measure.pipeline
+        self.pipelined = qkit.cfg.get('spectroscopy_pipelined', False)
+        self._pipeline = MeasurementPipeline(threaded=False)
+        self._scan_pipeline = self._pipeline  # the pipeline of the last 2D/3D scan, see timings
 
         self.set_log_function()
         self.set_log_function_2D()
@@ -249,7 +257,8 @@ class spectrum(object):
         at this point all measurement parameters are known and put in the output file
         '''
 
-        self._data_file = hdf.Data(name=self._file_name, mode='a')
+        # the live resonator fit writes to the file through a second handle, which SWMR mode does not allow
+        self._data_file = hdf.Data(name=self._file_name, mode='a', preallocate=self.preallocate, swmr=self.swmr and not self._fit_resonator)
         self._measurement_object.uuid = self._data_file._uuid
         self._measurement_object.hdf_relpath = self._data_file._relpath
         self._measurement_object.instruments = qkit.instruments.get_instrument_names()
@@ -376,12 +385,13 @@ class spectrum(object):
             self._file_name += '_' + self.exp_name
         self._prepare_measurement_vna()
         self._prepare_measurement_file()
+        self._data_file.start_swmr()
 
         """opens qviewkit to plot measurement, amp and pha are opened by default"""
         if self.open_qviewkit:
             self._qvk_process = qviewkit.plot(self._data_file.get_filepath(), datasets=['amplitude', 'phase'])
         if self._fit_resonator:
-            self._resonator = resonator(self._data_file.get_filepath())
+            self._start_resonator_fit()
 
         qkit.flow.start()
         if rescan:
@@ -426,7 +436,7 @@ class spectrum(object):
         self._data_real.append(data_real)
         self._data_imag.append(data_imag)
         if self._fit_resonator:
-            self._do_fit_resonator()
+            self._do_fit_resonator(data_amp, data_pha)
 
         qkit.flow.end()
         self._end_measurement()
@@ -470,11 +480,12 @@ class spectrum(object):
             self._data_file.hf.hf.attrs['default_ds'] =['views/amplitude_midpoint', 'views/phase_midpoint']
         else:
             self._data_file.hf.hf.attrs['default_ds'] = ['data0/amplitude_midpoint', 'data0/phase_midpoint']
+        self._data_file.start_swmr()
         
         if self.open_qviewkit:
             self._qvk_process = qviewkit.plot(self._data_file.get_filepath(),datasets=list(self._data_file.hf.hf.attrs['default_ds']))
         if self._fit_resonator:
-            self._resonator = resonator(self._data_file.get_filepath())
+            self._start_resonator_fit()
         self._measure()
 
     def measure_3D(self, web_visible=True):
@@ -510,12 +521,13 @@ class spectrum(object):
 
         self._prepare_measurement_vna()
         self._prepare_measurement_file()
+        self._data_file.start_swmr()
         """opens qviewkit to plot measurement, amp and pha are opened by default"""
         """only middle point in freq array is plotted vs x and y"""
         if self.open_qviewkit: self._qvk_process = qviewkit.plot(self._data_file.get_filepath(),
                                                                  datasets=['amplitude', 'phase'])
         if self._fit_resonator:
-            self._resonator = resonator(self._data_file.get_filepath())
+            self._start_resonator_fit()
 
         if self.progress_bar:
             if self.landscape.xylandscapes:
@@ -563,23 +575,27 @@ class spectrum(object):
         '''
         measures and plots the data depending on the measurement type.
         the measurement loops feature the setting of the objects and saving the data in the .h5 file.
+        With self.pipelined, the hdf appends and live fits of a point are done
+        by a worker thread while the VNA already sweeps the next point.
         '''
         qkit.flow.start()
+        self._pipeline = MeasurementPipeline(threaded=self.pipelined)
         try:
             """
             loop: x_obj with parameters from x_vec
             """
             for ix, x in enumerate(self.x_vec):
-                self.x_set_obj(x)
-                sleep(self.tdx)
+                with self._pipeline.stage('set'):
+                    self.x_set_obj(x)
+                    sleep(self.tdx)
 
                 if self.log_function != None:
-                    for i, f in enumerate(self.log_function):
-                        self._log_value[i].append(float(f()))
+                    values = [float(f()) for f in self.log_function]
+                    self._pipeline.submit('store', self._append_log_values, self._log_value, values)
 
                 if self.log_function_2D != None:
-                    for i, f in enumerate(self.log_function_2D):
-                        self._log_value_2D[i].append(f())
+                    values = [f() for f in self.log_function_2D]
+                    self._pipeline.submit('store', self._append_log_values, self._log_value_2D, values)
 
                 if self._scan_dim == 3:
                     for y in self.y_vec:
@@ -589,86 +605,113 @@ class spectrum(object):
                             data_amp = np.full(int(self._nop), np.NaN, dtype=np.float16)
                             data_pha = np.full(int(self._nop), np.NaN, dtype=np.float16)  # fill with NaNs
                         else:
-                            self.y_set_obj(y)
-                            sleep(self.tdy)
-                            if self.averaging_start_ready:
-                                self.vna.start_measurement()
-                                # Check if the VNA is STILL in ready state, then add some delay.
-                                # If you manually decrease the poll_inveral, I guess you know what you are doing and will disable this safety query.
-                                if self.vna_poll_interval >= 0.1 and self.vna.ready():
-                                    logging.debug("VNA STILL ready... Adding delay")
-                                    qkit.flow.sleep(
-                                        .2)  # just to make sure, the ready command does not *still* show ready
-
-                                while not self.vna.ready():
-                                    qkit.flow.sleep(min(self.vna.get_sweeptime_averages(query=False) / 11., self.vna_poll_interval))
-                            else:
-                                self.vna.avg_clear()
-                                qkit.flow.sleep(self._sweeptime_averages)
+                            with self._pipeline.stage('set'):
+                                self.y_set_obj(y)
+                                sleep(self.tdy)
+                            with self._pipeline.stage('sweep'):
+                                if self.averaging_start_ready:
+                                    self.vna.start_measurement()
+                                    # Check if the VNA is STILL in ready state, then add some delay.
+                                    # If you manually decrease the poll_inveral, I guess you know what you are doing and will disable this safety query.
+                                    if self.vna_poll_interval >= 0.1 and self.vna.ready():
+                                        logging.debug("VNA STILL ready... Adding delay")
+                                        qkit.flow.sleep(
+                                            .2)  # just to make sure, the ready command does not *still* show ready
+
+                                    while not self.vna.ready():
+                                        qkit.flow.sleep(min(self.vna.get_sweeptime_averages(query=False) / 11., self.vna_poll_interval))
+                                else:
+                                    self.vna.avg_clear()
+                                    qkit.flow.sleep(self._sweeptime_averages)
 
                             # if "avg_status" in self.vna.get_function_names():
                             #       while self.vna.avg_status() < self.vna.get_averages():
                             #            qkit.flow.sleep(.2) #maybe one would like to adjust this at a later point
 
                             """ measurement """
-                            if not self.landscape.xzlandscape_func:  # normal scan
-                                data_amp, data_pha = self.vna.get_tracedata()
-                            else:
-                                data_amp, data_pha = self.landscape.get_tracedata_xz(x)
+                            with self._pipeline.stage('transfer'):
+                                if not self.landscape.xzlandscape_func:  # normal scan
+                                    data_amp, data_pha = self.vna.get_tracedata()
+                                else:
+                                    data_amp, data_pha = self.landscape.get_tracedata_xz(x)
                             if self.progress_bar:
                                 self._p.iterate()
 
                         if self._nop == 0:  # this does not work yet.
                             print(data_amp[0], data_amp, self._nop)
-                            self._data_amp.append(data_amp[0])
-                            self._data_pha.append(data_pha[0])
+                            self._pipeline.submit('store', self._append, data_amp[0], data_pha[0])
                         else:
-                            self._data_amp.append(data_amp)
-                            self._data_pha.append(data_pha)
+                            self._pipeline.submit('store', self._append, data_amp, data_pha)
                         if self._fit_resonator:
-                            self._do_fit_resonator()
+                            self._pipeline.submit('fit', self._do_fit_resonator, data_amp, data_pha)
                         qkit.flow.sleep()
                     """
                     filling of value-box is done here.
                     after every y-loop the data is stored the next 2d structure
                     """
-                    self._data_amp.next_matrix()
-                    self._data_pha.next_matrix()
+                    self._pipeline.submit('store', self._next_matrix)
 
                 if self._scan_dim == 2:
-                    if self.averaging_start_ready:
-                        self.vna.start_measurement()
-                        if self.vna.ready():
-                            logging.debug("VNA STILL ready... Adding delay")
-                            qkit.flow.sleep(.2)  # just to make sure, the ready command does not *still* show ready
-
-                        while not self.vna.ready():
-                            qkit.flow.sleep(min(self.vna.get_sweeptime_averages(query=False) / 11., .2))
-                    else:
-                        self.vna.avg_clear()
-                        qkit.flow.sleep(self._sweeptime_averages)
+                    with self._pipeline.stage('sweep'):
+                        if self.averaging_start_ready:
+                            self.vna.start_measurement()
+                            if self.vna.ready():
+                                logging.debug("VNA STILL ready... Adding delay")
+                                qkit.flow.sleep(.2)  # just to make sure, the ready command does not *still* show ready
+
+                            while not self.vna.ready():
+                                qkit.flow.sleep(min(self.vna.get_sweeptime_averages(query=False) / 11., .2))
+                        else:
+                            self.vna.avg_clear()
+                            qkit.flow.sleep(self._sweeptime_averages)
                     """ measurement """
-                    if not self.landscape.xzlandscape_func:  # normal scan
-                        data_amp, data_pha = self.vna.get_tracedata()
-                    else:
-                        data_amp, data_pha = self.landscape.get_tracedata_xz(x)
-                    self._data_amp.append(data_amp)
-                    self._data_pha.append(data_pha)
+                    with self._pipeline.stage('transfer'):
+                        if not self.landscape.xzlandscape_func:  # normal scan
+                            data_amp, data_pha = self.vna.get_tracedata()
+                        else:
+                            data_amp, data_pha = self.landscape.get_tracedata_xz(x)
+                    self._pipeline.submit('store', self._append, data_amp, data_pha)
 
                     if self._fit_resonator:
-                        self._do_fit_resonator()
+                        self._pipeline.submit('fit', self._do_fit_resonator, data_amp, data_pha)
                     if self.progress_bar:
                         self._p.iterate()
                     qkit.flow.sleep()
         finally:
-            self._end_measurement()
-            qkit.flow.end()
+            try:
+                self._pipeline.close()
+            finally:
+                self._end_measurement()
+                qkit.flow.end()
+                if self.pipelined:
+                    print(self._pipeline.report())
+                # the worker thread is stopped, later measurements store directly
+                self._scan_pipeline, self._pipeline = self._pipeline, MeasurementPipeline(threaded=False)
+
+    @property
+    def timings(self):
+        '''Per-stage timings {stage: (count, total s, longest s)} of the last 2D/3D scan, see MeasurementPipeline.report()'''
+        return self._scan_pipeline.timings
+
+    def _append(self, amplitude, phase):
+        self._data_amp.append(amplitude)
+        self._data_pha.append(phase)
+
+    def _append_log_values(self, datasets, values):
+        for ds, value in zip(datasets, values):
+            ds.append(value)
+
+    def _next_matrix(self):
+        self._data_amp.next_matrix()
+        self._data_pha.next_matrix()
 
     def _end_measurement(self):
         '''
         the data file is closed and filepath is printed
         '''
         print(self._data_file.get_filepath())
+        if self._fit_resonator and getattr(self, '_resonator', None) is not None and self._resonator_stream:
+            self._resonator.close()  # writes the pending fit results
         # qviewkit.save_plots(self._data_file.get_filepath(),comment=self._plot_comment) #old version where we have to wait for the plots
         t = threading.Thread(target=qviewkit.save_plots, args=[self._data_file.get_filepath(), self._plot_comment])
         t.start()
@@ -699,15 +742,35 @@ class spectrum(object):
                 'Fit function not properly set. Must be either \'lorentzian\', \'skewed_lorentzian\', \'circle_fit_reflection\', \'circle_fit_notch\', \'fano\', or \'all_fits\'.')
         else:
             self._fit_resonator = True
+            self._fit_function_name = fit_function
             self._f_min = f_min
             self._f_max = f_max
 
-    def _do_fit_resonator(self):
+    def _start_resonator_fit(self):
+        '''
+        creates the resonator for the live fit. In 1D and 2D scans the traces are
+        streamed to it as they are measured (see Resonator.stream), so the cost of
+        a fit does not grow with the number of traces and the results are written
+        by a background thread. 3D and time scans fit the last trace of the file.
+        '''
+        self._resonator_stream = (self._scan_dim < 3 and not self._scan_time and
+                                  self._fit_function_name in resonator.stream_functions)
+        self._resonator = resonator(self._data_file.get_filepath(), threaded=True if self._resonator_stream else None)
+        if self._resonator_stream:
+            self._resonator.stream(self._fit_function_name, self._freqpoints, f_min=self._f_min, f_max=self._f_max,
+                                   x_co=self._data_x if self._scan_dim == 2 else None,
+                                   y_co=self._data_freq, ds_amp=self._data_amp, ds_pha=self._data_pha)
+
+    def _do_fit_resonator(self, amplitude=None, phase=None):
         '''
         calls fit function in resonator class
         fit function is specified in self.set_fit, with boundaries f_mim and f_max
         only the last 'slice' of data is fitted, since we fit live while measuring.
+        A streaming resonator fits the given trace, otherwise it is read back from the file.
         '''
+        if self._resonator_stream and amplitude is not None:
+            self._resonator.push_trace(amplitude, phase)
+            return
 
         if self._fit_function == 0:  # lorentzian
             self._resonator.fit_lorentzian(f_min=self._f_min, f_max=self._f_max)
@@ -28,9 +28,10 @@ if qkit.module_available("matplotlib"):
 if qkit.module_available("scipy"):
     from scipy.optimize import curve_fit
     from scipy.interpolate import interp1d, UnivariateSpline
-from qkit.analysis.resonator import Resonator as resonator
+from qkit.analysis.resonator import Resonator as resonator, fit_lorentzian_trace
 from qkit.gui.notebook.Progress_Bar import Progress_Bar
 from qkit.measure.measurement_base import MeasureBase
+from qkit.measure.pipeline import MeasurementPipeline
 
 
 ##################################################################
@@ -60,10 +61,20 @@ class spectrum(MeasureBase):
         
         self.landscape = Landscape(vna=vna, spec=self)
         self._fit_resonator = False
+        self._resonator_stream = False
         self._measurement_object.measurement_type = 'SpectroscopyMeasurement'
         self._views = []
         self._scan_time = False
         self._segments = [] # bool([]) == False
+        # store and fit a trace in a worker thread while the VNA already sweeps the next one, see qkit.measure.pipeline
+        self.pipelined = qkit.cfg.get('spectroscopy_pipelined', False)
+        self._pipeline = MeasurementPipeline(threaded=False)
+        self._scan_pipeline = self._pipeline  # the pipeline of the last 2D/3D scan, see timings
+    
+    @property
+    def timings(self):
+        """Per-stage timings {stage: (count, total s, longest s)} of the last 2D/3D scan, see MeasurementPipeline.report()"""
+        return self._scan_pipeline.timings
     
     def set_x_parameters(self, vec, coordname, set_obj, unit, dt=None):
         """
@@ -186,6 +197,8 @@ class spectrum(MeasureBase):
                 self.Data("phase", [f], "rad")])
         
         self._open_qviewkit(datasets=[] if len(self._segments)>4 else None)
+        if self._fit_resonator:
+            self._start_resonator_fit()
         
         qkit.flow.start()
         if rescan:
@@ -222,7 +235,7 @@ class spectrum(MeasureBase):
         
         self._append(data_amp,data_pha,data_real,data_imag)
         if self._fit_resonator:
-            self._do_fit_resonator()
+            self._do_fit_resonator(data_amp, data_pha)
         self._end_measurement()
     
     def measure_2D(self):
@@ -231,8 +244,9 @@ class spectrum(MeasureBase):
         for all parameters x_vec in x_obj
         """
         
-        if self.landscape.xzlandscape_func:  # The vna limits need to be adjusted, happens in the frequency wrapper
+        if self.landscape.xzlandscape_func or self.landscape.adaptive:  # The vna limits need to be adjusted, happens in the frequency wrapper
             self._x_parameter.set_function = self.landscape.vna_frequency_wrapper(self._x_parameter.set_function)
+        self.landscape._reset_trackers()
         
         self._dim = 2
         self._measurement_object.measurement_func = 'measure_2D'
@@ -264,7 +278,7 @@ class spectrum(MeasureBase):
             self._open_qviewkit(datasets=[] if len(self._segments)>4 else None)
         
         if self._fit_resonator:
-            self._resonator = resonator(self._data_file.get_filepath())
+            self._start_resonator_fit()
         self._measure()
     
     def measure_3D(self):
@@ -275,8 +289,9 @@ class spectrum(MeasureBase):
         self.span is the range (in units of the vertical plot axis) data is taken around the specified funtion(s)
         note: make sure to have properly set x,y vectors before generating traces
         """
-        if self.landscape.xzlandscape_func:  # The vna limits need to be adjusted, happens in the frequency wrapper
+        if self.landscape.xzlandscape_func or self.landscape.adaptive:  # The vna limits need to be adjusted, happens in the frequency wrapper
             self._x_parameter.set_function = self.landscape.vna_frequency_wrapper(self._x_parameter.set_function)
+        self.landscape._reset_trackers()
 
         self._dim = 3
         self._measurement_object.measurement_func = 'measure_3D'
@@ -295,7 +310,7 @@ class spectrum(MeasureBase):
         self._open_qviewkit(datasets=[] if len(self._segments)>4 else None)
         
         if self._fit_resonator:
-            self._resonator = resonator(self._data_file.get_filepath())
+            self._start_resonator_fit()
         
         if self.progress_bar:
             if self.landscape.xylandscapes:  # ToDo: This part could be part of the Landscape class
@@ -368,23 +383,48 @@ class spectrum(MeasureBase):
             self._end_measurement()
             self._scan_time = False
     
+    def _prepare_measurement_file(self, data, coords=()):
+        """the windows of an adaptive landscape scan are recorded as log datasets"""
+        logs = self.landscape._adaptive_log_functions() if self._measurement_object.measurement_func in ('measure_2D', 'measure_3D') else []
+        self.log_functions += logs
+        try:
+            super(spectrum, self)._prepare_measurement_file(data, coords)
+        finally:
+            for log in logs:
+                self.log_functions.remove(log)
+    
     def _acquire_vna_data(self):
-        if self.averaging_start_ready:
-            self.vna.start_measurement()
-            if self._scan_time:
-                qkit.flow.sleep(self.vna.get_sweeptime(query=False))  # to prevent timeouts in time scan
-            elif self.vna.ready():
-                logging.debug("VNA STILL ready... Adding delay")
-                qkit.flow.sleep(.2)  # just to make sure, the ready command does not *still* show ready
-            
-            while not self.vna.ready():
-                qkit.flow.sleep(min(self.vna.get_sweeptime_averages(query=False) / 11., .2))
-        else:
-            self.vna.avg_clear()
-            qkit.flow.sleep(self._sweeptime_averages)
+        with self._pipeline.stage('sweep'):
+            if self.averaging_start_ready:
+                self.vna.start_measurement()
+                if self._scan_time:
+                    qkit.flow.sleep(self.vna.get_sweeptime(query=False))  # to prevent timeouts in time scan
+                elif self.vna.ready():
+                    logging.debug("VNA STILL ready... Adding delay")
+                    qkit.flow.sleep(.2)  # just to make sure, the ready command does not *still* show ready
+                
+                while not self.vna.ready():
+                    qkit.flow.sleep(min(self.vna.get_sweeptime_averages(query=False) / 11., .2))
+            else:
+                self.vna.avg_clear()
+                qkit.flow.sleep(self._sweeptime_averages)
         
         """ measurement """
-        return self.vna.get_tracedata()
+        with self._pipeline.stage('transfer'):
+            return self.vna.get_tracedata()
+    
+    def _acquire_log_functions(self):
+        """the instruments are queried in the measurement thread, the values are stored by the pipeline"""
+        values = [func() for [ds, func] in self._log_datasets]
+        self._pipeline.submit('store', self._append_log_values, values)
+    
+    def _append_log_values(self, values):
+        for [ds, func], value in zip(self._log_datasets, values):
+            ds.append([value])
+    
+    def _next_matrix(self):
+        for d in self._datasets.values():
+            d.next_matrix()
     
     def _append(self,amplitude,phase,real=None,imag=None):
         if self._segments:
@@ -405,15 +445,21 @@ class spectrum(MeasureBase):
         """
         measures and plots the data depending on the measurement type.
         the measurement loops feature the setting of the objects and saving the data in the .h5 file.
+        With self.pipelined, the hdf appends and live fits of a point are done
+        by a worker thread while the VNA already sweeps the next point.
+        The VNA itself is only accessed from this thread: the trace of a point 
+        is transferred before the next sweep is started.
         """
         qkit.flow.start()
+        self._pipeline = MeasurementPipeline(threaded=self.pipelined)
         try:
             """
             loop: x_obj with parameters from x_vec
             """
             for ix, x in enumerate(self._x_parameter.values):
-                self._x_parameter.set_function(x)
-                qkit.flow.sleep(self._x_parameter.wait_time)
+                with self._pipeline.stage('set'):
+                    self._x_parameter.set_function(x)
+                    qkit.flow.sleep(self._x_parameter.wait_time)
                 
                 self._acquire_log_functions()
     
@@ -425,35 +471,49 @@ class spectrum(MeasureBase):
                             data_amp = np.full(int(self._nop), np.NaN, dtype=np.float16)
                             data_pha = np.full(int(self._nop), np.NaN, dtype=np.float16)  # fill with NaNs
                         else:
-                            self._y_parameter.set_function(y)
-                            qkit.flow.sleep(self._y_parameter.wait_time)
+                            with self._pipeline.stage('set'):
+                                self._y_parameter.set_function(y)
+                                qkit.flow.sleep(self._y_parameter.wait_time)
                             if not self.landscape.xzlandscape_func:  # normal scan
                                 data_amp, data_pha = self._acquire_vna_data()
                             else:
                                 data_amp, data_pha = self.landscape.get_tracedata_xz(x)
+                            self.landscape._trace_measured(x, y, data_amp, data_pha)
                             self._pb.iterate()
-                        self._append(data_amp,data_pha)
+                        self._pipeline.submit('store', self._append, data_amp, data_pha)
                         if self._fit_resonator:
-                            self._do_fit_resonator()
+                            self._pipeline.submit('fit', self._do_fit_resonator, data_amp, data_pha)
                         qkit.flow.sleep()
                     """
                     filling of value-box is done here.
                     after every y-loop the data is stored the next 2d structure
                     """
-                    [d.next_matrix() for d in self._datasets.values()]
+                    self._pipeline.submit('store', self._next_matrix)
     
                 if self._dim == 2:
-                    data_amp, data_pha = self._acquire_vna_data()
-                    self._append(data_amp, data_pha)
+                    if not self.landscape.xzlandscape_func:  # normal scan
+                        data_amp, data_pha = self._acquire_vna_data()
+                    else:
+                        data_amp, data_pha = self.landscape.get_tracedata_xz(x)
+                    self._pipeline.submit('store', self._append, data_amp, data_pha)
                     
                     if self._fit_resonator:
-                        self._do_fit_resonator()
+                        self._pipeline.submit('fit', self._do_fit_resonator, data_amp, data_pha)
                     self._pb.iterate()
                     qkit.flow.sleep()
         finally:
-            self._end_measurement()
+            try:
+                self._pipeline.close()
+            finally:
+                self._end_measurement()
+                if self.pipelined:
+                    print(self._pipeline.report())
+                # the worker thread is stopped, later measurements store directly
+                self._scan_pipeline, self._pipeline = self._pipeline, MeasurementPipeline(threaded=False)
     
     def _end_measurement(self):
+        if self._fit_resonator and getattr(self, '_resonator', None) is not None and self._resonator_stream:
+            self._resonator.close()  # writes the pending fit results
         super(spectrum, self)._end_measurement()
         if self.averaging_start_ready: self.vna.post_measurement()
     
@@ -478,15 +538,35 @@ class spectrum(MeasureBase):
                     'Fit function not properly set. Must be either \'lorentzian\', \'skewed_lorentzian\', \'circle_fit_reflection\', \'circle_fit_notch\', \'fano\', or \'all_fits\'.')
         else:
             self._fit_resonator = True
+            self._fit_function_name = fit_function
             self._f_min = f_min
             self._f_max = f_max
     
-    def _do_fit_resonator(self):
+    def _start_resonator_fit(self):
+        """
+        creates the resonator for the live fit. In 1D and 2D scans the traces are 
+        streamed to it as they are measured (see Resonator.stream), so the cost of 
+        a fit does not grow with the number of traces and the results are written
+        by a background thread. 3D and segmented scans fit the last trace of the file.
+        """
+        self._resonator_stream = (self._dim < 3 and not self._segments and
+                                  self._fit_function_name in resonator.stream_functions)
+        self._resonator = resonator(self._data_file.get_filepath(), threaded=True if self._resonator_stream else None)
+        if self._resonator_stream:
+            self._resonator.stream(self._fit_function_name, self._freqpoints, f_min=self._f_min, f_max=self._f_max,
+                                   x_co=self._x_parameter.hdf_dataset if self._dim == 2 else None,
+                                   y_co=self._coordinates['frequency'], ds_amp=self._datasets['amplitude'], ds_pha=self._datasets['phase'])
+    
+    def _do_fit_resonator(self, amplitude=None, phase=None):
         """
         calls fit function in resonator class
         fit function is specified in self.set_fit, with boundaries f_mim and f_max
         only the last 'slice' of data is fitted, since we fit live while measuring.
+        A streaming resonator fits the given trace, otherwise it is read back from the file.
         """
+        if self._resonator_stream and amplitude is not None:
+            self._resonator.push_trace(amplitude, phase)
+            return
         
         if self._fit_function == 0:  # lorentzian
             self._resonator.fit_lorentzian(f_min=self._f_min, f_max=self._f_max)
@@ -561,6 +641,111 @@ class Landscape:
         self.xz_freqpoints = None
         self.y_span_default = 200e6  # this is for the xy landscape scan, i.e., span of your y_parameter, e.g, mw_frequency
         self.z_span = self.vna.get_span()  # This is for the xz landscape scan i.e. span of vna is adjusted w/ resp to x
+        self._x = None  # the current x value, set by vna_frequency_wrapper
+    
+    @property
+    def adaptive(self):
+        """True if a landscape follows a resonance during the scan, see track_resonance_xz/track_resonance_xy"""
+        return isinstance(self.xzlandscape_func, ResonanceTracker) or any('tracker' in e for e in self.xylandscapes)
+    
+    def track_resonance_xz(self, f_range, start=None, z_span=None, history=5, order=1, max_step=None):
+        """
+        Adaptive xz landscape: the vna window follows a resonance during a 2D or 3D scan, without a landscape
+        function fitted beforehand. Every trace is fitted with a lorentzian (qkit.analysis.resonator), the center of
+        the window at the next x value is extrapolated from the resonance frequencies found at the last x values.
+        The window center used at every x value is stored as 'vna_center_frequency'.
+        :param f_range: [f_min, f_max] frequency range the resonance may move in, the data is stored on this grid
+        :param start: center of the window at the first x value, default: center of the current vna window
+        :param z_span: If None, span from VNA is used. If specified, vna span will be updated.
+        :param history: number of previous x values used for the extrapolation
+        :param order: order of the extrapolating polynomial, 0 uses the last resonance frequency
+        :param max_step: maximum shift of the window center between two x values (Hz)
+        :return:
+        """
+        if z_span is not None:
+            self.z_span = z_span
+            self.vna.set_span(z_span)
+        else:
+            self.z_span = self.vna.get_span()
+        f_min, f_max = np.min(f_range), np.max(f_range)
+        if f_max - f_min < self.z_span:
+            raise ValueError('f_range has to be larger than the vna span.')
+        if start is None:
+            start = self.vna.get_centerfreq()
+        self.xz_freqpoints = np.arange(f_min, f_max + self.z_span / self.vna.get_nop(), self.z_span / self.vna.get_nop())
+        self.xzlandscape_func = ResonanceTracker(start, history=history, order=order, max_step=max_step,
+                                                 bounds=[f_min + self.z_span / 2., f_max - self.z_span / 2.])
+    
+    def track_resonance_xy(self, start, y_span=None, x_range=None, history=5, order=1, max_step=None, response=None):
+        """
+        Adaptive xy landscape for 3D scans: for every x value only the y values within y_span around a tracked center
+        are measured. After all y values of an x value are measured, a lorentzian is fitted to the response vs y,
+        the center at the next x value is extrapolated from the centers found at the last x values.
+        The center used at every x value is stored as 'landscape_center_<n>'.
+        :param start: center at the first x value
+        :param y_span: span of the y values measured around the center, default: self.y_span_default
+        :param x_range: specify x_range for the tracking in the format [x_min, x_max]
+        :param history: number of previous x values used for the extrapolation
+        :param order: order of the extrapolating polynomial, 0 uses the last center
+        :param max_step: maximum shift of the center between two x values
+        :param response: function(amplitude, phase) -> float, the response of a trace which is fitted vs y,
+                         default: mean amplitude of the trace
+        :return:
+        """
+        if x_range is None:
+            x_range = [self.spec.x_vec[0], self.spec.x_vec[-1]]
+        if y_span is None:
+            y_span = self.y_span_default
+        if response is None:
+            response = lambda amp, pha: np.nanmean(amp)
+        self.xylandscapes.append({'center_points': np.full(len(self.spec.x_vec), float(start)), 'y_span': y_span,
+                                  'x_range': [np.min(x_range), np.max(x_range)], 'blacklist': False,
+                                  'tracker': ResonanceTracker(start, history=history, order=order, max_step=max_step),
+                                  'response': response, 'responses': []})
+    
+    def _reset_trackers(self):
+        self._x = None
+        if isinstance(self.xzlandscape_func, ResonanceTracker):
+            self.xzlandscape_func.reset()
+        for e in self.xylandscapes:
+            if 'tracker' in e:
+                e['tracker'].reset()
+                e['responses'] = []
+                e['center_points'][:] = e['tracker'].start
+    
+    def _adaptive_log_functions(self):
+        """log functions [func, name, unit, dtype] storing the windows used by the adaptive landscapes"""
+        logs = []
+        if isinstance(self.xzlandscape_func, ResonanceTracker):
+            logs.append([lambda: self.xzlandscape_func(self._x), 'vna_center_frequency', 'Hz', float])
+        for i, e in enumerate(self.xylandscapes):
+            if 'tracker' in e and self.spec._dim == 3:
+                logs.append([lambda t=e['tracker']: t(self._x), 'landscape_center_%i' % i, self.spec._y_parameter.unit, float])
+        return logs
+    
+    def _trace_measured(self, x, y, amp, pha):
+        """collects the response of a measured trace for the adaptive xy landscapes"""
+        for e in self.xylandscapes:
+            if 'tracker' in e and np.abs(e['tracker'](x) - y) <= e['y_span'] / 2:
+                e['responses'].append((y, e['response'](amp, pha)))
+    
+    def _finish_xy(self):
+        """fits the responses collected at the last x value and hands the center to the trackers"""
+        for e in self.xylandscapes:
+            if 'tracker' not in e or not e['responses']:
+                continue
+            y, r = np.array(e['responses'], dtype=float).T
+            e['responses'] = []
+            r = np.abs(r - np.nanmedian(r))
+            center = y[np.nanargmax(r)]
+            if len(y) > 4:
+                try:
+                    popt, chi2 = fit_lorentzian_trace(y, np.sqrt(r))
+                    if np.min(y) <= popt[0] <= np.max(y):
+                        center = popt[0]
+                except Exception as err:
+                    logging.debug('landscape: fit of the xy response failed: %s' % err)
+            e['tracker'].update(self._x, center)
     
     def generate_fit_function_xy(self, curve_f, curve_p, x_range=None, y_span=None, blacklist=False, p0=[-1, 0.1, 7], units=''):
         """
@@ -764,13 +949,21 @@ class Landscape:
         """
         
         def vna_wrapper(x):
-            start_freq = self.xz_freqpoints[np.argmin(np.abs(self.xz_freqpoints - (self.xzlandscape_func(x) - self.z_span / 2)))]
-            self.vna.set_startfreq(start_freq)
-            self.vna.set_stopfreq(start_freq + self.z_span)
+            self._finish_xy()
+            self._x = x
+            if self.xzlandscape_func:
+                start_freq = self.xz_freqpoints[self._xz_startarg(x)]
+                self.vna.set_startfreq(start_freq)
+                self.vna.set_stopfreq(start_freq + self.z_span)
             x_set_obj(x)
         
         return vna_wrapper
     
+    def _xz_startarg(self, x):
+        """index of the first frequency point of the vna window at x in xz_freqpoints"""
+        startarg = np.argmin(np.abs(self.xz_freqpoints - (self.xzlandscape_func(x) - self.z_span / 2)))
+        return int(min(startarg, len(self.xz_freqpoints) - self.vna.get_nop()))
+    
     def perform_measurement_at_point(self, x, y, ix):
         """
         Looks if the point is of interest and returns True or False
@@ -782,6 +975,8 @@ class Landscape:
         # looks strange but works
         measure = False
         for e in self.xylandscapes:
+            if 'tracker' in e:
+                e['center_points'][ix] = e['tracker'](x)
             if np.abs(e['center_points'][ix] - y) <= e['y_span'] / 2 and e['x_range'][0] <= x <= e['x_range'][1]:  # The point is covered by this span
                 if e['blacklist']:
                     return False  # if the point is blacklisted anywhere, we don't need to look further
@@ -792,16 +987,27 @@ class Landscape:
     def get_tracedata_xz(self, x):
         """
         Function to fill the tracedata with NaNs outside the scan region
+        For an adaptive xz landscape the trace is fitted and the resonance frequency handed to the tracker.
         :param x: x_value where we perform the scan
         :return:
         """
         amp = np.full_like(self.xz_freqpoints, np.NaN, dtype=np.float16)
         pha = np.full_like(self.xz_freqpoints, np.NaN, dtype=np.float16)
-        startarg = np.argmin(np.abs(self.xz_freqpoints - (self.xzlandscape_func(x) - self.z_span / 2)))
+        startarg = self._xz_startarg(x)
         stoparg = startarg + self.vna.get_nop()
         a, p = self.spec._acquire_vna_data()
         amp[startarg:stoparg] = a
         pha[startarg:stoparg] = p
+        if isinstance(self.xzlandscape_func, ResonanceTracker):
+            f_start = self.xz_freqpoints[startarg]
+            freqs = np.linspace(f_start, f_start + self.z_span, len(a))
+            try:
+                popt, chi2 = fit_lorentzian_trace(freqs, a)
+            except Exception as e:
+                logging.debug('landscape: fit of the trace at x=%s failed: %s' % (x, e))
+            else:
+                if freqs[0] <= popt[0] <= freqs[-1] and np.abs(popt[1]) < self.z_span:
+                    self.xzlandscape_func.update(x, popt[0])
         return amp, pha
     
     def get_freqpoints_xz(self):
@@ -832,3 +1038,51 @@ class Landscape:
             Primal transition frequency of a transmon qubit.
         """
         return w_max * (np.abs(np.cos(np.pi / L * (x - I_ext))) * (1 + djj ** 2 * np.tan(np.pi / L * (x - I_ext)) ** 2) ** .5) ** 0.5
+
+
+class ResonanceTracker(object):
+    """
+    Follows a resonance during an adaptive landscape scan.
+    The center at an x value is extrapolated by a polynomial of degree 'order' through the centers found at the last
+    'history' x values (the median if several were found at one x value). Until a center is found, 'start' is used.
+    The predicted center of an x value is kept, so the vna window and the recorded center agree.
+    """
+    
+    def __init__(self, start, history=5, order=1, max_step=None, bounds=None):
+        self.start = float(start)
+        self.history = history
+        self.order = order
+        self.max_step = max_step
+        self.bounds = bounds
+        self.reset()
+    
+    def reset(self):
+        self.found = {}  # x -> [centers found at x]
+        self.used = {}  # x -> center used at x
+    
+    def predict(self, x):
+        xs = list(self.found.keys())[-self.history:]
+        cs = [np.median(self.found[k]) for k in xs]
+        if not xs:
+            center = self.start
+        elif len(xs) == 1 or self.order == 0:
+            center = cs[-1]
+        else:
+            center = np.polyval(np.polyfit(xs, cs, min(self.order, len(xs) - 1)), x)
+        if self.max_step is not None and cs:
+            center = np.clip(center, cs[-1] - self.max_step, cs[-1] + self.max_step)
+        if self.bounds is not None:
+            center = np.clip(center, *self.bounds)
+        return float(center)
+    
+    def update(self, x, center):
+        if np.isfinite(center):
+            self.found.setdefault(float(x), []).append(float(center))
+    
+    def __call__(self, x):
+        if np.ndim(x):  # e.g. plot_xz_landscape
+            return np.array([self.used.get(float(xi), self.predict(xi)) for xi in x])
+        x = float(x)
+        if x not in self.used:
+            self.used[x] = self.predict(x)
+        return self.used[x]
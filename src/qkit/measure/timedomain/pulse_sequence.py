@@ -19,16 +19,38 @@ class Shape(np.vectorize):
     """
     A vectorized function describing a possible shape
     defined on the standardized interval [0,1).
+    If array_func is given, the shape is evaluated by array_func on the whole array at once
+    instead of calling func sample by sample.
     """
 
     def __init__(
-        self, name: str, func: Callable[[float], float], *args: Any, **kwargs: Any
+        self,
+        name: str,
+        func: Callable[[float], float],
+        *args: Any,
+        array_func: Callable[[np.ndarray], np.ndarray] = None,
+        **kwargs: Any
     ):
         self.name = name
+        self.array_func = array_func
         super(Shape, self).__init__(func, *args, **kwargs)
 
+    def __call__(self, *args: Any, **kwargs: Any):
+        if self.array_func is not None and len(args) == 1 and not kwargs:
+            return self.array_func(np.asarray(args[0], dtype=float))
+        return super(Shape, self).__call__(*args, **kwargs)
+
     def __mul__(self, other):
-        return Shape(self.name, lambda x: self.pyfunc(x) * other.pyfunc(x))
+        # other can be a plain np.vectorize without array_func
+        other_array_func = getattr(other, "array_func", None)
+        array_func = None
+        if self.array_func is not None and other_array_func is not None:
+            array_func = lambda x: self.array_func(x) * other_array_func(x)
+        return Shape(
+            self.name,
+            lambda x: self.pyfunc(x) * other.pyfunc(x),
+            array_func=array_func,
+        )
 
 
 class ShapeLibClass(object):
@@ -38,19 +60,78 @@ class ShapeLibClass(object):
     """
 
     def __init__(self):
-        self.zero = Shape("", lambda x: 0)
-        self.rect = Shape("rect", lambda x: np.where(x >= 0 and x < 1, 1, 0))
+        self.zero = Shape("", lambda x: 0, array_func=lambda x: np.zeros(x.shape))
+        self.rect = Shape(
+            "rect",
+            lambda x: np.where(x >= 0 and x < 1, 1, 0),
+            array_func=lambda x: ((x >= 0) & (x < 1)).astype(float),
+        )
         self.gauss = (
-            Shape("gauss", lambda x: np.exp(-0.5 * np.power((x - 0.5) / 0.166, 2.0)))
+            Shape(
+                "gauss",
+                lambda x: np.exp(-0.5 * np.power((x - 0.5) / 0.166, 2.0)),
+                array_func=lambda x: np.exp(-0.5 * np.power((x - 0.5) / 0.166, 2.0)),
+            )
             * self.rect
         )
-        self.ramp = Shape("ramp", lambda x: x) * self.rect
-        self.sqrfct = Shape("sqrfct", lambda x: x ** 2) * self.rect
+        self.ramp = Shape("ramp", lambda x: x, array_func=lambda x: x) * self.rect
+        self.sqrfct = (
+            Shape("sqrfct", lambda x: x ** 2, array_func=lambda x: x ** 2) * self.rect
+        )
 
 
 # Make ShapeLib a singleton:
 ShapeLib = ShapeLibClass()
 
+# Sampled shapes and IQ carriers, shared by all pulses. Sweeps regenerate the same pulses
+# over and over, only amplitude and phase are applied per call.
+_WAVEFORM_CACHE_SIZE = 256
+_shape_cache: Dict[Tuple[Shape, float, float], Tuple[np.ndarray, np.ndarray]] = {}
+_carrier_cache: Dict[Tuple[float, int, float], np.ndarray] = {}
+
+
+def _cached(cache: Dict, key: Tuple, func: Callable[[], Any]) -> Any:
+    """Returns cache[key], computed by func() on the first call."""
+    try:
+        return cache[key]
+    except KeyError:
+        pass
+    if len(cache) >= _WAVEFORM_CACHE_SIZE:
+        cache.clear()
+    value = cache[key] = func()
+    return value
+
+
+def _sample_shape(shape: Shape, length: float, samplerate: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the sample times and the (read-only) values of shape for a pulse of given length."""
+    timestep = 1.0 / samplerate
+    time = np.arange(0, length, timestep)
+    time_fractions = time / length
+
+    if time_fractions[-1] >= 1.0:
+        # This can happen due to float rounding error -> cut it away
+        # (the shapes are only defined on [0,1) where 1 is not included)
+        time = time[:-1]
+        time_fractions = time_fractions[:-1]
+
+    values = np.asarray(shape(time_fractions), dtype=float)
+    time.setflags(write=False)
+    values.setflags(write=False)
+    return time, values
+
+
+def _sample_carrier(iq_frequency: float, time: np.ndarray) -> np.ndarray:
+    """Returns the (read-only) IQ carrier exp(2 pi i f t)."""
+    carrier = np.exp(2.0j * np.pi * iq_frequency * time)
+    carrier.setflags(write=False)
+    return carrier
+
+
+def clear_waveform_cache():
+    """Empties the cache of sampled pulse shapes and IQ carriers."""
+    _shape_cache.clear()
+    _carrier_cache.clear()
+
 
 class PulseType(Enum):
     """Type of Pulse object"""
@@ -219,28 +300,27 @@ class Pulse(object):
 
             return np.zeros(0)
 
-        time = np.arange(0, length, timestep)
-        time_fractions = time / length
-
-        if time_fractions[-1] >= 1.0:
-            # This can happen due to float rounding error -> cut it away
-            # (the shapes are only defined on [0,1) where 1 is not included)
-            time = time[:-1]
-            time_fractions = time_fractions[:-1]
-
-        envelope = amplitude * self.shape(time_fractions)
+        # the sampled shape and the carrier are computed once per shape, length and iq frequency
+        time, values = _cached(
+            _shape_cache,
+            (self.shape, float(length), float(samplerate)),
+            lambda: _sample_shape(self.shape, length, samplerate),
+        )
+        envelope = amplitude * values
         if not heterodyne or envelope.size == 0 or self.iq_frequency == 0:
             return envelope
         # Empty envelope needs no IQ modulation and
         # for homodyne mixing the envelope is real
         else:
-            envelope = envelope * np.exp(
-                1.0j
-                * (
-                    start_phase
-                    - np.pi / 180 * self.phase
-                    + 2 * np.pi * self.iq_frequency * time
-                )
+            carrier = _cached(
+                _carrier_cache,
+                (float(self.iq_frequency), len(time), float(samplerate)),
+                lambda: _sample_carrier(self.iq_frequency, time),
+            )
+            envelope = (
+                envelope
+                * np.exp(1.0j * (start_phase - np.pi / 180 * self.phase))
+                * carrier
             )
 
         # account for mixer calibration i.e. dc offset and phase != 90deg between I and Q
@@ -362,14 +442,13 @@ class PulseSequence(object):
             logging.error("Sequence call requires samplerate.")
             return None
 
-        # build the waveform of this sequence
-        full_waveform = np.zeros(0, dtype=np.complex128)
+        # compile the waveform of this sequence: place the pulses, then add them to the preallocated waveform
         timestep = 1.0 / samplerate  # minimum time step
         readout_index = 0  # index of the readout in the waveform of the whole sequence
         position_of_next_slice = 0  # index where the next time slice will start
+        placed_wfms: List[Tuple[int, np.ndarray]] = []  # (start index, waveform) of all pulses
+        total_length = 0
         for time_slice in self._sequence:
-            # holds all waveforms that start at the same time (within the same slice)
-            wfm_slice = np.zeros(0, dtype=np.complex128)
             # tracks the length of the last waveform in the slice as the next slice will start after that
             last_wfm_length = 0
             for pulse in time_slice:
@@ -386,50 +465,29 @@ class PulseSequence(object):
                     **variables
                 )
 
-                # if (pulse_dict["pulse"].type == PulseType.Readout) and (i == len(self._sequence) - 1):
-                #     # if readout is last, omit the wfm (apart from a single digit)
-                #     length = timestep
-
                 # Store index if this pulse is a readout pulse (will have the last one at the end)
+                # Readout pulses only take up time in the waveform unless include_readout is set
                 if pulse.type == PulseType.Readout:
                     readout_index = position_of_next_slice
-                    if not include_readout:
-                        # Readout pulses are not taken into account here
-                        wfm[:] = 0
+                if pulse.type != PulseType.Readout or include_readout:
+                    placed_wfms.append((position_of_next_slice, wfm))
 
                 # Store the size of the last waveform in a slice
                 # This waveform has skip=False and thus the next slice will start when this pulse is finished
                 # even if other pulses of the current slice are longer
                 last_wfm_length = len(wfm)
-
-                # Enlarge waveforms to be the same size
-                if len(wfm_slice) < len(wfm):
-                    wfm_slice.resize(len(wfm))
-                else:
-                    wfm.resize(len(wfm_slice))
-                # Add pulse to waveform of current time slice
-                wfm_slice += wfm
-
-            # Resize waveform to be capable of holding current wfm_slice
-            new_waveform_length: float = max(
-                len(full_waveform), position_of_next_slice + len(wfm_slice)
-            )
-            full_waveform.resize(new_waveform_length)
-            # Add current time slice to global waveform
-            full_waveform[
-                position_of_next_slice : (position_of_next_slice + len(wfm_slice))
-            ] += wfm_slice
+                total_length = max(total_length, position_of_next_slice + len(wfm))
 
             # Update position for next slice (the last waveform has no skip and thus decides the time)
             position_of_next_slice += last_wfm_length
 
-        full_waveform += self.dc_corr
-
         # make sure first and last point of the waveform go to 0
-        full_waveform = np.append(0, full_waveform)
-        full_waveform = np.append(full_waveform, 0)
+        full_waveform = np.zeros(total_length + 2, dtype=np.complex128)
+        full_waveform[1:-1] = self.dc_corr
+        for position, wfm in placed_wfms:
+            full_waveform[1 + position : 1 + position + len(wfm)] += wfm
 
-        if not any(np.iscomplex(full_waveform)):
+        if not np.any(np.iscomplex(full_waveform)):
             # No complex information in there, so just return the real part
             full_waveform = np.real(full_waveform)
 
@@ -102,6 +102,8 @@ class transport(object):
         self._comment = None
         # measurement services
         self.progress_bar = True
+        self.preallocate = None  # create the datasets at their final shape (None: qkit.cfg['h5_preallocate']), see qkit.storage.store.Data
+        self.swmr = qkit.cfg.get('h5_swmr', False)  # qviewkit follows the file as SWMR reader, see qkit.storage.store.Data
         self.open_qviewkit = True
         self._qvk_process = False  # qviewkit process
         self._plot_comment = ''
@@ -113,6 +115,7 @@ class transport(object):
         self._numder_args = ()  # arguments for derivation function
         self._numder_kwargs = {'window_length': 15, 'polyorder': 3, 'deriv': 1}  # keyword arguments for derivation function
         self._average = None  # trace averaging
+        self._average_write_interval = qkit.cfg.get('transport_average_write_interval', 1)  # minimum time (s) between writes of the averaged traces
         self._view_xy = False
         # x and y data
         self._hdf_x = None
@@ -297,6 +300,44 @@ class transport(object):
             logging.warning("Can't calculate numerical derivative, possibly insufficient data points. %s", e)
             return np.zeros(len(y))*np.nan
     
+    def _numerical_derivatives(self, x, y):
+        """
+        Calculates the numerical derivatives dy/dx of several traces at once. Traces of the same length are stacked and derived along the last axis with a single call of <self._numder_func>.
+        
+        Parameters
+        ----------
+        x: list of array_likes
+            1D-arrays containing x-values of the traces.
+        y: list of array_likes
+            1D-arrays containing y-values of the traces.
+        
+        Returns
+        -------
+        dydx: list of numpy.array
+            Numerical derivatives dy/dx of the traces.
+        """
+        dydx = [None]*len(y)
+        lengths = [len(val) for val in y]
+        for length in set(lengths):
+            idx = [k for k, l in enumerate(lengths) if l == length]
+            if len(idx) == 1:
+                dydx[idx[0]] = self._numerical_derivative(x[idx[0]], y[idx[0]])
+                continue
+            xs, ys = np.array([x[k] for k in idx]), np.array([y[k] for k in idx])
+            kwargs = dict(self._numder_kwargs)
+            kwargs.setdefault('axis', -1)
+            try:
+                res = np.asarray(self._numder_func(ys, *self._numder_args, **kwargs)/self._numder_func(xs, *self._numder_args, **kwargs))
+                if res.shape != ys.shape:
+                    raise ValueError("shape {!s} instead of {!s}".format(res.shape, ys.shape))
+            except Exception as e:
+                # derivative function without axis support, derive trace by trace
+                logging.debug("Numerical derivative of stacked traces failed, deriving them one by one. %s", e)
+                res = [self._numerical_derivative(xs[k], ys[k]) for k in range(len(idx))]
+            for k, val in zip(idx, res):
+                dydx[k] = val
+        return dydx
+    
     def set_x_dt(self, x_dt):
         """
         Sets sleep time between x-iterations in 2D and 3D scans.
@@ -925,7 +966,7 @@ class transport(object):
         self._comment = None
         return
     
-    def set_average(self, avg):
+    def set_average(self, avg, write_interval=None):
         """
         Sets trace average parameter.
         
@@ -933,12 +974,16 @@ class transport(object):
         ----------
         avg: int
             Number of averages of whole traces. Must be None (off) or natural numbers.
+        write_interval: float, optional
+            Minimum time in seconds between two writes of the intermediate averaged traces to the .h5 file. The final average is always written. Default is qkit.cfg['transport_average_write_interval'] or 1.
         
         Returns
         -------
         None
         """
         self._average = avg
+        if write_interval is not None:
+            self._average_write_interval = write_interval
         return
     
     def get_average(self):
@@ -1100,6 +1145,7 @@ class transport(object):
         self._prepare_measurement_IVD()
         ''' prepare data storage '''
         self._prepare_measurement_file()
+        self._data_file.start_swmr()
         ''' prepare progress bar '''
         self._prepare_progress_bar()
         ''' opens qviewkit to plot measurement '''
@@ -1220,7 +1266,7 @@ class transport(object):
         """
         ''' create files '''
         # data.h5 file
-        self._data_file = hdf.Data(name='_'.join(list(filter(None, ('xy' if self._scan_dim is 0 else '{:d}D_IV_curve'.format(self._scan_dim), self._filename, self._expname)))), mode='a')
+        self._data_file = hdf.Data(name='_'.join(list(filter(None, ('xy' if self._scan_dim is 0 else '{:d}D_IV_curve'.format(self._scan_dim), self._filename, self._expname)))), mode='a', preallocate=self.preallocate, swmr=self.swmr)
         # settings.set file
         self._hdf_settings = self._data_file.add_textlist('settings')
         self._hdf_settings.append(waf.get_instrument_settings(self._data_file.get_filepath()))
@@ -1613,33 +1659,55 @@ class transport(object):
                     self._pb.iterate(addend=self._pb_addend[self.ix] if self._landscape else 1)
                 qkit.flow.sleep()
         else:
-            I_values, V_values = [], []
+            # running sums and counts of the values of each sweep, NaN values (bias values skipped by the landscape) are not counted
+            self.sweeps.create_iterator()
+            sweeps = [self.sweeps.get_sweep() for j in range(self.sweeps.get_nos())]
+            sums, counts = [None]*len(sweeps), [None]*len(sweeps)
+            written, t_write = False, time.time()
             for i in range(self._average):
-                I_values.append([])
-                V_values.append([])
-                self.sweeps.create_iterator()
-                for j in range(self.sweeps.get_nos()):
+                for j, sweep in enumerate(sweeps):
                     # take data
-                    for val, lst in zip(self.take_IV(sweep=self.sweeps.get_sweep()), [I_values, V_values]):
-                        lst[i].append(list(val))  # append as list in order to later use zip
-                    I_values_avg, V_values_avg = np.mean(list(zip(*I_values))[j], axis=0), np.mean(list(zip(*V_values))[j], axis=0)  # use zip since np.mean cannot handle different shapes
-                    data = {self._hdf_I[j]:I_values_avg,
-                            self._hdf_V[j]:V_values_avg}
-                    if self._dVdI:
-                        data[self._hdf_dVdI[j]] = self._numerical_derivative(I_values_avg, V_values_avg)
-                    if self._fit_func:
-                        data[self._hdf_fit[j]] = self._fit_func(data[self._hdf_I[j]],
-                                                                data[self._hdf_V[j]],
-                                                                data[self._hdf_dVdI[j]],
-                                                                **self._fit_kwargs)
-                    # save data
-                    for key, val in data.items():
-                        key.append(val, reset=bool(i))  # append data series or overwrite last iteration by new averaged data
-                        key.ds.attrs['average'] = '({:d}/{:d})'.format(i+1, self._average)  # add (iteration/average) as attribute
-                        self._data_file.flush()
+                    values = np.array(self.take_IV(sweep=sweep), dtype=float)
+                    if sums[j] is None:
+                        sums[j], counts[j] = np.zeros(values.shape), np.zeros(values.shape, dtype=int)
+                    valid = ~np.isnan(values)
+                    sums[j][valid] += values[valid]
+                    counts[j] += valid
                     # iterate progress bar
                     if self.progress_bar:
                         self._pb.iterate(addend=self._pb_addend[self.ix] if self._landscape else 1)
+                qkit.flow.sleep()
+                # the intermediate averages are written at most every <self._average_write_interval> seconds
+                if i+1 < self._average and time.time()-t_write < self._average_write_interval:
+                    continue
+                avg = [s/np.where(c > 0, c, np.nan) for s, c in zip(sums, counts)]
+                if self._dVdI or self._fit_func:
+                    dVdI_values = self._numerical_derivatives([I for I, V in avg], [V for I, V in avg])
+                data = {}  # {dataset: (data, reset)}
+                for j, (I_values_avg, V_values_avg) in enumerate(avg):
+                    data[self._hdf_I[j]] = (I_values_avg, written)  # append data series or overwrite last write by new averaged data
+                    data[self._hdf_V[j]] = (V_values_avg, written)
+                    if self._dVdI:
+                        data[self._hdf_dVdI[j]] = (dVdI_values[j], written)
+                    if self._fit_func:
+                        fit = float(self._fit_func(I_values_avg, V_values_avg, dVdI_values[j], **self._fit_kwargs))
+                        if self._scan_dim == 1:
+                            self._data_fit[j] = fit
+                            data[self._hdf_fit[j]] = (self._data_fit[j], written)
+                        elif self._scan_dim == 2:
+                            self._data_fit[j][self.ix] = fit
+                            data[self._hdf_fit[j]] = (self._data_fit[j], True)
+                        elif self._scan_dim == 3:
+                            self._data_fit[j][self.ix, self.iy] = fit
+                            data[self._hdf_fit[j]] = (self._data_fit[j][self.ix], written or self._rst_fit_hdf_appnd)
+                # save data
+                for key, (val, reset) in data.items():
+                    key.append(val, reset=reset)
+                    key.ds.attrs['average'] = '({:d}/{:d})'.format(i+1, self._average)  # add (iteration/average) as attribute
+                self._data_file.flush()
+                written, t_write = True, time.time()
+            if self._fit_func and self._scan_dim == 3:
+                self._rst_fit_hdf_appnd = not bool(self.iy + 1 == len(self._y_vec))
             # set average attribute to number of averages
             for j in range(self.sweeps.get_nos()):
                 for lst in [val for k, val in enumerate([self._hdf_I, self._hdf_V, self._hdf_dVdI]) if k < 2+int(self._dVdI)]:
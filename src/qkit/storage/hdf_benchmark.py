@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the hdf storage layout: write throughput, file size and
+slice-read latency of value matrices and boxes for different chunk shapes
+and filters.
+
+Run as
+    python -m qkit.storage.hdf_benchmark [--nx 200] [--ny 20] [--tracelength 2001]
+
+The 'legacy' layout is the former fixed chunking (5, tracelength) for matrices
+and (5, 5, tracelength) for boxes.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import h5py
+import numpy as np
+
+from qkit.storage.store import Data
+
+layouts = {
+    'legacy': lambda dim, tl: dict(chunks=(5,) * (dim - 1) + (tl,)),
+    'policy': lambda dim, tl: dict(),
+    'policy+lzf': lambda dim, tl: dict(compression='lzf', shuffle=True),
+    'policy+gzip': lambda dim, tl: dict(compression='gzip', compression_opts=4, shuffle=True),
+}
+
+
+def _trace(tracelength, i):
+    """Resonance dip with noise, roughly as compressible as VNA data."""
+    f = np.linspace(-1, 1, tracelength)
+    return (1 - 0.8 / (1 + ((f - 0.001 * i) / 0.02) ** 2) + 1e-3 * np.random.randn(tracelength)).astype('f')
+
+
+def _write(path, layout, dim, nx, ny, tracelength):
+    with Data(path, mode='a') as d:
+        x = d.add_coordinate('x')
+        x.add(np.arange(nx))
+        y = d.add_coordinate('y')
+        y.add(np.arange(ny))
+        f = d.add_coordinate('f')
+        f.add(np.arange(tracelength))
+        t0 = time.time()
+        if dim == 2:
+            ds = d.add_value_matrix('amplitude', x=x, y=f, **layout)
+            for i in range(nx):
+                ds.append(_trace(tracelength, i))
+        else:
+            ds = d.add_value_box('amplitude', x=x, y=y, z=f, **layout)
+            for i in range(nx):
+                for j in range(ny):
+                    ds.append(_trace(tracelength, i + j))
+                ds.next_matrix()
+        return time.time() - t0
+
+
+def _read_latency(path, dim, repeat=20):
+    """Mean latency (s) of reading a single trace and a cut across traces."""
+    with h5py.File(path, 'r') as hf:
+        ds = hf['/entry/data0/amplitude']
+        t0 = time.time()
+        for i in range(repeat):
+            ds[i % ds.shape[0]]
+        t_trace = (time.time() - t0) / repeat
+        t0 = time.time()
+        for i in range(repeat):
+            ds[..., i % ds.shape[-1]]
+        t_cut = (time.time() - t0) / repeat
+    return t_trace, t_cut
+
+
+def run(nx=200, ny=20, tracelength=2001, dims=(2, 3)):
+    """Runs the benchmark and prints one line per dataset type and layout."""
+    tmpdir = tempfile.mkdtemp()
+    try:
+        print("{:4s} {:12s} {:>10s} {:>10s} {:>12s} {:>12s} {:>10s}".format(
+            "dim", "layout", "write MB/s", "size MB", "trace ms", "cut ms", "chunks"))
+        for dim in dims:
+            n = nx if dim == 2 else nx * ny
+            for name, layout in layouts.items():
+                path = os.path.join(tmpdir, "bench_{:d}D_{:s}.h5".format(dim, name.replace('+', '_')))
+                t_write = _write(path, layout(dim, tracelength), dim, nx, ny, tracelength)
+                t_trace, t_cut = _read_latency(path, dim)
+                with h5py.File(path, 'r') as hf:
+                    chunks = hf['/entry/data0/amplitude'].chunks
+                print("{:4d} {:12s} {:10.1f} {:10.2f} {:12.3f} {:12.3f} {!s:>10}".format(
+                    dim, name, n * tracelength * 4 / 1e6 / t_write, os.path.getsize(path) / 1e6,
+                    1e3 * t_trace, 1e3 * t_cut, chunks))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="qkit hdf storage layout benchmark")
+    parser.add_argument('--nx', type=int, default=200, help="number of outer (x) points")
+    parser.add_argument('--ny', type=int, default=20, help="number of middle (y) points for boxes")
+    parser.add_argument('--tracelength', type=int, default=2001, help="number of points per trace")
+    args = parser.parse_args()
+    run(args.nx, args.ny, args.tracelength)
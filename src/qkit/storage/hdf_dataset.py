@@ -37,8 +37,20 @@ class hdf_dataset(object):
                  save_timestamp = False, 
                  overwrite=False,
                  ds_type = ds_types['vector'],
+                 buffered = None,
+                 preallocate = None,
                  **meta):
-        """Init the dataset object with case sensitive arguments"""
+        """Init the dataset object with case sensitive arguments
+        
+        With 'buffered' set (default: taken from the Data object), appended
+        traces are collected in memory and written in blocks whenever
+        qkit.cfg['h5_flush_interval'] seconds have passed or
+        qkit.cfg['h5_flush_bytes'] bytes are pending, see append().
+        With 'preallocate' set (default: taken from the Data object), a value
+        vector, matrix or box is created at its final shape from the lengths
+        of the x, y and z coordinates, NaN-filled, and the data is written in
+        place. The progress is tracked by the 'fill' attribute only.
+        """
         name = name.lower().replace(" ","_")
         self.hf = hdf_file
         self.x_object = x
@@ -50,6 +62,17 @@ class hdf_dataset(object):
         self.ds_type = ds_type
         self._next_matrix = False
         self._save_timestamp = save_timestamp
+        if buffered is None:
+            buffered = getattr(hdf_file, 'buffered', False)
+        self._buffered = buffered
+        if preallocate is None:
+            preallocate = getattr(hdf_file, 'preallocate', False)
+        self._preallocate = preallocate and ds_type in [ds_types['vector'], ds_types['matrix'], ds_types['box']]
+        self._buffer = []
+        self._buffer_ts = []
+        self._buffer_bytes = 0
+        self._buffer_next_matrix = False
+        self._last_flush = time.time()
         
         ## only one information: either 'name' (for creation) or 'ds_url' (for readout)
         if (name and ds_url) or (not name and not ds_url) :
@@ -68,6 +91,7 @@ class hdf_dataset(object):
         self.comment = comment
         # the first dataset is used to extract a few attributes
         self.first = True
+        self.hf.register_dataset(self)
 
     def _read_ds_from_hdf(self,ds_url):
         ds = self.hf[str(ds_url)]
@@ -93,6 +117,31 @@ class hdf_dataset(object):
                 ds.attrs.create("z_ds_url",self.z_object.ds_url.encode())
 
 
+    def _coordinate_lengths(self, n):
+        """Lengths of the first 'n' of the x, y and z coordinate datasets 
+        (None where unknown).
+        """
+        shape = []
+        for obj in (self.x_object, self.y_object, self.z_object)[:n]:
+            ds = getattr(obj, 'ds', None)
+            shape.append(ds.shape[0] if ds is not None and ds.shape[0] else None)
+        return shape
+
+    def _outer_shape(self):
+        """Expected lengths of the outer dimensions."""
+        return tuple(self._coordinate_lengths(self.dim - 1))
+
+    def _final_shape(self, data, pointwise):
+        """Final shape of the dataset from the coordinate lengths, None if one is unknown.
+        For traces appended as a whole, their length defines the innermost dimension.
+        """
+        shape = self._coordinate_lengths(self.dim)
+        if None in shape or len(shape) < self.dim:
+            return None
+        if self.dim > 1 and not pointwise:
+            shape[-1] = len(data)
+        return tuple(shape)
+
     def next_matrix(self):
         self._next_matrix = True
         self._y_pos = 0
@@ -118,31 +167,153 @@ class hdf_dataset(object):
         else:
             ## we cast everything to a float numpy array
             data = numpy.atleast_1d(numpy.array(data,dtype=self.dtype))
+        next_matrix, self._next_matrix = self._next_matrix, False
+        if self.hf.writer is not None:
+            # the data is written by the background writer thread, see H5_writer
+            self.hf.writer.submit(self._write, data, reset, pointwise, next_matrix, time.time(),
+                                  nbytes=getattr(data, 'nbytes', len(data)))
+        else:
+            self._write(data, reset, pointwise, next_matrix, time.time())
+
+    def _create(self, data, pointwise):
+        """Creates the hdf dataset on the first write, 'data' is the first trace."""
+        self.first = False
+        if self.ds_type == ds_types['txt']:
+            tracelength = 0
+        else:
+            tracelength = len(data)
+        ## tracelength is used so far only for multi-dimensional datasets to chunk needed memory
+        if self._preallocate:
+            shape = self._final_shape(data, pointwise)
+            if shape:
+                self.meta['shape'] = shape
+                tracelength = shape[-1]
+            else:
+                logging.info("HDF_dataset: Cannot preallocate '%s', coordinate lengths unknown." % (self.name))
+                self._preallocate = False
+        if self.dim and self.dim > 1:
+            self.meta.setdefault('outer_shape', self._outer_shape())
+        self.ds = self.hf.create_dataset(self.name,tracelength,
+                                         folder=self.folder,
+                                         dim = self.dim,
+                                         ds_type = self.ds_type,
+                                         dtype = self.dtype,
+                                         **self.meta)
+        if self._preallocate and 'fill' not in self.ds.attrs:
+            self.ds.attrs.create("fill", [0,0,0])
+        self._setup_metadata()
+        if self._save_timestamp:
+            self._create_timestamp_ds()
+        self.hf.dataset_created(self)
+
+    def _write(self, data, reset, pointwise, next_matrix, timestamp):
+        """Writes the data prepared by append() to the hdf file."""
         # at this point the reference data should be around
         if self.first:
-            self.first = False
-            if self.ds_type == ds_types['txt']:
-                tracelength = 0
-            else:
-                tracelength = len(data)
-            ## tracelength is used so far only for multi-dimensional datasets to chunk needed memory
-            self.ds = self.hf.create_dataset(self.name,tracelength,
-                                             folder=self.folder,
-                                             dim = self.dim,
-                                             ds_type = self.ds_type,
-                                             dtype = self.dtype,
-                                             **self.meta)
-            self._setup_metadata()
-            if self._save_timestamp:
-                self._create_timestamp_ds()
+            self._create(data, pointwise)
 
-        self.hf.append(self.ds, data, next_matrix=self._next_matrix, reset=reset, pointwise=pointwise)
+        if self._buffered and self.ds_type != ds_types['txt'] and not reset and not pointwise:
+            self._append_buffered(data, next_matrix, timestamp)
+            return
+        # everything else bypasses the buffer, which has to be written first
+        self.flush_buffer(trim=True)
+        if self._preallocate:
+            self.hf.append_in_place(self.ds, data, next_matrix=next_matrix, reset=reset, pointwise=pointwise)
+        else:
+            self.hf.append(self.ds, data, next_matrix=next_matrix, reset=reset, pointwise=pointwise)
         if self._save_timestamp:
-            self.hf.append(self.ds_ts, numpy.array([time.time()]), next_matrix=self._next_matrix, reset=reset)
-        if self._next_matrix:
-            self._next_matrix = False
+            self.hf.append(self.ds_ts, numpy.array([timestamp]), next_matrix=next_matrix, reset=reset)
+
+    def append_block(self, data):
+        """Function to save several datapoints (vector) or datalines (matrix, box) at once.
+
+        Block counterpart of append() for results computed for many traces
+        together, e.g. batch fits: the entries of a vector or the traces of a
+        matrix or box (one per row of 'data') are written with a single write
+        instead of one append() per trace. Traces written to a box go into
+        the current matrix, see next_matrix(). All entries share one timestamp.
 
+        Args:
+            data: 1D array of entries (coordinate, vector) or 2D array of traces (matrix, box)
+        """
+        if self.ds_type == ds_types['txt']:
+            raise TypeError("HDF_dataset: append_block() is not available for text datasets.")
+        data = numpy.array(data, dtype=self.dtype)
+        if self.ds_type in [ds_types['coordinate'], ds_types['vector']]:
+            data = data.ravel()
+        else:
+            data = numpy.atleast_2d(data)
+        if not len(data):
+            return
+        next_matrix, self._next_matrix = self._next_matrix, False
+        if self.hf.writer is not None:
+            self.hf.writer.submit(self._write_block, data, next_matrix, time.time(), nbytes=data.nbytes)
+        else:
+            self._write_block(data, next_matrix, time.time())
+
+    def _write_block(self, data, next_matrix, timestamp):
+        """Writes the data prepared by append_block() to the hdf file."""
+        if self.first:
+            self._create(data if data.ndim == 1 else data[0], False)
+        self.flush_buffer(trim=True)
+        self.hf.append_block(self.ds, data, next_matrix=next_matrix, in_place=self._preallocate)
+        if not self._preallocate:
+            # plain append() continues after the last row of the dataset
+            self.hf.trim_dataset(self.ds)
+        if self._save_timestamp:
+            ts = numpy.full(len(data), timestamp)
+            if len(self.ds_ts.shape) == 2:
+                ts = ts[:, numpy.newaxis]
+            self.hf.append_block(self.ds_ts, ts)
+            self.hf.trim_dataset(self.ds_ts)
         self.hf.flush()
+
+    def _append_buffered(self, data, next_matrix, timestamp):
+        """Collects a trace in the write-behind buffer and writes the buffer
+        once the time or byte budget is used up.
+        """
+        if next_matrix:
+            # a buffer only ever holds traces of one matrix in a value_box
+            self.flush_buffer()
+            self._buffer_next_matrix = True
+        if not self._buffer:
+            self.hf.register_buffer(self)
+        self._buffer.append(data)
+        self._buffer_bytes += data.nbytes
+        if self._save_timestamp:
+            self._buffer_ts.append(timestamp)
+        if (self._buffer_bytes >= qkit.cfg.get('h5_flush_bytes', 16*1024**2) or
+                time.time() - self._last_flush >= qkit.cfg.get('h5_flush_interval', 1.)):
+            self.flush_buffer()
+
+    def flush_buffer(self, trim=False):
+        """Writes the content of the write-behind buffer to the file.
+
+        Args:
+            trim (Boolean, optional): cut a geometrically grown matrix back to its fill
+        """
+        if self._buffer:
+            if self.ds_type in [ds_types['coordinate'], ds_types['vector']]:
+                data = numpy.concatenate(self._buffer)
+            else:
+                data = numpy.vstack(self._buffer)
+            self.hf.append_block(self.ds, data, next_matrix=self._buffer_next_matrix, in_place=self._preallocate)
+            if self._save_timestamp:
+                ts = numpy.array(self._buffer_ts)
+                if len(self.ds_ts.shape) == 2:
+                    ts = ts[:, numpy.newaxis]
+                self.hf.append_block(self.ds_ts, ts)
+            self._buffer = []
+            self._buffer_ts = []
+            self._buffer_bytes = 0
+            self._buffer_next_matrix = False
+            self.hf.flush()
+        if trim and self._buffered and not self.first:
+            if not self._preallocate:
+                self.hf.trim_dataset(self.ds)
+            if self._save_timestamp:
+                self.hf.trim_dataset(self.ds_ts)
+        self._last_flush = time.time()
             
     def add(self,data):
         """Function to save a 1dim dataset once.
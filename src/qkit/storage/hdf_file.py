@@ -19,6 +19,40 @@ if LooseVersion(h5py.__version__) >= LooseVersion("3.5.0"): # new file locking
 elif LooseVersion(h5py.__version__) >= LooseVersion("3.0.0"): # intermediate
     logging.error("Qkit HDF file handling: In h5py between 3.0 and 3.5, there are problems with file locking handling. Please update to h5py==3.5.0")
 
+# keyword arguments of create_dataset() that configure the storage layout and
+# are therefore not stored as attributes of the dataset
+storage_kwargs = ('scaleoffset', 'compression', 'compression_opts', 'shuffle', 'chunks', 'outer_shape', 'shape')
+
+def chunk_shape(dim, tracelength, itemsize, outer_shape=(), chunk_bytes=None):
+    """Chunk shape for a dataset of 'dim' dimensions targeting a byte size.
+    
+    The innermost dimension holds whole traces (split only if a single trace 
+    exceeds the target). The outer dimensions are filled up with as many traces
+    as fit into qkit.cfg['h5_chunk_bytes'] (default 512 KiB), limited by the
+    expected outer lengths known from the coordinate vectors.
+    
+    Args:
+        dim: number of dimensions (2 or 3)
+        tracelength: length of the innermost dimension
+        itemsize: bytes per value
+        outer_shape: expected lengths of the outer dimensions, None if unknown
+        chunk_bytes: optional target size of a chunk in bytes
+    Returns:
+        tuple with the chunk shape
+    """
+    if chunk_bytes is None:
+        chunk_bytes = qkit.cfg.get('h5_chunk_bytes', 512*1024)
+    tracelength = max(1, tracelength)
+    trace_chunk = min(tracelength, max(1, chunk_bytes // itemsize))
+    traces = max(1, chunk_bytes // (trace_chunk * itemsize))
+    outer_shape = list(outer_shape or ()) + [None] * (dim - 1)
+    chunks = []
+    for length in reversed(outer_shape[:dim - 1]):
+        n = traces if not length else min(traces, length)
+        chunks.insert(0, n)
+        traces = max(1, traces // n)
+    return tuple(chunks) + (trace_chunk,)
+
 class H5_file(object):
     """Base hdf5 class intended for qkit.
     
@@ -32,12 +66,27 @@ class H5_file(object):
     trick of placing added data in the correct position in the dataset.
     """    
     
-    def __init__(self,output_file, mode,**kw):
+    def __init__(self,output_file, mode, swmr=False, **kw):
         """Inits the H5_file at the path 'output_file' with the access mode
         'mode'
+        
+        With 'swmr' set, the file is opened for single-writer/multiple-reader
+        access: a writer switches to SWMR mode by start_swmr(), which the
+        measurement calls once all its datasets are created. A reader ('r')
+        opens the file as SWMR reader.
         """
+        self.swmr = swmr
         self.create_file(output_file, mode)
         self.newfile = False
+        # datasets with a pending write-behind buffer, see hdf_dataset(buffered=True)
+        self._buffered_datasets = []
+        # hdf_dataset objects of this file, and those not yet created in the file
+        self._datasets = []
+        self._pending_datasets = []
+        # start_swmr() was called before all datasets were created
+        self._swmr_requested = False
+        # optional background writer thread, see qkit.storage.hdf_writer
+        self.writer = None
         
         if self.hf.attrs.get("qt-file",None) or self.hf.attrs.get("qkit",None):
             "File existed before and was created by qkit."
@@ -52,7 +101,13 @@ class H5_file(object):
                 self.grp.attrs[k] = kw[k]
         
     def create_file(self,output_file, mode):
-        self.hf = h5py.File(output_file, mode,**file_kwargs )
+        kwargs = dict(file_kwargs)
+        if self.swmr:
+            # SWMR needs the latest file format, i.e. HDF5 >= 1.10
+            kwargs['libver'] = 'latest'
+            if mode == 'r':
+                kwargs['swmr'] = True
+        self.hf = h5py.File(output_file, mode, **kwargs)
 
     def set_base_attributes(self):
         "stores some attributes and creates the default data group"
@@ -101,29 +156,40 @@ class H5_file(object):
             
                 'folder' is a optional group relative to the default group
             
-                'kwargs' are appended as attributes to the dataset
+                'kwargs' are appended as attributes to the dataset, except for
+                the storage options:
+                    'chunks': explicit chunk shape, default from chunk_shape()
+                    'outer_shape': expected lengths of the outer dimensions
+                    'shape': initial (final) shape of a preallocated dataset
+                    'compression': lossless filter, e.g. 'gzip' or 'lzf'
+                    'compression_opts': e.g. the gzip level (0-9)
+                    'shuffle': byte shuffle filter, improves compression
+                    'scaleoffset': lossy compression, see below
         """
 
         self.ds_type = ds_type
+        # by default we create float datasets        
+        dtype = kwargs.get('dtype','f')
         
         if dim == 1:
             shape    = (0,)
             maxshape = (None,)
             chunks=True
             
-        elif dim == 2:
-            shape    = (0,0)
-            maxshape = (None,None)
-            chunks=(5, tracelength)
-            
-        elif dim == 3:
-            shape    = (0,0,0)
-            maxshape = (None,None,None)
-            chunks=(5, 5, tracelength)
+        elif dim in (2, 3):
+            shape    = (0,) * dim
+            maxshape = (None,) * dim
+            chunks = chunk_shape(dim, tracelength, np.dtype(dtype).itemsize, kwargs.get('outer_shape'))
             
         else:
             logging.error("Create datasets: '%s' is wrong number of dims." %(dim))
             raise ValueError
+        chunks = kwargs.get('chunks') or chunks
+        shape = kwargs.get('shape') or shape
+
+        if self.hf.swmr_mode:
+            logging.error("Create datasets: '%s' is created after the switch to SWMR mode, '%s' is reopened as normal file." % (name, self.hf.filename))
+            self._leave_swmr()
 
         if folder == "data":
             self.grp = self.dgrp
@@ -135,13 +201,11 @@ class H5_file(object):
         else:
             logging.error("please specify either: folder = 'data' , folder = 'analysis' or folder ='view' ")
             raise ValueError
-            
+
         if name in self.grp.keys():
             logging.info("Item '%s' already exists in data set." % (name))
             #return False        
             
-        # by default we create float datasets        
-        dtype = kwargs.get('dtype','f')
         
         # we store text as unicode; this seems somewhat non-standard for hdf
         if ds_type == ds_types['txt']:
@@ -163,11 +227,15 @@ class H5_file(object):
         # 'scaleoffset' is an optional parameter for lossy compression of floating-point data,  retaining a specified number of bits post-decimal. 
         # It is used to compress dataset elements by reducing the precision of the data. Defaults to None, implying no compression.
         scaleoffset = kwargs.get('scaleoffset',None)
+        # lossless filters; 'shuffle' reorders the bytes and helps gzip/lzf on float data
+        filters = dict(compression=kwargs.get('compression', None),
+                       compression_opts=kwargs.get('compression_opts', None),
+                       shuffle=kwargs.get('shuffle', False))
 
         if ds_type == ds_types['txt']:
-            ds = self.grp.create_dataset(name, shape, maxshape=maxshape, chunks = chunks, dtype=dtype, scaleoffset = scaleoffset)
+            ds = self.grp.create_dataset(name, shape, maxshape=maxshape, chunks = chunks, dtype=dtype, scaleoffset = scaleoffset, **filters)
         else:
-            ds = self.grp.create_dataset(name, shape, maxshape=maxshape, chunks = chunks, dtype=dtype, fillvalue = np.nan, scaleoffset = scaleoffset)
+            ds = self.grp.create_dataset(name, shape, maxshape=maxshape, chunks = chunks, dtype=dtype, fillvalue = np.nan, scaleoffset = scaleoffset, **filters)
         
         ds.attrs.create("name",name.encode())
         ds.attrs.create("ds_type", ds_type)
@@ -176,7 +244,7 @@ class H5_file(object):
             ds.attrs.create("fill", [0,0,0])
         # add attibutes
         for a in kwargs:
-            if not a == "scaleoffset":
+            if a not in storage_kwargs:
                 ds.attrs.create(a,(kwargs[a]).encode())
              
         self.flush()
@@ -230,6 +298,7 @@ class H5_file(object):
                         ## here the data gets not appended but overwritten!
                         ds.resize((len(data),))
                         ds[:] = data
+                        self.count_rewrite(ds)
                     else:
                         ## data append
                         dim1 = ds.shape[0] 
@@ -260,6 +329,7 @@ class H5_file(object):
                 fill[1] = len(data)
                 if reset:
                     ds[dim0-1,:] = data  # reset overwrites last data series (last row matrix)
+                    self.count_rewrite(ds)
                 else:  # standard reset = False
                     fill[0] += 1
                     ds.resize((dim0+1,len(data)))
@@ -284,16 +354,250 @@ class H5_file(object):
                 fill[1] += 1 # Update write position
             ds[fill[0]-1,fill[1]-1] = data # Our indices start with one.
             ds.attrs.modify("fill", fill)
+            if reset:
+                self.count_rewrite(ds)
 
         self.flush()
+
+    def append_in_place(self, ds, data, next_matrix=False, reset=False, pointwise=False):
+        """Method for writing data into a preallocated dataset.
         
+        Counterpart of append() for datasets created at their final shape.
+        The data is written by index at the position given by the 'fill'
+        attribute, which is the only thing that grows. Data exceeding the 
+        preallocated shape enlarges the dataset as a fallback.
+        
+        Args:
+            hdf_dataset 'ds'
+            numpy array 'data'
+            boolean 'next_matrix'
+            reset (Boolean): overwrite the last trace (the whole vector for 1D)
+            pointwise (Boolean): if True, the data is appended pointwise, i.e. to the innermost dimension
+        """
+        fill = ds.attrs.get('fill')
+        if len(ds.shape) == 1:
+            if reset:
+                fill[0] = 0
+            self._grow(ds, (fill[0] + len(data),))
+            ds[fill[0]:fill[0] + len(data)] = data
+            fill[0] += len(data)
+
+        elif len(ds.shape) == 2:
+            if pointwise:
+                if next_matrix or fill[0] == 0:
+                    fill[0] += 1
+                    fill[1] = 0
+                fill[1] += 1
+                self._grow(ds, (fill[0], fill[1]))
+                ds[fill[0]-1, fill[1]-1] = data
+            else:
+                if not reset or fill[0] == 0:
+                    fill[0] += 1
+                fill[1] = len(data)
+                self._grow(ds, (fill[0], len(data)))
+                ds[fill[0]-1, :len(data)] = data
+
+        elif len(ds.shape) == 3:
+            if next_matrix or fill[0] == 0:
+                fill[0] += 1
+                fill[1] = 0
+            if not reset or fill[1] == 0:
+                fill[1] += 1
+            self._grow(ds, (fill[0], fill[1], len(data)))
+            ds[fill[0]-1, fill[1]-1, :len(data)] = data
+        ds.attrs.modify('fill', fill)
+        if reset:
+            self.count_rewrite(ds)
+
+        self.flush()
+
+    def count_rewrite(self, ds):
+        """Increments the 'rewrites' attribute of a dataset after written data
+        has been overwritten in place (reset). Readers caching the data, like
+        qviewkit, compare it to notice the change.
+        """
+        try:
+            ds.attrs.modify('rewrites', int(ds.attrs.get('rewrites', 0)) + 1)
+        except (KeyError, ValueError, RuntimeError) as e:
+            # new attributes cannot be added to a file in SWMR mode
+            logging.debug("Qkit HDF file handling: Could not count rewrite of '%s': %s" % (ds.name, e))
+
+    def _grow(self, ds, shape):
+        """Enlarges a dataset to at least 'shape', it is never shrunk."""
+        shape = tuple(max(n, m) for n, m in zip(ds.shape, shape))
+        if shape != ds.shape:
+            ds.resize(shape)
+
+    def append_block(self, ds, data, next_matrix=False, in_place=False):
+        """Method for appending several data traces at once.
+
+        Block counterpart of append() for the standard (not pointwise, not
+        reset) case, used to write the content of a write-behind buffer.
+        Vectors are extended by the concatenated entries, matrices get all rows
+        at once and boxes get all rows into the current x-slice. For matrices
+        the first dimension is grown geometrically; the number of valid rows is
+        tracked in the 'fill' attribute and the dataset is cut back to it by
+        trim_dataset().
+        The file is not flushed here.
+
+        Args:
+            hdf_dataset 'ds'
+            numpy array 'data': concatenated entries (1D) or stacked traces (2D, 3D)
+            boolean 'next_matrix': the first trace opens a new matrix in a value_box
+            in_place (Boolean): 'ds' is preallocated, see append_in_place()
+        """
+        if in_place:
+            self._append_block_in_place(ds, data, next_matrix)
+
+        elif len(ds.shape) == 1:
+            dim0 = ds.shape[0]
+            data = data.ravel()
+            ds.resize((dim0 + len(data),))
+            ds[dim0:] = data
+
+        elif len(ds.shape) == 2:
+            fill = ds.attrs.get('fill')
+            rows, tracelength = data.shape
+            dim0 = ds.shape[0]
+            if fill[0] + rows > dim0:
+                dim0 = max(fill[0] + rows, 2 * dim0)
+            ds.resize((dim0, tracelength))
+            ds[fill[0]:fill[0] + rows, :] = data
+            fill[0] += rows
+            fill[1] = tracelength
+            ds.attrs.modify('fill', fill)
+
+        elif len(ds.shape) == 3:
+            rows, tracelength = data.shape
+            dim0 = max(1, ds.shape[0])
+            dim1 = ds.shape[1]
+            fill = ds.attrs.get('fill')
+            if next_matrix:
+                dim0 += 1
+                fill[0] += 1
+                fill[1] = 0
+            if dim0 == 1:
+                fill[0] = 1
+                dim1 += rows
+            ds.resize((dim0, dim1, tracelength))
+            ds[fill[0]-1, fill[1]:fill[1] + rows] = data
+            fill[1] += rows
+            ds.attrs.modify("fill", fill)
+
+    def _append_block_in_place(self, ds, data, next_matrix=False):
+        """append_block() for preallocated datasets, the traces are written 
+        at the position given by 'fill'.
+        """
+        fill = ds.attrs.get('fill')
+        if len(ds.shape) == 1:
+            data = data.ravel()
+            self._grow(ds, (fill[0] + len(data),))
+            ds[fill[0]:fill[0] + len(data)] = data
+            fill[0] += len(data)
+
+        elif len(ds.shape) == 2:
+            rows, tracelength = data.shape
+            self._grow(ds, (fill[0] + rows, tracelength))
+            ds[fill[0]:fill[0] + rows, :tracelength] = data
+            fill[0] += rows
+            fill[1] = tracelength
+
+        elif len(ds.shape) == 3:
+            rows, tracelength = data.shape
+            if next_matrix or fill[0] == 0:
+                fill[0] += 1
+                fill[1] = 0
+            self._grow(ds, (fill[0], fill[1] + rows, tracelength))
+            ds[fill[0]-1, fill[1]:fill[1] + rows, :tracelength] = data
+            fill[1] += rows
+        ds.attrs.modify('fill', fill)
+
+    def trim_dataset(self, ds):
+        """Cuts a geometrically grown matrix back to the rows given by 'fill'."""
+        if len(ds.shape) == 2:
+            fill = ds.attrs.get('fill')
+            if ds.shape[0] > fill[0]:
+                ds.resize((fill[0], ds.shape[1]))
+
+    def register_buffer(self, ds):
+        """Registers a buffered hdf_dataset to be flushed with the file."""
+        if ds not in self._buffered_datasets:
+            self._buffered_datasets.append(ds)
+
+    def flush_buffers(self, trim=False):
+        """Writes all pending write-behind buffers to the file and flushes it.
+
+        Args:
+            trim (Boolean): cut geometrically grown datasets back to their fill
+        """
+        for ds in self._buffered_datasets:
+            ds.flush_buffer(trim=trim)
+        self.flush()
+
+    def register_dataset(self, ds):
+        """Announces a hdf_dataset whose h5 dataset is created on its first append."""
+        self._datasets.append(ds)
+        self._pending_datasets.append(ds)
+
+    def dataset_created(self, ds):
+        """Marks an announced dataset as created."""
+        if ds in self._pending_datasets:
+            self._pending_datasets.remove(ds)
+        if self._swmr_requested and not self._pending_datasets:
+            self.start_swmr()
+
+    def start_swmr(self):
+        """Switches the writer to SWMR mode. From now on readers can follow the
+        data by refreshing the datasets. No datasets can be added in SWMR mode,
+        a dataset created later reopens the file as normal file.
+        Datasets are created on their first append: with datasets still to be
+        created, the switch is done once the last of them is created.
+        """
+        if not self.swmr or self.hf.swmr_mode or self.hf.mode == 'r':
+            return
+        if self._pending_datasets:
+            logging.info("Qkit HDF file handling: '%s' switches to SWMR mode once '%s' is created." % (self.hf.filename, "', '".join(ds.name for ds in self._pending_datasets)))
+            self._swmr_requested = True
+            return
+        self._swmr_requested = False
+        self.flush()
+        try:
+            self.hf.swmr_mode = True
+        except (ValueError, RuntimeError) as e:
+            # e.g. files created with an older file format
+            logging.warning("Qkit HDF file handling: Could not switch '%s' to SWMR mode: %s" % (self.hf.filename, e))
+            self.swmr = False
+
+    def _leave_swmr(self):
+        """Reopens a writer in SWMR mode as normal file, the h5 datasets of the
+        hdf_dataset objects are looked up again in the reopened file.
+        """
+        urls = [(ds, attr, getattr(ds, attr).name) for ds in self._datasets
+                for attr in ('ds', 'ds_ts') if getattr(ds, attr, None) is not None]
+        filename = self.hf.filename
+        self.flush()
+        self.hf.close()
+        self.swmr = False
+        self.hf = h5py.File(filename, 'a', libver='latest', **file_kwargs)
+        self.setup_required_groups()
+        # tells qviewkit to read this file normally again
+        self.hf.attrs['_swmr'] = False
+        for ds, attr, url in urls:
+            setattr(ds, attr, self.hf[url])
+
     def flush(self):
         self.hf.flush()
         
     def close_file(self):
         # delegate close
+        if self.hf.mode != 'r':
+            self.flush_buffers(trim=True)
         if self.newfile:
-            self.entry.attrs["updating"] = False
+            if self.hf.swmr_mode:
+                # attributes can only be modified in place in SWMR mode
+                self.entry.attrs.modify("updating", False)
+            else:
+                self.entry.attrs["updating"] = False
         self.hf.close()
         
     def __getitem__(self,s):
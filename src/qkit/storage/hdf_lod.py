@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Level-of-detail pyramid for large value matrices.
+
+Each level is the block mean (NaN ignoring) of the previous one, reduced by
+'factor' along both axes, until both axes are shorter than 'min_size'. The
+levels are stored next to the data in analysis0 as '<name>_lod<level>' with
+the attributes 'lod_source' (ds_url of the matrix) and 'lod_factor' (total
+reduction w.r.t. the matrix). The x and y coordinates are reduced the same way
+and stored as '<name>_lod<level>_x' and '_y' (attribute 'lod_axis_source'), the
+'x_ds_url' and 'y_ds_url' of a level point to them. qviewkit displays the coarsest level that still
+resolves the plot window and reads finer levels for zoomed regions.
+
+The pyramid is meant for completed measurements: it is built block-wise
+(a few rows of the matrix in memory at a time) by build_pyramid() or on
+Data.close() with qkit.cfg['h5_lod_pyramid'] = True.
+"""
+import logging
+
+import numpy as np
+
+import qkit
+from qkit.storage.hdf_constants import ds_types
+
+
+def _decimate(block, factor):
+    """Block mean of a 2D array over factor x factor cells, missing cells are NaN padded."""
+    nx = -(-block.shape[0] // factor) * factor
+    ny = -(-block.shape[1] // factor) * factor
+    if (nx, ny) != block.shape:
+        padded = np.full((nx, ny), np.nan)
+        padded[:block.shape[0], :block.shape[1]] = block
+        block = padded
+    with np.errstate(invalid='ignore'):
+        cells = block.reshape(nx // factor, factor, ny // factor, factor)
+        counts = np.sum(~np.isnan(cells), axis=(1, 3))
+        sums = np.nansum(cells, axis=(1, 3))
+        return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+
+def _decimate_axis(values, factor, n):
+    """Block mean of the first n coordinate values over factor values, missing values are NaN padded."""
+    padded = np.full(-(-n // factor) * factor, np.nan)
+    values = np.asarray(values[:n], dtype='f8')
+    padded[:len(values)] = values
+    cells = padded.reshape(-1, factor)
+    counts = np.sum(~np.isnan(cells), axis=1)
+    with np.errstate(invalid='ignore'):
+        return np.where(counts > 0, np.nansum(cells, axis=1) / np.maximum(counts, 1), np.nan)
+
+
+def _axes(h5_file, ds):
+    """Returns {'x_ds_url': dataset, 'y_ds_url': dataset} of the coordinates of a matrix found in the file."""
+    axes = {}
+    for attr in ('x_ds_url', 'y_ds_url'):
+        url = ds.attrs.get(attr, None)
+        if isinstance(url, bytes):
+            url = url.decode()
+        if url and url in h5_file:
+            axes[attr] = h5_file[url]
+    return axes
+
+
+def levels(ds):
+    """Returns [(lod_factor, dataset)] of the pyramid of the h5py dataset ds, sorted by factor."""
+    try:
+        grp = ds.file['/entry/analysis0']
+    except KeyError:
+        return []
+    url = ds.name.encode()
+    found = []
+    for name in grp:
+        if name.startswith(ds.name.split('/')[-1] + '_lod'):
+            lod = grp[name]
+            if lod.attrs.get('lod_source', b'') in (url, ds.name):
+                found.append((int(lod.attrs.get('lod_factor', 1)), lod))
+    return sorted(found, key=lambda l: l[0])
+
+
+def build_pyramid(h5_file, ds_url, factor=None, min_size=None, rows_per_block=None):
+    """Builds (or rebuilds) the level-of-detail pyramid of a value matrix.
+
+    Args:
+        h5_file: h5py.File opened for writing.
+        ds_url: url of the matrix, e.g. '/entry/data0/amplitude'.
+        factor: reduction per level, default qkit.cfg['h5_lod_factor'] or 4.
+        min_size: no further levels once both axes are shorter,
+            default qkit.cfg['h5_lod_min_size'] or 512.
+        rows_per_block: rows of the output level computed at once.
+    Returns:
+        list of the urls of the levels.
+    """
+    factor = factor or qkit.cfg.get('h5_lod_factor', 4)
+    min_size = min_size or qkit.cfg.get('h5_lod_min_size', 512)
+    src = h5_file[ds_url]
+    if src.ndim != 2:
+        raise ValueError("LOD pyramid: '%s' is not a matrix." % ds_url)
+    if rows_per_block is None:
+        rows_per_block = max(1, (16 * 1024 * 1024) // (8 * factor * max(1, src.shape[1])))
+    fill = src.attrs.get('fill', None)
+    nx = int(fill[0]) if fill is not None and 0 < fill[0] < src.shape[0] else src.shape[0]
+    grp = h5_file.require_group('/entry/analysis0')
+    name = ds_url.split('/')[-1]
+    for old in [n for n in grp if n.startswith(name + '_lod')]:
+        if (grp[old].attrs.get('lod_source', b'') in (ds_url.encode(), ds_url) or
+                grp[old].attrs.get('lod_axis_source', b'') in (ds_url.encode(), ds_url)):
+            del grp[old]
+    axes = _axes(h5_file, src)
+
+    urls = []
+    level, total, shape = 1, 1, (nx, src.shape[1])
+    while max(shape) >= min_size:
+        total *= factor
+        out_shape = (-(-shape[0] // factor), -(-shape[1] // factor))
+        lod = grp.create_dataset("%s_lod%i" % (name, level), out_shape, dtype='f8', fillvalue=np.nan,
+                                 chunks=(min(out_shape[0], 64), min(out_shape[1], 1024)))
+        for i in range(0, out_shape[0], rows_per_block):
+            block = src[i * factor:min((i + rows_per_block) * factor, shape[0]), :shape[1]]
+            lod[i:i + rows_per_block] = _decimate(np.asarray(block, dtype='f8'), factor)
+        for attr in ('name', 'unit'):
+            if attr in src.attrs:
+                lod.attrs[attr] = src.attrs[attr]
+        for i, attr in enumerate(('x_ds_url', 'y_ds_url')):
+            if attr not in axes:
+                continue
+            axis = grp.create_dataset("%s_lod%i_%s" % (name, level, attr[0]),
+                                      data=_decimate_axis(axes[attr], factor, shape[i]))
+            for a in ('name', 'unit', 'ds_type'):
+                if a in axes[attr].attrs:
+                    axis.attrs[a] = axes[attr].attrs[a]
+            axis.attrs['lod_axis_source'] = ds_url.encode()
+            axis.attrs['comment'] = ("level of detail %i of the %s coordinate of %s" % (level, attr[0], ds_url)).encode()
+            lod.attrs[attr] = axis.name.encode()
+            axes[attr] = axis
+        lod.attrs['lod_source'] = ds_url.encode()
+        lod.attrs['lod_factor'] = total
+        lod.attrs['comment'] = ("level of detail %i of %s, mean over %ix%i values" % (level, ds_url, total, total)).encode()
+        urls.append(lod.name)
+        src, shape, level = lod, out_shape, level + 1
+    logging.debug("LOD pyramid of %s: %s" % (ds_url, urls))
+    return urls
+
+
+def build_all(h5_file, min_size=None):
+    """Builds the pyramids of all value matrices in data0 larger than min_size."""
+    min_size = min_size or qkit.cfg.get('h5_lod_min_size', 512)
+    urls = []
+    for ds in h5_file['/entry/data0'].values():
+        if ds.attrs.get('ds_type', -1) == ds_types['matrix'] and max(ds.shape) >= min_size:
+            urls += build_pyramid(h5_file, ds.name, min_size=min_size)
+    return urls
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Background writer thread for the hdf storage layer.
+"""
+import logging
+import threading
+import time
+try:
+    import queue
+except ImportError:
+    import Queue as queue  # python 2
+
+import qkit
+
+
+class H5_writer(object):
+    """Writer thread that owns the write access to a H5_file.
+    
+    hdf_dataset.append() hands its (already copied) numpy buffer to submit(),
+    the thread writes it to the file. The queue is bounded: if the storage 
+    cannot keep up, submit() blocks until there is room again (backpressure).
+    An exception in the writer thread is raised in the measurement thread on
+    the next submit(), sync() or close(); jobs queued after a failed one are
+    dropped until then.
+    
+    Instrumentation:
+        queue_depth: number of jobs waiting to be written
+        write_latency: mean time (s) a job needs to be written
+        max_write_latency: longest time (s) a job needed to be written
+        wait_time: accumulated time (s) the measurement was blocked by a full queue
+        bytes_written: number of data bytes written
+        write_rate: data bytes per second of write time
+    """
+
+    def __init__(self, h5_file, maxsize=None):
+        """Inits the writer for a H5_file and starts the thread.
+        
+        Args:
+            h5_file: H5_file object to write to
+            maxsize: maximum queue depth, default: qkit.cfg['h5_writer_queue_size'] or 100
+        """
+        self.hf = h5_file
+        if maxsize is None:
+            maxsize = qkit.cfg.get('h5_writer_queue_size', 100)
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._error = None
+        self._lock = threading.Lock()
+        self.jobs_written = 0
+        self.bytes_written = 0
+        self.write_time = 0.
+        self.max_write_latency = 0.
+        self.wait_time = 0.
+        self._thread = threading.Thread(target=self._run, name="H5_writer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    @property
+    def write_latency(self):
+        return self.write_time / self.jobs_written if self.jobs_written else 0.
+
+    @property
+    def write_rate(self):
+        return self.bytes_written / self.write_time if self.write_time else 0.
+
+    def submit(self, func, *args, **kwargs):
+        """Queues func(*args, **kwargs) to be executed by the writer thread.
+        
+        The keyword argument 'nbytes' is not passed on but counted as written
+        data bytes. Blocks while the queue is full.
+        """
+        nbytes = kwargs.pop('nbytes', 0)
+        self.check()
+        if not self._thread.is_alive():
+            raise IOError("H5_writer: The writer thread is not running anymore.")
+        t0 = time.time()
+        self._queue.put((func, args, kwargs, nbytes))
+        self.wait_time += time.time() - t0
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                break
+            func, args, kwargs, nbytes = job
+            t0 = time.time()
+            try:
+                if self._error is None:
+                    func(*args, **kwargs)
+            except Exception as e:
+                logging.error("H5_writer: Error while writing to '%s': %s" % (self.hf.hf.filename, e))
+                with self._lock:
+                    self._error = e
+            finally:
+                dt = time.time() - t0
+                self.jobs_written += 1
+                self.bytes_written += nbytes
+                self.write_time += dt
+                self.max_write_latency = max(self.max_write_latency, dt)
+                self._queue.task_done()
+
+    def check(self):
+        """Raises an exception that occurred in the writer thread."""
+        with self._lock:
+            error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def sync(self):
+        """Waits until all queued jobs are written."""
+        self._queue.join()
+        self.check()
+
+    def close(self):
+        """Writes all queued jobs and stops the thread."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self.check()
+
+    def __repr__(self):
+        return "H5_writer: queue depth %d, %d jobs, mean latency %.3g s, %.3g MB/s" % (
+            self.queue_depth, self.jobs_written, self.write_latency, self.write_rate / 1e6)
@@ -16,10 +16,83 @@ from qkit.storage.hdf_file import H5_file
 from qkit.storage.hdf_dataset import hdf_dataset
 from qkit.storage.hdf_constants import ds_types
 from qkit.storage.hdf_view import dataset_view
+from qkit.storage.hdf_writer import H5_writer
+from qkit.storage import hdf_lod
 from qkit.storage.hdf_DateTimeGenerator import DateTimeGenerator
 
 
 
+class lazy_dataset(object):
+    """Handle of a dataset in a Data object, resolved on first access.
+    
+    The hdf dataset is opened when it is first used, its hdf attributes are
+    available as python attributes (e.g. ds.unit) and read when asked for.
+    Slicing is passed straight through to h5py, i.e. ds[-1] or ds[:, 10] 
+    only reads the selected part of the file. read_direct() reads into a
+    buffer of the caller without an intermediate copy.
+    """
+    def __init__(self, h5_group, name):
+        self.__dict__['_group'] = h5_group
+        self.__dict__['_name'] = name
+        self.__dict__['_ds'] = None
+
+    @property
+    def ds(self):
+        """The h5py dataset."""
+        if self._ds is None:
+            self.__dict__['_ds'] = self._group[self._name]
+        return self._ds
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        try:
+            return getattr(self.ds, name)
+        except AttributeError:
+            pass
+        try:
+            value = self.ds.attrs[name]
+        except KeyError:
+            raise AttributeError("Dataset '{}' has no attribute '{}'".format(self._name, name))
+        self.__dict__[name] = value
+        return value
+
+    def __dir__(self):
+        return sorted(set(dir(type(self))) | set(self.__dict__) | set(dir(self.ds)) | set(self.ds.attrs.keys()))
+
+    def __getitem__(self, key):
+        return self.ds[key]
+
+    def __setitem__(self, key, value):
+        self.ds[key] = value
+
+    def __len__(self):
+        return len(self.ds)
+
+    def __array__(self, dtype=None, copy=None):
+        # the data is read from the file, there is no view without a copy (numpy 2 protocol)
+        if copy is False:
+            raise ValueError("lazy_dataset '{}' cannot be converted to an array without a copy".format(self._name))
+        return self.ds[()] if dtype is None else self.ds[()].astype(dtype, copy=False)
+
+    def read_direct(self, dest, source_sel=None, dest_sel=None):
+        """Reads the selection source_sel of the dataset into the numpy array
+        dest (at dest_sel), without temporary copies. Returns dest.
+        """
+        self.ds.read_direct(dest, source_sel, dest_sel)
+        return dest
+
+    def __repr__(self):
+        return "<lazy_dataset '{}'>".format(self._name)
+
+
+class group(object):
+    """Dummy class holding the datasets of a hdf group as lazy_dataset attributes."""
+    def __init__(self, h5_group):
+        for n in h5_group.keys():
+            self.__dict__[n.replace(" ","_")] = lazy_dataset(h5_group, n)
+
+
 class Data(object):
     """Basic hdf5 class adopted to our needs.
     
@@ -29,7 +102,7 @@ class Data(object):
     mentioned classes.
     """
     # a types
-    def __init__(self, name = None, mode = 'r+', copy_file = False):
+    def __init__(self, name = None, mode = 'r+', copy_file = False, buffered = None, preallocate = None, swmr = False, threaded = None):
         """Creates an empty data set including the file, for which the currently
         set file name generator is used or opens the h5 file at location 'name'.
 
@@ -37,6 +110,26 @@ class Data(object):
             name (string):  filename or absolute filepath
             mode (string):  access mode to the hdf5 file, default: 'r+' (read+write).
                 Other modes are 'a' (read, write, and create)
+            buffered (bool): default for the write-behind buffer of the datasets
+                added to this file, default: qkit.cfg['h5_buffered'] or False.
+                Buffered data is written on the flush policy given by 
+                qkit.cfg['h5_flush_interval'] (s) and qkit.cfg['h5_flush_bytes'],
+                on flush() and on close().
+            preallocate (bool): default for creating the value datasets added to
+                this file at their final shape given by their coordinates,
+                default: qkit.cfg['h5_preallocate'] or False.
+            swmr (bool): single-writer/multiple-reader access, default: False.
+                A writer switches to SWMR mode on start_swmr(), which the
+                measurement calls once all its datasets are added; the switch
+                is done when they are created by their first append. Datasets
+                added later reopen the file as normal file. Readers (mode 'r')
+                follow the data by refreshing the datasets instead of
+                reopening the file.
+            threaded (bool): write appended data in a background thread, 
+                default: qkit.cfg['h5_threaded'] or False. The writer is 
+                available as 'writer' and reports queue depth, write latency
+                and throughput. Errors are raised on the next append, on 
+                flush() or on close().
         """
         self._name = name
         if os.path.isfile(self._name):
@@ -53,9 +146,15 @@ class Data(object):
             self._folder,self._filename = os.path.split(self._filepath)
         "setup the  file"
         try:
-            self.hf = H5_file(self._filepath, mode)
+            self.hf = H5_file(self._filepath, mode, swmr=swmr)
         except IOError:
             raise IOError('File does not exist. Use argument \"mode=\'a\'\" to create a new h5 file.')
+        if buffered is None:
+            buffered = qkit.cfg.get('h5_buffered', False)
+        self.hf.buffered = buffered
+        if preallocate is None:
+            preallocate = qkit.cfg.get('h5_preallocate', False)
+        self.hf.preallocate = preallocate
         if self.hf.newfile:
             if self.__dict__.get('_uuid', False):
                 tags = ["_unix_timestamp", "_localtime", "_timestamp", "_timemark", "_datemark", "_uuid", "_filename", "_folder", "_relpath", "_filepath"]
@@ -64,8 +163,17 @@ class Data(object):
                 self.hf.hf.attrs['_user'] = qkit.cfg.get('user')
             if "run_id" in qkit.cfg:
                 self.hf.hf.attrs['_run_id'] = qkit.cfg.get('run_id').upper()
+            if swmr:
+                # tells qviewkit to follow this file as SWMR reader
+                self.hf.hf.attrs['_swmr'] = True
         self._mapH5PathToObject()
         self.hf.flush()
+        if threaded is None:
+            threaded = qkit.cfg.get('h5_threaded', False)
+        self.writer = None
+        if threaded and mode != 'r':
+            self.writer = H5_writer(self.hf)
+            self.hf.writer = self.writer
         
     def __enter__(self):
         return self
@@ -86,28 +194,16 @@ class Data(object):
         """Function for automated data readout at Data object creation.
         
         This function gets called during the init of a data object. Here we 
-        translate the attributes of all datasets into attributs of the 
+        map the datasets of analysis0 and data0 to attributes of the
         dummy-class "group". These objects get added to the self.__dict__ what
         makes them tabbable in a notebook.
-        We iterate over all atributes of all entries in analysis0 and data0 as
-        well as the 'comment' entry on the respective group attributes.
+        Only the names are read here: the datasets are lazy_dataset objects, 
+        which open the hdf dataset and read its attributes on first access.
+        The 'comment' entry of the respective group attributes is added as well.
         """
-        class group(object):
-            pass
-        
-        a = group()
-        for n, o in self.hf.hf['/entry/analysis0'].items():
-            n = n.replace(" ","_")
-            a.__dict__[n] = o
-            for nn, oo in o.attrs.items():
-                o.__dict__[nn] = oo
+        a = group(self.hf.hf['/entry/analysis0'])
         a.__dict__['comment'] = self.hf.agrp.attrs.get('comment', '')
-        d = group()
-        for n, o in self.hf.hf['/entry/data0'].items():
-            n = n.replace(" ","_")
-            d.__dict__[n] = o
-            for nn, oo in o.attrs.items():
-                o.__dict__[nn] = oo
+        d = group(self.hf.hf['/entry/data0'])
         d.__dict__['comment'] = self.hf.dgrp.attrs.get('comment', '')
         self.__dict__.update({'analysis':a})
         self.__dict__.update({'data':d})
@@ -136,6 +232,7 @@ class Data(object):
             os.makedirs(self._folder)
 
     def __getitem__(self, name):
+        self.sync()
         return self.hf[name]
 
     def __setitem__(self, name, val):
@@ -235,6 +332,9 @@ class Data(object):
             unit: Optional string.
             comment: Optional string to put in any comment.
             folder: Optional string ('data' or 'analysis').
+            compression: Optional lossless filter ('gzip' or 'lzf'), together
+                with 'compression_opts' and 'shuffle'. 'chunks' overrides the
+                chunk shape, which by default targets qkit.cfg['h5_chunk_bytes'].
         
         Returns:
             hdf_dataset object.
@@ -259,6 +359,9 @@ class Data(object):
             unit: Optional string.
             comment: Optional string to put in any comment.
             folder: Optional string ('data' or 'analysis').
+            compression: Optional lossless filter ('gzip' or 'lzf'), together
+                with 'compression_opts' and 'shuffle'. 'chunks' overrides the
+                chunk shape, which by default targets qkit.cfg['h5_chunk_bytes'].
         
         Returns:
             hdf_dataset object.
@@ -300,13 +403,55 @@ class Data(object):
     def get_dataset(self,ds_url):
         return hdf_dataset(self.hf,ds_url = ds_url)
 
+    def start_swmr(self):
+        """Switches a file opened with swmr=True to SWMR mode. Call it once 
+        all datasets are added: datasets not yet created by their first append
+        are waited for, the switch is done when the last one is created. A 
+        dataset created afterwards logs an error and reopens the file without
+        SWMR. Does nothing for files opened without swmr.
+        """
+        if self.writer is not None:
+            self.writer.submit(self.hf.start_swmr)
+            self.writer.sync()
+        else:
+            self.hf.start_swmr()
+
     def save_finished(self):
         pass
 
+    def sync(self):
+        """Waits until the background writer has written all appended data."""
+        if self.writer is not None:
+            self.writer.sync()
+
     def flush(self):
-        self.hf.flush()
+        if self.writer is not None:
+            self.writer.submit(self.hf.flush_buffers)
+            self.writer.sync()
+        else:
+            self.hf.flush_buffers()
+
+    def build_lod_pyramid(self, ds_url=None):
+        """Stores level-of-detail versions (block means) of a value matrix in
+        analysis0, used by qviewkit to display large matrices. Without 
+        ds_url, all value matrices of data0 larger than 
+        qkit.cfg['h5_lod_min_size'] (default 512) get a pyramid. 
+        See hdf_lod for details.
+        """
+        self.flush()
+        if ds_url is None:
+            return hdf_lod.build_all(self.hf.hf)
+        return hdf_lod.build_pyramid(self.hf.hf, ds_url)
 
     def close_file(self):
-        self.hf.close_file()
+        try:
+            if self.writer is not None:
+                self.hf.writer = None
+                self.writer.close()
+            if qkit.cfg.get('h5_lod_pyramid', False) and self.hf.hf.mode != 'r' and not self.hf.hf.swmr_mode:
+                self.hf.flush_buffers(trim=True)
+                hdf_lod.build_all(self.hf.hf)
+        finally:
+            self.hf.close_file()
     def close(self):
-        self.hf.close_file()
+        self.close_file()